@@ -0,0 +1,194 @@
+import argparse
+import contextlib
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path[:0] = [os.path.join(ROOT, "docs_parser"), os.path.join(ROOT, "html_parser")]
+
+import samples  # noqa: E402
+from local_server import article_urls, start_server, stop_server  # noqa: E402
+
+SIZES = [10, 100, 400]
+PARAGRAPHS_PER_PAGE = 10
+SPIRE_PARAGRAPH_LIMIT = 450
+
+# Имя случая -> (модуль, функция)
+TARGETS = {
+    "pdf": ("pdf_parser", "extract_text_from_pdf"),
+    "docx": ("docx_parser", "extract_text_from_docx"),
+    "doc": ("doc_parser", "extract_text_from_doc"),
+    "djvu": ("djvu_parser", "parse_djvu"),
+    "html": ("gazeta_parser", "parse_one_link"),
+}
+
+
+def peak_rss_mb():
+    # ru_maxrss в Linux наследуется от родителя через fork/exec, а VmHWM - нет
+    if os.path.exists("/proc/self/status"):
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS отдает байты, остальные - килобайты
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def run_case(target: str, inputs: list, repeat: int):
+    """Выполняется в отдельном процессе, чтобы пик RSS относился к одному случаю."""
+    import importlib
+
+    module_name, func_name = TARGETS[target]
+    func = getattr(importlib.import_module(module_name), func_name)
+    baseline_rss = peak_rss_mb()
+
+    latencies = []
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        for _ in range(repeat):
+            start = time.perf_counter()
+            for item in inputs:
+                if func(item) is None:
+                    raise RuntimeError(f"{func_name}({item!r}) вернул None")
+            latencies.append(time.perf_counter() - start)
+
+    return {"latencies": latencies, "baseline_rss_mb": baseline_rss, "peak_rss_mb": peak_rss_mb()}
+
+
+def measure(target: str, size: int, inputs: list, units: int, size_bytes: int, repeat: int):
+    # Свежий процесс на каждый случай: импорты и пик памяти не переходят между случаями
+    spawn = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=1, mp_context=spawn) as executor:
+        result = executor.submit(run_case, target, inputs, repeat).result()
+    median = statistics.median(result["latencies"])
+    return {
+        "case": target,
+        "size": size,
+        "units": units,
+        "bytes": size_bytes,
+        "repeat": repeat,
+        "latency_min_s": min(result["latencies"]),
+        "latency_median_s": median,
+        "units_per_s": units / median,
+        "mb_per_s": size_bytes / (1024 * 1024) / median,
+        "baseline_rss_mb": result["baseline_rss_mb"],
+        "peak_rss_mb": result["peak_rss_mb"],
+    }
+
+
+def document_cases(sizes, tmp_dir: str):
+    # (случай, размер, путь, единиц: страниц или абзацев)
+    for size in sizes:
+        path = os.path.join(tmp_dir, f"{size}.pdf")
+        samples.make_pdf(path, size)
+        yield "pdf", size, path, size
+
+        paragraphs = size * PARAGRAPHS_PER_PAGE
+        path = os.path.join(tmp_dir, f"{size}.docx")
+        samples.make_docx(path, paragraphs)
+        yield "docx", size, path, paragraphs
+
+        paragraphs = min(paragraphs, SPIRE_PARAGRAPH_LIMIT)
+        path = os.path.join(tmp_dir, f"{size}.doc")
+        samples.make_doc(path, paragraphs)
+        yield "doc", size, path, paragraphs
+
+        if samples.can_make_djvu() and shutil.which("ddjvu") and shutil.which("tesseract"):
+            path = os.path.join(tmp_dir, f"{size}.djvu")
+            samples.make_djvu(path, size)
+            yield "djvu", size, path, size
+
+
+def run_suite(sizes, repeat: int, targets):
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for target, size, path, units in document_cases(sizes, tmp_dir):
+            if target in targets:
+                size_bytes = os.path.getsize(path)
+                results.append(measure(target, size, [path], units, size_bytes, repeat))
+                print_result(results[-1])
+
+    if "html" in targets:
+        server, base_url = start_server()
+        try:
+            for size in sizes:
+                urls = article_urls(base_url, size)
+                size_bytes = sum(len(requests_get(url)) for url in urls)
+                results.append(measure("html", size, urls, size, size_bytes, repeat))
+                print_result(results[-1])
+        finally:
+            stop_server(server)
+    return results
+
+
+def requests_get(url: str):
+    import requests
+
+    return requests.get(url).content
+
+
+def print_result(result: dict):
+    print(
+        f"{result['case']:>5} size={result['size']:<5} "
+        f"median {result['latency_median_s'] * 1000:9.1f} мс  "
+        f"{result['units_per_s']:9.1f} ед/с  {result['mb_per_s']:7.2f} МБ/с  "
+        f"пик RSS {result['peak_rss_mb']:.0f} МБ"
+    )
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(previous_path: str, results: list):
+    with open(previous_path, encoding="utf-8") as f:
+        previous = json.load(f)
+    before = {(row["case"], row["size"]): row for row in previous["results"]}
+    print(f"Сравнение с {previous.get('commit') or previous_path}:")
+    for row in results:
+        old = before.get((row["case"], row["size"]))
+        if old is None:
+            continue
+        latency = row["latency_median_s"] / old["latency_median_s"] - 1
+        rss = row["peak_rss_mb"] - old["peak_rss_mb"]
+        print(f"{row['case']:>5} size={row['size']:<5} время {latency:+.1%}, пик RSS {rss:+.0f} МБ")
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Бенчмарк экстракторов и краулера")
+    arg_parser.add_argument("--sizes", type=int, nargs="+", default=SIZES)
+    arg_parser.add_argument("--repeat", type=int, default=3)
+    arg_parser.add_argument("--only", action="append", choices=sorted(TARGETS))
+    arg_parser.add_argument("-o", "--output", default="benchmark_results.json")
+    arg_parser.add_argument("--compare", help="JSON предыдущего прогона")
+    args = arg_parser.parse_args()
+
+    results = run_suite(args.sizes, args.repeat, args.only or list(TARGETS))
+    report = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "results": results,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"Результаты записаны в {args.output}")
+
+    if args.compare:
+        compare(args.compare, results)
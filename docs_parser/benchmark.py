@@ -0,0 +1,419 @@
+import argparse
+import difflib
+import multiprocessing
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+import fitz
+import pytesseract
+from PIL import Image
+
+from budget import extract_within_budget
+from djvu_parser import (
+    BATCH_PAGES,
+    convert_djvu_to_pdf,
+    iter_djvu_pages,
+    iter_ocr_pages,
+    iter_page_pixmaps,
+    ocr_pixmap,
+)
+from ocr_profiles import PROFILES, render_page
+from pdf_parser import WINDOW_PAGES, extract_text_from_pdf
+from service import ExtractionService, ServiceClient, make_server
+from samples import make_doc, make_docx, make_large_docx, make_pdf, make_scanned_pdf, scanned_page_text
+
+
+def serial_baseline(pdf_path):
+    # Прежняя реализация: один поток и text += page.get_text()
+    text = ""
+    pdf_document = fitz.open(pdf_path)
+    for i in range(pdf_document.page_count):
+        text += pdf_document[i].get_text()
+    return text
+
+
+def docx_round_trip(doc_path, docx_path):
+    # Прежний путь doc_parser: сохранение в .docx и повторный разбор python-docx
+    from docx import Document as DC
+    from spire.doc import Document, FileFormat
+
+    document = Document()
+    document.LoadFromFile(doc_path)
+    document.SaveToFile(docx_path, FileFormat.Docx2016)
+    document.Close()
+    return "\n".join(paragraph.text for paragraph in DC(docx_path).paragraphs)
+
+
+def png_pipeline(pdf_path, image_dir, ocr):
+    # Прежний путь djvu_parser: PNG на диск, затем чтение обратно
+    texts = []
+    doc = fitz.open(pdf_path)
+    for page_num in range(doc.page_count):
+        pixmap = doc.load_page(page_num).get_pixmap()
+        image_path = f"{image_dir}/page_{page_num}.png"
+        Image.frombytes("RGB", [pixmap.width, pixmap.height], pixmap.samples).save(image_path)
+        image = Image.open(image_path)
+        image.load()
+        if ocr:
+            texts.append(pytesseract.image_to_string(image))
+        os.remove(image_path)
+    doc.close()
+    return "".join(texts)
+
+
+def memory_pipeline(pdf_path, ocr):
+    texts = []
+    for pixmap in iter_page_pixmaps(pdf_path):
+        if ocr:
+            texts.append(ocr_pixmap(pixmap))
+        else:
+            pixmap.tobytes("ppm")
+    return "".join(texts)
+
+
+def timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def bench_pdf(pages: int, workers: int, chunk_size: int):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        pdf_path = os.path.join(tmp_dir, "large.pdf")
+        make_pdf(pdf_path, pages)
+
+        expected, serial_time = timed(serial_baseline, pdf_path)
+        text, parallel_time = timed(
+            extract_text_from_pdf, pdf_path, workers=workers, chunk_size=chunk_size
+        )
+        assert text == expected
+
+    print(f"PDF, страниц: {pages}")
+    print(f"  последовательно: {serial_time:.2f} с ({pages / serial_time:.0f} стр/с)")
+    print(
+        f"  {workers} процессов, по {chunk_size} стр.: {parallel_time:.2f} с "
+        f"({pages / parallel_time:.0f} стр/с), ускорение x{serial_time / parallel_time:.1f}"
+    )
+
+
+def bench_ocr_input(pages: int):
+    ocr = shutil.which(pytesseract.pytesseract.tesseract_cmd) is not None
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        pdf_path = os.path.join(tmp_dir, "scanned.pdf")
+        make_scanned_pdf(pdf_path, pages)
+
+        png_text, png_time = timed(png_pipeline, pdf_path, tmp_dir, ocr)
+        memory_text, memory_time = timed(memory_pipeline, pdf_path, ocr)
+
+    stage = "рендер + OCR" if ocr else "рендер и передача в OCR (tesseract не найден)"
+    print(f"Скан, страниц: {pages}, {stage}")
+    print(f"  через PNG на диске: {png_time:.2f} с ({pages / png_time:.1f} стр/с)")
+    print(
+        f"  в памяти: {memory_time:.2f} с ({pages / memory_time:.1f} стр/с), "
+        f"ускорение x{png_time / memory_time:.1f}"
+    )
+    if ocr and png_text.split() != memory_text.split():
+        print("  внимание: тексты различаются")
+
+
+def bench_doc(paragraphs: int):
+    from doc_parser import iter_doc_paragraphs
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        doc_path = os.path.join(tmp_dir, "large.doc")
+        make_doc(doc_path, paragraphs)
+
+        _, round_trip_time = timed(docx_round_trip, doc_path, os.path.join(tmp_dir, "ToDocx.docx"))
+        _, memory_time = timed(list, iter_doc_paragraphs(doc_path))
+
+    print(f"DOC, абзацев: {paragraphs}")
+    print(f"  через ToDocx.docx: {round_trip_time:.2f} с")
+    print(f"  модель Spire в памяти: {memory_time:.2f} с, ускорение x{round_trip_time / memory_time:.1f}")
+
+
+def peak_rss_mb():
+    # Пик резидентной памяти процесса (Linux), иначе 0
+    if not os.path.exists("/proc/self/status"):
+        return 0.0
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def count_docx_paragraphs(func_name: str, path: str):
+    import docx_parser
+
+    start = time.perf_counter()
+    count = sum(1 for _ in getattr(docx_parser, func_name)(path))
+    return count, time.perf_counter() - start, peak_rss_mb()
+
+
+def bench_docx(paragraphs: int):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        docx_path = os.path.join(tmp_dir, "large.docx")
+        make_large_docx(docx_path, paragraphs)
+        with zipfile.ZipFile(docx_path) as archive:
+            xml_megabytes = archive.getinfo("word/document.xml").file_size / (1024 * 1024)
+
+        print(f"DOCX, абзацев: {paragraphs}, document.xml {xml_megabytes:.0f} МБ")
+        # Каждый способ в свежем процессе, чтобы пик памяти не смешивался
+        spawn = multiprocessing.get_context("spawn")
+        for name, func_name in [("python-docx", "iter_docx_paragraphs"), ("iterparse", "iter_docx_text")]:
+            with ProcessPoolExecutor(max_workers=1, mp_context=spawn) as executor:
+                count, seconds, peak = executor.submit(count_docx_paragraphs, func_name, docx_path).result()
+            print(
+                f"  {name}: {seconds:.2f} с ({xml_megabytes / seconds:.1f} МБ/с), "
+                f"абзацев {count}, пик RSS {peak:.0f} МБ"
+            )
+
+
+def run_ocr_pages(pages):
+    start = time.perf_counter()
+    results = list(pages)
+    total = time.perf_counter() - start
+    render = sum(page["render_seconds"] for page in results)
+    ocr = sum(page["ocr_seconds"] for page in results)
+    return results, total, render, ocr
+
+
+def bench_ocr_pool(pages: int, workers: int, max_in_flight: int, djvu_file: str = None):
+    if shutil.which(pytesseract.pytesseract.tesseract_cmd) is None:
+        print("Пул OCR: tesseract не найден, пропуск")
+        return
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        if djvu_file:
+            name = djvu_file
+            run = partial(iter_djvu_pages, djvu_file, max_in_flight=max_in_flight)
+        else:
+            name = f"скан, страниц: {pages}"
+            pdf_path = os.path.join(tmp_dir, "scanned.pdf")
+            make_scanned_pdf(pdf_path, pages)
+            run = partial(iter_ocr_pages, pdf_path, max_in_flight=max_in_flight)
+
+        serial, serial_time, render, ocr = run_ocr_pages(run(1))
+        pooled, pooled_time, _, _ = run_ocr_pages(run(workers))
+    assert [page["text"] for page in serial] == [page["text"] for page in pooled]
+
+    count = len(serial)
+    print(f"Пул OCR, {name}")
+    print(
+        f"  на страницу: рендер {render / count * 1000:.0f} мс, OCR {ocr / count * 1000:.0f} мс"
+    )
+    print(f"  последовательно: {serial_time:.2f} с ({count / serial_time:.2f} стр/с)")
+    print(
+        f"  {workers} процессов: {pooled_time:.2f} с ({count / pooled_time:.2f} стр/с), "
+        f"ускорение x{serial_time / pooled_time:.1f}"
+    )
+
+
+def first_and_total(pages):
+    # Время до первой страницы и до последней
+    start = time.perf_counter()
+    first = None
+    count = 0
+    for _ in pages:
+        count += 1
+        if first is None:
+            first = time.perf_counter() - start
+    return count, first, time.perf_counter() - start
+
+
+def convert_then_ocr(djvu_file: str, workers: int):
+    # Прежний порядок: весь документ через ddjvu, только потом рендер и OCR
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        pdf_path = os.path.join(tmp_dir, "converted.pdf")
+        convert_djvu_to_pdf(djvu_file, pdf_path)
+        yield from iter_ocr_pages(pdf_path, workers)
+
+
+def bench_djvu_pipeline(djvu_file: str, workers: int, batch_pages: int):
+    tools = [pytesseract.pytesseract.tesseract_cmd, "ddjvu", "djvused"]
+    if not djvu_file or any(shutil.which(tool) is None for tool in tools):
+        print("Конвейер DJVU: нужен --djvu и установленные tesseract и djvulibre, пропуск")
+        return
+
+    print(f"Конвейер DJVU, {djvu_file}, {workers} потоков OCR")
+    runs = [
+        ("ddjvu целиком, затем OCR", convert_then_ocr(djvu_file, workers)),
+        (
+            f"конвейер по {batch_pages} стр.",
+            iter_djvu_pages(djvu_file, workers, text_layer=False, batch_pages=batch_pages),
+        ),
+    ]
+    for name, pages in runs:
+        count, first, total = first_and_total(pages)
+        print(f"  {name}: первая страница через {first:.2f} с, все {count} за {total:.2f} с")
+
+
+def bench_service(documents: int, workers: int):
+    # Накладные расходы на документ: новый процесс на файл против прогретого сервиса
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        paths = []
+        for num in range(documents):
+            path = os.path.join(tmp_dir, f"small_{num}" + (".pdf" if num % 2 else ".docx"))
+            make_pdf(path, 1) if num % 2 else make_docx(path, 5)
+            paths.append(path)
+
+        cold = paths[:10]
+        code = "import sys; from dispatcher import extract; extract(sys.argv[1])"
+        here = os.path.dirname(os.path.abspath(__file__))
+        start = time.perf_counter()
+        for path in cold:
+            subprocess.run([sys.executable, "-c", code, path], cwd=here, check=True)
+        cold_time = (time.perf_counter() - start) / len(cold)
+
+        start = time.perf_counter()
+        service = ExtractionService(workers)
+        startup = time.perf_counter() - start
+        server = make_server(service, port=0)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        client = ServiceClient(port=server.server_address[1])
+        try:
+            start = time.perf_counter()
+            for path in paths:
+                client.extract(path)
+            single_time = (time.perf_counter() - start) / len(paths)
+
+            start = time.perf_counter()
+            for first in range(0, len(paths), service.max_pending):
+                client.extract_batch(paths[first:first + service.max_pending])
+            batch_time = (time.perf_counter() - start) / len(paths)
+        finally:
+            client.close()
+            server.shutdown()
+            server.server_close()
+            service.close()
+
+    print(f"Сервис, маленьких документов: {documents} (pdf в 1 стр. и docx в 5 абзацев)")
+    print(f"  новый процесс на файл: {cold_time * 1000:.0f} мс/док")
+    print(f"  запуск сервиса ({workers} процессов): {startup:.2f} с")
+    print(f"  сервис, по одному: {single_time * 1000:.1f} мс/док")
+    print(f"  сервис, пакетами: {batch_time * 1000:.1f} мс/док")
+
+
+def budget_run(pdf_path: str, window: int, max_seconds: float):
+    start = time.perf_counter()
+    result = extract_within_budget(pdf_path, window=window, max_seconds=max_seconds)
+    seconds = time.perf_counter() - start
+    return result["pages"], result["stopped"], seconds, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def bench_budget(pages: int, window: int):
+    # Пиковая память процесса на большом pdf: каждый прогон - в свежем процессе
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        pdf_path = os.path.join(tmp_dir, "huge.pdf")
+        make_pdf(pdf_path, pages)
+
+        print(f"Окна страниц и бюджеты, pdf, страниц: {pages}")
+        runs = [
+            ("без окон", pages, None),
+            (f"окна по {window} стр.", window, None),
+            (f"окна по {window} стр., бюджет 0.5 с", window, 0.5),
+        ]
+        context = multiprocessing.get_context("spawn")
+        for name, run_window, max_seconds in runs:
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                done, stopped, seconds, peak = executor.submit(budget_run, pdf_path, run_window, max_seconds).result()
+            note = f", остановлено: {stopped}" if stopped else ""
+            print(f"  {name}: {done} стр. за {seconds:.2f} с, пик памяти {peak:.0f} МБ{note}")
+
+
+def char_accuracy(reference: str, text: str):
+    # 1 - (замены + вставки + удаления) / длина эталона; пробелы не учитываются
+    reference = " ".join(reference.split())
+    text = " ".join(text.split())
+    matcher = difflib.SequenceMatcher(None, reference, text, autojunk=False)
+    errors = sum(
+        max(ref_end - ref_start, text_end - text_start)
+        for tag, ref_start, ref_end, text_start, text_end in matcher.get_opcodes()
+        if tag != "equal"
+    )
+    return max(0.0, 1 - errors / max(len(reference), 1))
+
+
+def bench_profile_render(pdf_path: str, pages: int):
+    # Без tesseract: только рендер и размер картинки, от которого зависит время OCR
+    for name in [None, *PROFILES]:
+        start = time.perf_counter()
+        pixels = 0
+        with fitz.open(pdf_path) as doc:
+            for page in doc:
+                pixmap = render_page(page, name)
+                pixels += pixmap.width * pixmap.height
+        seconds = time.perf_counter() - start
+        print(
+            f"  {name or 'без профиля':>12}: рендер {pages / seconds:.1f} стр/с, "
+            f"{pixels / pages / 1e6:.2f} Мпикс на стр."
+        )
+
+
+def bench_profiles(pages: int):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        pdf_path = os.path.join(tmp_dir, "scanned.pdf")
+        make_scanned_pdf(pdf_path, pages)
+
+        if shutil.which(pytesseract.pytesseract.tesseract_cmd) is None:
+            print(f"Профили OCR: tesseract не найден, только рендер, скан, страниц: {pages}")
+            bench_profile_render(pdf_path, pages)
+            return
+
+        print(f"Профили OCR, скан, страниц: {pages}")
+        for name in [None, *PROFILES]:
+            results, total, render, ocr = run_ocr_pages(iter_ocr_pages(pdf_path, profile=name))
+            accuracy = sum(
+                char_accuracy(scanned_page_text(page["page"]), page["text"]) for page in results
+            ) / len(results)
+            print(
+                f"  {name or 'без профиля':>12}: {len(results) / total:.2f} стр/с "
+                f"(рендер {render / len(results) * 1000:.0f} мс, OCR {ocr / len(results) * 1000:.0f} мс на стр.), "
+                f"точность по символам {accuracy:.1%}"
+            )
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("--only", action="append", choices=["pdf", "ocr", "pool", "doc", "docx", "profiles", "djvu", "service", "budget"])
+    arg_parser.add_argument("--pages", type=int, default=2000)
+    arg_parser.add_argument("--scanned-pages", type=int, default=20)
+    arg_parser.add_argument("--workers", type=int, default=os.cpu_count())
+    arg_parser.add_argument("--chunk-size", type=int, default=50)
+    arg_parser.add_argument("--max-in-flight", type=int)
+    arg_parser.add_argument("--paragraphs", type=int, default=450)
+    arg_parser.add_argument("--docx-paragraphs", type=int, default=100000)
+    arg_parser.add_argument("--djvu", help="многостраничный DJVU вместо сгенерированного скана")
+    arg_parser.add_argument("--documents", type=int, default=200, help="маленьких документов для сервиса")
+    arg_parser.add_argument("--batch-pages", type=int, default=BATCH_PAGES, help="страниц в одном вызове ddjvu")
+    arg_parser.add_argument("--window", type=int, default=WINDOW_PAGES, help="страниц pdf в одном окне")
+    args = arg_parser.parse_args()
+    benches = args.only or ["pdf", "ocr", "pool", "doc", "docx", "profiles", "djvu", "service", "budget"]
+
+    if "pdf" in benches:
+        bench_pdf(args.pages, args.workers, args.chunk_size)
+    if "ocr" in benches:
+        bench_ocr_input(args.scanned_pages)
+    if "pool" in benches:
+        bench_ocr_pool(args.scanned_pages, args.workers, args.max_in_flight, args.djvu)
+    if "doc" in benches:
+        bench_doc(args.paragraphs)
+    if "docx" in benches:
+        bench_docx(args.docx_paragraphs)
+    if "profiles" in benches:
+        bench_profiles(args.scanned_pages)
+    if "djvu" in benches:
+        bench_djvu_pipeline(args.djvu, args.workers, args.batch_pages)
+    if "service" in benches:
+        bench_service(args.documents, args.workers)
+    if "budget" in benches:
+        bench_budget(args.pages, args.window)
@@ -0,0 +1,111 @@
+import os
+import resource
+import time
+
+import metrics
+from dispatcher import detect_format, get_extractor
+from djvu_parser import BATCH_PAGES
+from pdf_parser import WINDOW_PAGES
+
+# Как называется размер окна у потокового экстрактора формата
+WINDOW_OPTIONS = {"pdf": "window", "djvu": "batch_pages"}
+# Окно по умолчанию в extract_within_budget: у ddjvu свое, меньшее
+WINDOW_DEFAULTS = {"pdf": WINDOW_PAGES, "djvu": BATCH_PAGES}
+
+
+def rss_mb():
+    # Текущая резидентная память процесса; без /proc - пик за все время
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class DocumentBudget:
+    """Ограничения на один документ: время и прирост памяти процесса.
+
+    Проверяется между страницами, поэтому одна огромная страница может выйти
+    за бюджет; от зависания на одной странице защищает тайм-аут ingest.
+    """
+
+    def __init__(self, max_seconds: float = None, max_memory_mb: float = None):
+        self.max_seconds = max_seconds
+        self.max_memory_mb = max_memory_mb
+        self.start()
+
+    def start(self):
+        self.started = time.perf_counter()
+        self.baseline_mb = rss_mb() if self.max_memory_mb else 0.0
+        self.stopped = None
+
+    def exceeded(self):
+        # Причина остановки: "time", "memory" или None
+        if self.max_seconds is not None and time.perf_counter() - self.started > self.max_seconds:
+            return "time"
+        if self.max_memory_mb is not None and rss_mb() - self.baseline_mb > self.max_memory_mb:
+            return "memory"
+        return None
+
+
+def iter_within_budget(units, budget: DocumentBudget):
+    """Части документа, пока бюджет не исчерпан; причина остановки - в ``budget.stopped``.
+
+    Бюджет проверяется перед выдачей каждой части после первой: документ,
+    дочитанный до конца, не считается частичным, даже если бюджет исчерпан
+    на последней странице. Источник закрывается сразу, чтобы освободить его
+    память и временные файлы.
+    """
+    try:
+        for num, unit in enumerate(units):
+            if num:
+                budget.stopped = budget.exceeded()
+                if budget.stopped:
+                    metrics.inc("budget_stops", reason=budget.stopped)
+                    return
+            yield unit
+    finally:
+        close = getattr(units, "close", None)
+        if close:
+            close()
+
+
+def window_options(format: str, window: int):
+    name = WINDOW_OPTIONS.get(format)
+    return {name: window} if name and window else {}
+
+
+def extract_within_budget(
+    source,
+    format: str = None,
+    window: int = None,
+    max_seconds: float = None,
+    max_memory_mb: float = None,
+    **options,
+):
+    """Текст документа окнами страниц в пределах бюджета времени и памяти.
+
+    Возвращает {"format", "text", "units", "pages", "complete", "stopped"}:
+    при превышении бюджета ``complete`` = False, а в ``text`` - все, что
+    успели извлечь, ``stopped`` - "time" или "memory". Без ``window`` окно
+    берется из WINDOW_DEFAULTS для формата документа.
+    """
+    format = detect_format(source, format)
+    window = window or WINDOW_DEFAULTS.get(format)
+    iter_units, separator = get_extractor(format)
+    budget = DocumentBudget(max_seconds, max_memory_mb)
+    units = iter_units(source, **window_options(format, window), **options)
+
+    texts = []
+    pages = 0
+    for unit in iter_within_budget(units, budget):
+        texts.append(unit["text"])
+        pages += "page" in unit
+    return {
+        "format": format,
+        "text": separator.join(texts),
+        "units": len(texts),
+        "pages": pages,
+        "complete": budget.stopped is None,
+        "stopped": budget.stopped,
+    }
@@ -0,0 +1,169 @@
+import functools
+import hashlib
+import inspect
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import metrics
+from sources import BUFFER_TYPES, is_path
+
+CACHE_ENV = "DOCS_PARSER_CACHE"
+MAX_BYTES = 1024 * 1024 * 1024
+READ_CHUNK = 1024 * 1024
+
+_cache = None
+
+
+class ExtractionCache:
+    """Кэш извлеченного текста в SQLite с вытеснением давно не читанных записей."""
+
+    def __init__(self, path: str, max_bytes: int = MAX_BYTES):
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, used INTEGER NOT NULL)"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS entries_used ON entries (used)")
+        self.db.commit()
+
+    def get(self, key: str):
+        with self.lock:
+            row = self.db.execute("SELECT value FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.db.execute("UPDATE entries SET used = ? WHERE key = ?", (time.time_ns(), key))
+            self.db.commit()
+            return row[0]
+
+    def put(self, key: str, value: str):
+        size = len(value.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            self.db.execute(
+                "INSERT OR REPLACE INTO entries (key, value, size, used) VALUES (?, ?, ?, ?)",
+                (key, value, size, time.time_ns()),
+            )
+            self._evict()
+            self.db.commit()
+
+    def _evict(self):
+        total = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        rows = self.db.execute("SELECT key, size FROM entries ORDER BY used")
+        evicted = []
+        for key, size in rows:
+            if total <= self.max_bytes:
+                break
+            evicted.append((key,))
+            total -= size
+        self.db.executemany("DELETE FROM entries WHERE key = ?", evicted)
+
+    def stats(self):
+        with self.lock:
+            entries, size = self.db.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries"
+            ).fetchone()
+        return {"hits": self.hits, "misses": self.misses, "entries": entries, "bytes": size}
+
+    def clear(self):
+        with self.lock:
+            self.db.execute("DELETE FROM entries")
+            self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+
+def enable_cache(path: str, max_bytes: int = MAX_BYTES):
+    global _cache
+    disable_cache()
+    _cache = ExtractionCache(path, max_bytes)
+    return _cache
+
+
+def disable_cache():
+    global _cache
+    if _cache is not None:
+        _cache.close()
+    _cache = None
+
+
+def get_cache():
+    # Кэш включается вызовом enable_cache или переменной окружения DOCS_PARSER_CACHE
+    if _cache is None and os.environ.get(CACHE_ENV):
+        enable_cache(os.environ[CACHE_ENV])
+    return _cache
+
+
+def file_digest(path) -> str:
+    # path - путь, байты или двоичный поток; позиция потока сохраняется
+    digest = hashlib.sha256()
+    if isinstance(path, BUFFER_TYPES):
+        digest.update(path)
+    elif is_path(path):
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(READ_CHUNK), b""):
+                digest.update(chunk)
+    else:
+        position = path.tell()
+        for chunk in iter(lambda: path.read(READ_CHUNK), b""):
+            digest.update(chunk)
+        path.seek(position)
+    return digest.hexdigest()
+
+
+def make_key(path, extractor: str, version: str, options: dict) -> str:
+    options = json.dumps(options, sort_keys=True, default=str)
+    return f"{file_digest(path)}:{extractor}:{version}:{options}"
+
+
+def cached(extractor: str, version: str, ignore=()):
+    """Кэширует результат экстрактора по содержимому файла, версии и опциям.
+
+    Параметры из ``ignore`` не влияют на результат (например, число процессов)
+    и в ключ не входят.
+    """
+
+    def decorator(func):
+        signature = inspect.signature(func)
+
+        @functools.wraps(func)
+        def wrapper(path, *args, **kwargs):
+            cache = get_cache()
+            if cache is None:
+                return func(path, *args, **kwargs)
+
+            bound = signature.bind(path, *args, **kwargs)
+            bound.apply_defaults()
+            options = dict(list(bound.arguments.items())[1:])
+            for name in ignore:
+                options.pop(name, None)
+            try:
+                key = make_key(path, extractor, version, options)
+            except OSError:
+                return func(path, *args, **kwargs)
+
+            text = cache.get(key)
+            metrics.inc("cache_misses" if text is None else "cache_hits", extractor=extractor)
+            if text is None:
+                text = func(path, *args, **kwargs)
+                if text is not None:
+                    cache.put(key, text)
+            return text
+
+        return wrapper
+
+    return decorator
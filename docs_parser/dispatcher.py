@@ -0,0 +1,184 @@
+import codecs
+import importlib
+import json
+import os
+import zipfile
+
+import metrics
+from cache import get_cache, make_key
+from sources import as_file, is_path
+
+OLE2_MAGIC = b"\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1"
+SNIFF_BYTES = 1024
+# Параметры экстракторов, которые не меняют текст, а только скорость и память
+IGNORED_OPTIONS = ("workers", "max_in_flight", "window", "batch_pages")
+
+# Имя формата -> модуль и потоковый экстрактор, разделитель частей,
+# расширения файлов, проверка сигнатуры по первым байтам и версия
+# для ключа кэша (повышается, когда меняется текст на выходе экстрактора).
+# Модуль импортируется только при первом документе своего формата.
+FORMATS = {}
+
+
+def register(name: str, module: str, func: str, separator: str = "", extensions=(), version: str = "1"):
+    def decorator(sniff):
+        FORMATS[name] = {
+            "module": module,
+            "func": func,
+            "separator": separator,
+            "extensions": tuple(extensions),
+            "sniff": sniff,
+            "version": version,
+        }
+        return sniff
+
+    return decorator
+
+
+@register("djvu", "djvu_parser", "iter_djvu_pages", extensions=(".djvu", ".djv"))
+def is_djvu(header: bytes, source):
+    return header.startswith(b"AT&TFORM") and header[12:16] in (b"DJVU", b"DJVM")
+
+
+@register("docx", "docx_parser", "iter_docx_text", "\n", extensions=(".docx",))
+def is_docx(header: bytes, source):
+    if not header.startswith(b"PK\x03\x04"):
+        return False
+    try:
+        with zipfile.ZipFile(source) as archive:
+            return "word/document.xml" in archive.namelist()
+    except (OSError, zipfile.BadZipFile):
+        return False
+
+
+@register("doc", "doc_parser", "iter_doc_paragraphs", "\n", extensions=(".doc",))
+def is_doc(header: bytes, source):
+    # Контейнер OLE2: так же выглядят .xls и .ppt, отличить их можно только разбором
+    return header.startswith(OLE2_MAGIC)
+
+
+# Проверяется последним: "%PDF-" встречается и внутри docx или doc со
+# встроенным PDF, поэтому сначала сигнатуры контейнеров
+@register("pdf", "pdf_parser", "iter_pdf_pages", extensions=(".pdf",))
+def is_pdf(header: bytes, source):
+    # Перед сигнатурой допускаются только BOM и пробельные символы
+    return header.removeprefix(codecs.BOM_UTF8).lstrip().startswith(b"%PDF-")
+
+
+def format_from_extension(path: str):
+    extension = os.path.splitext(path)[1].lower()
+    for name, entry in FORMATS.items():
+        if extension in entry["extensions"]:
+            return name
+    return None
+
+
+def sniff_format(source):
+    """Формат документа по сигнатуре: путь, bytes или двоичный поток.
+
+    None, если сигнатура не узнана; позиция потока не меняется.
+    """
+    source = as_file(source)
+    if is_path(source):
+        with open(source, "rb") as f:
+            header = f.read(SNIFF_BYTES)
+    else:
+        position = source.tell()
+        header = source.read(SNIFF_BYTES)
+
+    try:
+        for name, entry in FORMATS.items():
+            if entry["sniff"](header, source):
+                return name
+        return None
+    finally:
+        if not is_path(source):
+            source.seek(position)
+
+
+def get_extractor(name: str):
+    entry = FORMATS[name]
+    module = importlib.import_module(entry["module"])
+    return getattr(module, entry["func"]), entry["separator"]
+
+
+def detect_format(source, format: str = None):
+    # Явный формат, затем сигнатура, затем расширение имени файла
+    if format is not None:
+        return format
+    detected = sniff_format(source)
+    if detected is None and is_path(source):
+        detected = format_from_extension(os.fspath(source))
+    if detected is None:
+        raise ValueError("Неизвестный формат документа")
+    return detected
+
+
+def iter_extract(source, format: str = None, **options):
+    """Части документа ({"page": ...} или {"paragraph": ...}) из подходящего экстрактора.
+
+    ``source`` - путь, байты (bytes, memoryview, mmap) или двоичный поток.
+    Параметры ``options`` передаются экстрактору как есть, например
+    ``profile`` для DJVU. Части читаются потоково и не кэшируются: кэш
+    хранит текст документа целиком, см. extract_record.
+    """
+    format = detect_format(source, format)
+    iter_units, _ = get_extractor(format)
+    yield from iter_units(source, **options)
+
+
+def collect_units(units, separator: str):
+    texts = []
+    pages = 0
+    for unit in units:
+        texts.append(unit["text"])
+        pages += "page" in unit
+    return {"text": separator.join(texts), "pages": pages, "units": len(texts)}
+
+
+def record_key(source, format: str, options: dict):
+    # Ключ кэша для текста документа целиком; None, если кэш выключен
+    if get_cache() is None:
+        return None
+    options = {name: value for name, value in options.items() if name not in IGNORED_OPTIONS}
+    try:
+        return make_key(source, f"extract-{format}", FORMATS[format]["version"], options)
+    except OSError:
+        return None
+
+
+def load_record(key: str, format: str):
+    # {"text", "pages", "units"} из кэша или None
+    cache = get_cache()
+    if key is None or cache is None:
+        return None
+    value = cache.get(key)
+    metrics.inc("cache_misses" if value is None else "cache_hits", extractor=f"extract-{format}")
+    return json.loads(value) if value is not None else None
+
+
+def save_record(key: str, record: dict):
+    cache = get_cache()
+    if key is not None and cache is not None:
+        cache.put(key, json.dumps(record, ensure_ascii=False))
+
+
+def extract_record(source, format: str = None, **options):
+    """{"format", "text", "pages", "units"} документа, через кэш, если он включен.
+
+    Ключ кэша - содержимое документа, формат и ``options``, кроме тех, что
+    влияют только на скорость (IGNORED_OPTIONS).
+    """
+    format = detect_format(source, format)
+    key = record_key(source, format, options)
+    record = load_record(key, format)
+    if record is None:
+        iter_units, separator = get_extractor(format)
+        record = collect_units(iter_units(source, **options), separator)
+        save_record(key, record)
+    return {"format": format, **record}
+
+
+def extract(source, format: str = None, **options):
+    # Текст документа целиком; кэшируется, как и в extract_record
+    return extract_record(source, format, **options)["text"]
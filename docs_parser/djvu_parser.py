@@ -1,77 +1,398 @@
+import codecs
 import subprocess
-import fitz
 import os
-import pytesseract
-from PIL import Image
+import re
+import shlex
+import shutil
+import tempfile
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from queue import Empty, Full, Queue
 
+import metrics
+from cache import cached
+from ocr_profiles import ddjvu_quality, render_page, tesseract_options
+from sources import as_bytes, is_path, open_pdf
 
-def convert_djvu_to_pdf(djvu_file_path, pdf_file_path):
-    process = subprocess.Popen(
-        ["ddjvu", "-format=pdf", "-quality=85", djvu_file_path, pdf_file_path],
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-    )
-    stdout, stderr = process.communicate()
+# Страниц в одном вызове ddjvu и сколько готовых PDF может ждать рендера
+BATCH_PAGES = 16
+PREFETCH_BATCHES = 2
+# Страница в выводе djvutxt --detail=page; без текстового слоя - ()
+PAGE_SEXP_RE = re.compile(rb'\(\s*(?:page\s[^"()]*"((?:[^"\\]|\\.)*)"\s*)?\)', re.S)
+
+_worker_doc = None
+_worker_profile = None
+
+
+def page_spec(page_nums):
+    # [0, 1, 2, 5] -> "1-3,6": диапазоны страниц для ddjvu -page, нумерация с 1
+    ranges = []
+    for page_num in page_nums:
+        if ranges and ranges[-1][1] == page_num:
+            ranges[-1][1] = page_num + 1
+        else:
+            ranges.append([page_num + 1, page_num + 1])
+    return ",".join(str(first) if first == last else f"{first}-{last}" for first, last in ranges)
+
+
+def convert_djvu_to_pdf(djvu_file_path, pdf_file_path, profile=None, page_nums=None):
+    cmd_args = ["ddjvu", "-format=pdf", f"-quality={ddjvu_quality(profile)}"]
+    if page_nums is not None:
+        cmd_args.append(f"-page={page_spec(page_nums)}")
+    with metrics.timer("stage", format="djvu", stage="ddjvu"):
+        process = subprocess.Popen(
+            cmd_args + [djvu_file_path, pdf_file_path],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+        stdout, stderr = process.communicate()
 
     if stderr:
         print(f"Ошибка конвертирования: {stderr.decode('utf-8')}")
 
 
-def convert_pdf_to_images(pdf_file):
-    doc = fitz.open(pdf_file)
+def djvu_page_count(filename):
+    # None, если djvused нет или файл не читается
+    if shutil.which("djvused") is None:
+        return None
+    count = subprocess.run(["djvused", "-e", "n", filename], capture_output=True, text=True)
+    if count.returncode:
+        return None
+    return int(count.stdout)
 
-    tmp_img_dir = "tmp_images"
-    if not os.path.exists(tmp_img_dir):
-        os.makedirs(tmp_img_dir)
 
-    image_paths = []
+def parse_page_texts(output: bytes):
+    """Тексты страниц из вывода ``djvutxt --detail=page``.
 
-    for page_num in range(doc.page_count):
-        page = doc.load_page(page_num)
-        image_path = f"{tmp_img_dir}/page_{page_num}.png"
-        image_paths.append(image_path)
+    Страница там - S-выражение (page x0 y0 x1 y1 "текст") со строкой в
+    экранировании C, страница без текста может выводиться как ().
+    """
+    return [codecs.escape_decode(text)[0].decode("utf-8", "replace") for text in PAGE_SEXP_RE.findall(output)]
 
-        pixmap = page.get_pixmap()
 
-        img_data = pixmap.samples
+def read_text_layer(filename):
+    """Скрытый текстовый слой DJVU постранично (djvused и djvutxt из djvulibre).
 
-        image = Image.frombytes("RGB", [pixmap.width, pixmap.height], img_data)
-        image.save(image_path)
+    Возвращает список текстов страниц или None, если утилит нет или файл не читается.
+    """
+    if shutil.which("djvutxt") is None:
+        return None
+    with metrics.timer("stage", format="djvu", stage="text_layer"):
+        count = djvu_page_count(filename)
+        if count is None:
+            return None
+        # Весь документ одним процессом, а не djvutxt --page на каждую страницу
+        process = subprocess.run(["djvutxt", "--detail=page", filename], capture_output=True)
+        if process.returncode:
+            return None
+        texts = parse_page_texts(process.stdout)
+        if len(texts) != count:
+            # Разбивка не сошлась с числом страниц: надежнее постранично
+            texts = []
+            for page_num in range(1, count + 1):
+                page = subprocess.run(["djvutxt", f"--page={page_num}", filename], capture_output=True)
+                if page.returncode:
+                    return None
+                texts.append(page.stdout.decode("utf-8", "replace"))
+    return texts
 
-    doc.close()
 
-    return image_paths
+def iter_page_pixmaps(pdf_file):
+    with open_pdf(pdf_file) as doc:
+        for page_num in range(doc.page_count):
+            yield doc.load_page(page_num).get_pixmap()
 
 
-def extract_text_from_images(image_paths):
-    extracted_text = ""
+def ocr_pixmap(pixmap, lang=None, config=""):
+    # Несжатый PPM уходит в tesseract через stdin, без PNG и временных файлов
+    import pytesseract
 
-    for image_path in image_paths:
-        image = Image.open(image_path)
-        text = pytesseract.image_to_string(image)
-        extracted_text += text
+    cmd_args = [pytesseract.pytesseract.tesseract_cmd, "stdin", "stdout"]
+    if lang is not None:
+        cmd_args += ["-l", lang]
+    if config:
+        cmd_args += shlex.split(config)
 
-    return extracted_text
+    try:
+        process = subprocess.run(cmd_args, input=pixmap.tobytes("ppm"), capture_output=True)
+    except FileNotFoundError:
+        raise pytesseract.TesseractNotFoundError()
+    if process.returncode:
+        raise pytesseract.TesseractError(
+            process.returncode, process.stderr.decode("utf-8", "replace")
+        )
+    return process.stdout.decode("utf-8")
 
 
-def parse_djvu(filename):
+def ocr_page(doc, page_num, profile=None):
+    # Без профиля - прежние настройки: 72 dpi, RGB, tesseract по умолчанию
+    start = time.perf_counter()
+    pixmap = render_page(doc.load_page(page_num), profile)
+    rendered = time.perf_counter()
+    text = ocr_pixmap(pixmap, **tesseract_options(profile))
+    return {
+        "page": page_num,
+        "text": text,
+        "render_seconds": rendered - start,
+        "ocr_seconds": time.perf_counter() - rendered,
+    }
 
-    djvu_file_path = filename
-    pdf_file_path = "converted.pdf"
 
-    convert_djvu_to_pdf(djvu_file_path, pdf_file_path)
+def _record_ocr_page(page):
+    # Время рендера и OCR приходит вместе со страницей, в том числе из процессов пула
+    metrics.inc("pages", format="ocr")
+    metrics.observe("stage", page["render_seconds"], format="ocr", stage="render")
+    metrics.observe("stage", page["ocr_seconds"], format="ocr", stage="ocr")
+    return page
 
-    pdf_file = "converted.pdf"
 
-    image_paths = convert_pdf_to_images(pdf_file)
+def _open_worker_document(pdf_file, profile=None):
+    global _worker_doc, _worker_profile
+    _worker_doc = open_pdf(pdf_file)
+    _worker_profile = profile
 
-    extracted_text = extract_text_from_images(image_paths)
 
-    print(extracted_text)
+def _ocr_worker_page(page_num):
+    return ocr_page(_worker_doc, page_num, _worker_profile)
+
+
+def iter_ocr_pages(pdf_file, workers: int = 1, max_in_flight: int = None, page_nums=None, profile=None):
+    """Рендер и OCR страниц PDF (после ddjvu или скана) в пуле процессов.
+
+    Страницы отдаются по порядку; одновременно в работе не больше
+    ``max_in_flight`` страниц, чтобы ограничить память. ``page_nums``
+    ограничивает OCR выбранными страницами, по умолчанию - все;
+    ``profile`` - профиль из ``ocr_profiles.PROFILES`` (имя или словарь).
+    """
+    if not is_path(pdf_file):
+        pdf_file = as_bytes(pdf_file)
+    if workers == 1:
+        with open_pdf(pdf_file) as doc:
+            for page_num in range(doc.page_count) if page_nums is None else page_nums:
+                yield _record_ocr_page(ocr_page(doc, page_num, profile))
+        return
+
+    workers = workers or os.cpu_count()
+    max_in_flight = max(max_in_flight or 2 * workers, 1)
+    if page_nums is None:
+        with open_pdf(pdf_file) as doc:
+            page_nums = range(doc.page_count)
+    page_nums = iter(page_nums)
+
+    with ProcessPoolExecutor(
+        max_workers=workers, initializer=_open_worker_document, initargs=(pdf_file, profile)
+    ) as executor:
+        pending = deque()
+        try:
+            for page_num in page_nums:
+                pending.append(executor.submit(_ocr_worker_page, page_num))
+                if len(pending) >= max_in_flight:
+                    yield _record_ocr_page(pending.popleft().result())
+            while pending:
+                yield _record_ocr_page(pending.popleft().result())
+        finally:
+            for future in pending:
+                future.cancel()
+
+
+class BackgroundStage:
+    """Стадия конвейера: итератор ``items`` в отдельном потоке.
+
+    Готовые элементы ждут в очереди не больше ``maxsize`` штук, так что стадия
+    не убегает вперед потребителя. Исключение стадии пробрасывается потребителю.
+    """
+
+    def __init__(self, items, maxsize: int):
+        self.queue = Queue(maxsize)
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, args=(items,), daemon=True)
+        self.thread.start()
+
+    def _run(self, items):
+        try:
+            for item in items:
+                if not self._put((True, item)):
+                    return
+            self._put((False, None))
+        except BaseException as err:
+            self._put((False, err))
+
+    def _put(self, entry):
+        while not self.stopped.is_set():
+            try:
+                self.queue.put(entry, timeout=0.1)
+                return True
+            except Full:
+                pass
+        return False
+
+    def __iter__(self):
+        while True:
+            try:
+                ok, item = self.queue.get(timeout=0.1)
+            except Empty:
+                if not self.thread.is_alive() and self.queue.empty():
+                    return
+                continue
+            if not ok:
+                if item is not None:
+                    raise item
+                return
+            yield item
+
+    def close(self):
+        # Поток доделывает текущий элемент (например, вызов ddjvu) и выходит
+        self.stopped.set()
+        self.thread.join()
+
 
-    for image_path in image_paths:
-        os.remove(image_path)
+def iter_converted_batches(filename, page_nums, scratch_dir, profile=None, batch_pages: int = BATCH_PAGES):
+    # ddjvu по диапазонам страниц: (PDF, номера страниц DJVU в нем по порядку)
+    for start in range(0, len(page_nums), batch_pages):
+        batch = page_nums[start:start + batch_pages]
+        pdf_file_path = os.path.join(scratch_dir, f"pages_{start}.pdf")
+        convert_djvu_to_pdf(filename, pdf_file_path, profile, page_nums=batch)
+        yield pdf_file_path, batch
 
-    os.rmdir("tmp_images")
+
+def iter_rendered_pages(batches, profile=None):
+    # (номер страницы, pixmap, время рендера); отрендеренный PDF сразу удаляется
+    for pdf_file_path, batch in batches:
+        with open_pdf(pdf_file_path) as doc:
+            for index, page_num in enumerate(batch):
+                start = time.perf_counter()
+                pixmap = render_page(doc.load_page(index), profile)
+                yield page_num, pixmap, time.perf_counter() - start
+        os.remove(pdf_file_path)
+
+
+def _ocr_rendered_page(page_num, pixmap, render_seconds, options):
+    start = time.perf_counter()
+    text = ocr_pixmap(pixmap, **options)
+    return {
+        "page": page_num,
+        "text": text,
+        "render_seconds": render_seconds,
+        "ocr_seconds": time.perf_counter() - start,
+    }
+
+
+def iter_pipeline_pages(
+    filename, page_nums, workers: int = 1, max_in_flight: int = None, profile=None, batch_pages: int = BATCH_PAGES
+):
+    """OCR страниц DJVU конвейером: ddjvu по диапазонам -> рендер -> tesseract.
+
+    Стадии работают одновременно и связаны очередями ограниченного размера:
+    пока ddjvu конвертирует следующий диапазон, предыдущий уже рендерится,
+    а готовые картинки распознаются в ``workers`` потоках (сам tesseract -
+    отдельный процесс). Страницы отдаются по порядку, первая - как только
+    готов первый диапазон, а не весь документ.
+    """
+    workers = workers or os.cpu_count()
+    max_in_flight = max(max_in_flight or 2 * workers, 1)
+    options = tesseract_options(profile)
+
+    with tempfile.TemporaryDirectory(prefix="djvu_") as scratch_dir:
+        batches = BackgroundStage(
+            iter_converted_batches(filename, list(page_nums), scratch_dir, profile, batch_pages),
+            PREFETCH_BATCHES,
+        )
+        rendered = BackgroundStage(iter_rendered_pages(batches, profile), max_in_flight)
+        pending = deque()
+        try:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                try:
+                    for page in rendered:
+                        pending.append(executor.submit(_ocr_rendered_page, *page, options))
+                        if len(pending) >= max_in_flight:
+                            yield _record_ocr_page(pending.popleft().result())
+                    while pending:
+                        yield _record_ocr_page(pending.popleft().result())
+                finally:
+                    for future in pending:
+                        future.cancel()
+        finally:
+            rendered.close()
+            batches.close()
+
+
+@cached("ocr", "1", ignore=("workers", "max_in_flight"))
+def ocr_pdf(pdf_file, workers: int = None, max_in_flight: int = None, profile=None):
+    pages = iter_ocr_pages(pdf_file, workers, max_in_flight, profile=profile)
+    return "".join(page["text"] for page in pages)
+
+
+def iter_djvu_pages(
+    filename,
+    workers: int = 1,
+    max_in_flight: int = None,
+    profile=None,
+    text_layer: bool = True,
+    batch_pages: int = BATCH_PAGES,
+):
+    """Текст страниц DJVU: {"page": номер страницы, "text": текст, "ocr": True/False, ...}.
+
+    Страницы со скрытым текстовым слоем берутся как есть; в PDF конвертируются
+    и распознаются только страницы без него. Без djvulibre-утилит для чтения
+    слоя (или с ``text_layer=False``) распознаются все страницы. Страницы
+    конвертируются по ``batch_pages`` штук, см. ``iter_pipeline_pages``.
+    """
+    if not is_path(filename):
+        # Утилитам djvulibre нужен файл с произвольным доступом, stdin им не подходит
+        with tempfile.TemporaryDirectory(prefix="djvu_") as scratch_dir:
+            djvu_file_path = os.path.join(scratch_dir, "input.djvu")
+            with open(djvu_file_path, "wb") as f:
+                f.write(as_bytes(filename))
+            yield from iter_djvu_pages(
+                djvu_file_path, workers, max_in_flight, profile, text_layer, batch_pages
+            )
+        return
+
+    texts = read_text_layer(filename) if text_layer else None
+    if texts is None:
+        # Слой не читается или не нужен: распознаются все страницы
+        count = djvu_page_count(filename)
+        texts = None if count is None else [""] * count
+    if texts is None:
+        scanned = None
+    else:
+        scanned = [page_num for page_num, text in enumerate(texts) if not text.strip()]
+        metrics.inc("pages", len(texts) - len(scanned), format="djvu_text")
+
+    if scanned == []:
+        for page_num, text in enumerate(texts):
+            yield {"page": page_num, "text": text, "ocr": False}
+        return
+
+    if scanned is None:
+        # Число страниц неизвестно, диапазоны не построить: весь документ одним ddjvu
+        with tempfile.TemporaryDirectory(prefix="djvu_") as scratch_dir:
+            pdf_file_path = os.path.join(scratch_dir, "converted.pdf")
+            convert_djvu_to_pdf(filename, pdf_file_path, profile)
+            for page in iter_ocr_pages(pdf_file_path, workers, max_in_flight, profile=profile):
+                yield {**page, "ocr": True}
+        return
+
+    ocr_pages = iter_pipeline_pages(filename, scanned, workers, max_in_flight, profile, batch_pages)
+    try:
+        for page_num, text in enumerate(texts):
+            if text.strip():
+                yield {"page": page_num, "text": text, "ocr": False}
+            else:
+                yield {**next(ocr_pages), "ocr": True}
+    finally:
+        ocr_pages.close()
+
+
+@cached("djvu", "2", ignore=("workers", "max_in_flight"))
+def parse_djvu(filename, workers: int = 1, max_in_flight: int = None, profile=None, text_layer: bool = True):
+    metrics.count_file(filename, format="djvu")
+
+    pages = iter_djvu_pages(filename, workers, max_in_flight, profile, text_layer)
+    extracted_text = "".join(page["text"] for page in pages)
+
+    print(extracted_text)
 
     return extracted_text
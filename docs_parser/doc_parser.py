@@ -1,19 +1,35 @@
-from spire.doc import *
-from spire.doc.common import *
-from docx import Document as DC
+import metrics
+from cache import cached
+from sources import as_bytes, is_path
 
 
+@cached("doc", "2")
 def extract_text_from_doc(doc_path):
+    metrics.count_file(doc_path, format="doc")
+    text = "\n".join(paragraph["text"] for paragraph in iter_doc_paragraphs(doc_path))
+    print(text)
+    return text
 
-    document = Document()
-    document.LoadFromFile(doc_path)
 
-    document.SaveToFile("ToDocx.docx", FileFormat.Docx2016)
-    document.Close()
+def iter_doc_paragraphs(doc_path):
+    # Отдает текст по абзацам: {"paragraph": номер абзаца, "text": текст}
+    # Абзацы читаются из модели Spire в памяти, без промежуточного .docx
+    from spire.doc import Document, FileFormat
+    from spire.doc.common import Stream
 
-    doc = DC("ToDocx.docx")
-    text = []
-    for paragraph in doc.paragraphs:
-        text.append(paragraph.text)
-    print("\n".join(text))
-    return "\n".join(text)
+    document = Document()
+    with metrics.timer("stage", format="doc", stage="load"):
+        if is_path(doc_path):
+            document.LoadFromFile(doc_path)
+        else:
+            document.LoadFromStream(Stream(bytes(as_bytes(doc_path))), FileFormat.Auto)
+    try:
+        num = 0
+        for section_num in range(document.Sections.Count):
+            paragraphs = document.Sections.get_Item(section_num).Paragraphs
+            for paragraph_num in range(paragraphs.Count):
+                metrics.inc("paragraphs", format="doc")
+                yield {"paragraph": num, "text": paragraphs.get_Item(paragraph_num).Text}
+                num += 1
+    finally:
+        document.Close()
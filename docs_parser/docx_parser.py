@@ -1,13 +1,150 @@
-from docx import Document
+import posixpath
+import zipfile
+from xml.etree import ElementTree
 
+import metrics
+from cache import cached
+from sources import as_file, is_path
 
+W = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+RELS = "{http://schemas.openxmlformats.org/package/2006/relationships}"
+MC = "{http://schemas.openxmlformats.org/markup-compatibility/2006}"
+# Части документа в порядке выдачи; тело документа идет после колонтитулов
+PART_ORDER = ["header", "body", "footnotes", "endnotes", "footer"]
+RUN_TEXT = {W + "tab": "\t", W + "br": "\n", W + "cr": "\n", W + "noBreakHyphen": "-"}
+
+
+@cached("docx", "3")
 def extract_text_from_docx(docx_path):
     try:
-        doc = Document(docx_path)
-        text = []
-        for paragraph in doc.paragraphs:
-            text.append(paragraph.text)
-        print("\n".join(text))
-        return "\n".join(text)
+        metrics.count_file(docx_path, format="docx")
+        text = "\n".join(paragraph["text"] for paragraph in iter_docx_text(docx_path))
+        print(text)
+        return text
     except Exception as err:
         print(f"Ошибка: {err}, Возможно, файл не найден.")
+
+
+def iter_docx_paragraphs(docx_path):
+    # Отдает текст по абзацам: {"paragraph": номер абзаца, "text": текст}
+    from docx import Document
+
+    with metrics.timer("stage", format="docx", stage="load"):
+        doc = Document(as_file(docx_path))
+    for num, paragraph in enumerate(doc.paragraphs):
+        metrics.inc("paragraphs", format="docx")
+        yield {"paragraph": num, "text": paragraph.text}
+
+
+def _relationship_targets(archive, part_name: str):
+    # (тип связи, путь к части в архиве) из _rels части part_name
+    directory, name = posixpath.split(part_name)
+    rels_name = posixpath.join(directory, "_rels", name + ".rels")
+    if rels_name not in archive.namelist():
+        return []
+    root = ElementTree.fromstring(archive.read(rels_name))
+    targets = []
+    for rel in root.iter(RELS + "Relationship"):
+        if rel.get("TargetMode") == "External":
+            continue
+        target = rel.get("Target")
+        if target.startswith("/"):
+            path = target.lstrip("/")
+        else:
+            path = posixpath.normpath(posixpath.join(directory, target))
+        targets.append((rel.get("Type").rsplit("/", 1)[-1], path))
+    return targets
+
+
+def docx_parts(archive):
+    """Части с текстом: [(вид части, путь в архиве)] в порядке PART_ORDER."""
+    main = "word/document.xml"
+    for kind, path in _relationship_targets(archive, ""):
+        if kind == "officeDocument":
+            main = path
+    parts = [("body", main)]
+    for kind, path in _relationship_targets(archive, main):
+        if kind in PART_ORDER:
+            parts.append((kind, path))
+    return sorted(parts, key=lambda part: PART_ORDER.index(part[0]))
+
+
+def iter_part_paragraphs(stream):
+    """Абзацы одной XML-части, прочитанные потоково через iterparse.
+
+    Разобранные абзацы сразу удаляются из дерева, поэтому память не растет
+    с размером документа. Вложенные абзацы (надписи) отдаются отдельно,
+    сразу после абзаца, в котором стоят. Из mc:AlternateContent берется
+    только mc:Choice: в mc:Fallback Word кладет копию того же текста.
+    """
+    open_elements = []
+    paragraphs = []
+    # Готовые вложенные абзацы каждого открытого абзаца
+    nested = []
+    in_properties = 0
+    in_fallback = 0
+    for event, element in ElementTree.iterparse(stream, events=("start", "end")):
+        tag = element.tag
+        if event == "start":
+            open_elements.append(element)
+            if tag == MC + "Fallback":
+                in_fallback += 1
+            elif in_fallback:
+                pass
+            elif tag == W + "p":
+                paragraphs.append([])
+                nested.append([])
+            elif tag == W + "pPr" or tag == W + "rPr":
+                in_properties += 1
+            continue
+
+        open_elements.pop()
+        if tag == MC + "Fallback":
+            in_fallback -= 1
+        elif in_fallback:
+            pass
+        elif tag == W + "t":
+            if paragraphs:
+                paragraphs[-1].append(element.text or "")
+        elif tag in RUN_TEXT:
+            if paragraphs and not in_properties:
+                paragraphs[-1].append(RUN_TEXT[tag])
+        elif tag == W + "pPr" or tag == W + "rPr":
+            in_properties -= 1
+        elif tag == W + "p":
+            texts = ["".join(paragraphs.pop()), *nested.pop()]
+            if nested:
+                nested[-1].extend(texts)
+            else:
+                yield from texts
+
+        if (tag == W + "p" or tag == W + "tbl") and not paragraphs:
+            element.clear()
+            if open_elements:
+                open_elements[-1].clear()
+
+
+def iter_docx_text(docx_path):
+    """Текст всех частей DOCX: {"paragraph": номер, "part": часть, "text": текст}.
+
+    Колонтитулы, тело с таблицами, сноски читаются прямо из zip без python-docx.
+    Пустые абзацы вне тела документа пропускаются. ``docx_path`` - путь,
+    байты или двоичный поток.
+    """
+    source = as_file(docx_path)
+    if not zipfile.is_zipfile(source):
+        from docx.opc.exceptions import PackageNotFoundError
+
+        name = docx_path if is_path(docx_path) else "<stream>"
+        raise PackageNotFoundError(f"Package not found at '{name}'")
+
+    num = 0
+    with zipfile.ZipFile(source) as archive:
+        for kind, path in docx_parts(archive):
+            with archive.open(path) as stream:
+                for text in iter_part_paragraphs(stream):
+                    if kind != "body" and not text:
+                        continue
+                    metrics.inc("paragraphs", format="docx")
+                    yield {"paragraph": num, "part": kind, "text": text}
+                    num += 1
@@ -0,0 +1,298 @@
+import argparse
+import json
+import os
+import signal
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
+
+import metrics
+from budget import DocumentBudget, iter_within_budget, window_options
+from dispatcher import (
+    collect_units,
+    format_from_extension,
+    get_extractor,
+    load_record,
+    record_key,
+    save_record,
+    sniff_format,
+)
+from near_duplicates import NearDuplicateIndex, minhash
+
+TIMEOUT = 600
+
+
+def collect_files(paths, list_file: str = None):
+    paths = list(paths)
+    if list_file:
+        with open(list_file, encoding="utf-8") as f:
+            paths += [line.strip() for line in f if line.strip()]
+
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for name in sorted(files):
+                    file_path = os.path.join(root, name)
+                    if format_from_extension(file_path):
+                        yield file_path
+        elif format_from_extension(path):
+            yield path
+
+
+def file_signature(path: str):
+    stat = os.stat(path)
+    return {"path": os.path.abspath(path), "size": stat.st_size, "mtime": stat.st_mtime}
+
+
+def signature_key(record: dict):
+    return record["path"], record["size"], record["mtime"]
+
+
+def load_done(output_path: str):
+    # Уже обработанные файлы: (путь, размер, mtime) успешных записей
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+    with open(output_path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if "error" not in record:
+                done.add(signature_key(record))
+    return done
+
+
+def _on_timeout(signum, frame):
+    raise TimeoutError("время ожидания истекло")
+
+
+@contextmanager
+def time_limit(seconds: float):
+    # TimeoutError через SIGALRM; работает только в главном потоке процесса
+    previous = signal.signal(signal.SIGALRM, _on_timeout)
+    signal.setitimer(signal.ITIMER_REAL, seconds)
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+
+
+def extract_units(record: dict, source, timeout: float = TIMEOUT, budget: DocumentBudget = None, **options):
+    # Дописывает в record текст, число страниц и частей или ошибку.
+    # Если бюджет исчерпан, текст частичный, а в "partial" - причина
+    try:
+        with time_limit(timeout):
+            key = record_key(source, record["format"], options)
+            cached = load_record(key, record["format"])
+            if cached is not None:
+                record.update(cached)
+                return record
+            iter_units, separator = get_extractor(record["format"])
+            units = iter_units(source, **options)
+            if budget is not None:
+                budget.start()
+                units = iter_within_budget(units, budget)
+            result = collect_units(units, separator)
+        record.update(result)
+        if budget is not None and budget.stopped:
+            record["partial"] = budget.stopped
+        else:
+            # Частичный текст не кэшируется: с другим бюджетом документ дочитается
+            save_record(key, result)
+    except Exception as err:
+        record["error"] = f"{type(err).__name__}: {err}"
+    return record
+
+
+def extract_file(
+    path: str,
+    timeout: float = TIMEOUT,
+    budget: DocumentBudget = None,
+    window: int = None,
+    fingerprint: bool = False,
+):
+    # fingerprint - посчитать подпись MinHash здесь же, в процессе пула
+    record = file_signature(path)
+    # Файлы отбираются по расширению, но экстрактор выбирается по содержимому
+    record["format"] = sniff_format(path) or format_from_extension(path)
+    start = time.perf_counter()
+    extract_units(record, path, timeout, budget, **window_options(record["format"], window))
+    if fingerprint and "error" not in record:
+        record["minhash"] = minhash(record["text"])
+    record["seconds"] = time.perf_counter() - start
+    return record
+
+
+def failed_record(path: str, err: Exception):
+    # Запись об ошибке, которая случилась вне extract_units: файл пропал
+    # между обходом и разбором или процесс пула убит (например, по памяти)
+    return {
+        "path": os.path.abspath(path),
+        "size": 0,
+        "format": format_from_extension(path) or "unknown",
+        "error": f"{type(err).__name__}: {err}",
+        "seconds": 0.0,
+    }
+
+
+def extract_files(files, workers: int = None, **options):
+    """Записи ``extract_file(path, **options)`` в порядке готовности; ошибка одного файла не прерывает пакет.
+
+    В работе не больше 2 * ``workers`` файлов. Если процесс пула погиб, пул
+    создается заново, а файлы, бывшие в работе, разбираются по одному:
+    так находится тот, что роняет процесс, и в записи о нем - ошибка.
+    """
+    workers = workers or os.cpu_count()
+    pending = deque(files)
+    suspects = deque()
+    running = {}
+    executor = ProcessPoolExecutor(max_workers=workers)
+    try:
+        while pending or suspects or running:
+            isolated = bool(suspects)
+            queue = suspects if isolated else pending
+            while queue and len(running) < (1 if isolated else 2 * workers):
+                path = queue.popleft()
+                running[executor.submit(extract_file, path, **options)] = path, isolated
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            broken = False
+            for future in done:
+                path, alone = running.pop(future)
+                try:
+                    yield future.result()
+                except BrokenProcessPool as err:
+                    broken = True
+                    if alone:
+                        yield failed_record(path, err)
+                    else:
+                        suspects.append(path)
+                except Exception as err:
+                    yield failed_record(path, err)
+
+            if broken:
+                # Остальные задачи погибшего пула тоже не выполнятся
+                suspects.extend(path for path, _ in running.values())
+                running.clear()
+                executor.shutdown(wait=False, cancel_futures=True)
+                executor = ProcessPoolExecutor(max_workers=workers)
+    finally:
+        executor.shutdown(cancel_futures=True)
+
+
+def ingest(
+    paths,
+    output_path: str,
+    workers: int = None,
+    timeout: float = TIMEOUT,
+    list_file: str = None,
+    budget: DocumentBudget = None,
+    window: int = None,
+    duplicates: NearDuplicateIndex = None,
+):
+    # budget - мягкие ограничения на документ (частичный текст вместо ошибки),
+    # window - страниц в окне для pdf и djvu, см. budget.extract_within_budget.
+    # С индексом duplicates у почти-дубликатов уже обработанных документов
+    # текст не сохраняется, в записи - "duplicate_of" и "similarity"
+    done = load_done(output_path)
+    files = []
+    skipped = 0
+    for path in collect_files(paths, list_file):
+        if signature_key(file_signature(path)) in done:
+            skipped += 1
+        else:
+            files.append(path)
+    print(f"Файлов к обработке: {len(files)}, пропущено ранее обработанных: {skipped}")
+
+    stats = {"files": 0, "errors": 0, "partial": 0, "duplicates": 0, "pages": 0, "bytes": 0}
+    start = time.perf_counter()
+    with open(output_path, "a", encoding="utf-8") as output:
+        fingerprint = duplicates is not None
+        records = extract_files(
+            files, workers, timeout=timeout, budget=budget, window=window, fingerprint=fingerprint
+        )
+        for record in records:
+            signature = record.pop("minhash", None)
+            if signature:
+                match = duplicates.add(record["path"], signature=signature)
+                if match:
+                    stats["duplicates"] += 1
+                    del record["text"]
+                    record.update(duplicate_of=match["name"], similarity=round(match["similarity"], 3))
+            output.write(json.dumps(record, ensure_ascii=False) + "\n")
+            output.flush()
+
+            stats["files"] += 1
+            stats["bytes"] += record["size"]
+            # Метрики процессов пула теряются, поэтому файл учитывается по записи
+            metrics.inc("input_bytes", record["size"], format=record["format"])
+            metrics.observe("file", record["seconds"], format=record["format"])
+            if "error" in record:
+                stats["errors"] += 1
+                metrics.inc("errors", format=record["format"])
+                print(f"Ошибка: {record['path']}: {record['error']}")
+            else:
+                stats["pages"] += record["pages"]
+                metrics.inc("documents", format=record["format"])
+                if "partial" in record:
+                    stats["partial"] += 1
+                    print(f"Частично ({record['partial']}): {record['path']}")
+                if record["pages"]:
+                    metrics.inc("pages", record["pages"], format=record["format"])
+                else:
+                    metrics.inc("paragraphs", record["units"], format=record["format"])
+
+    stats["seconds"] = time.perf_counter() - start
+    print_stats(stats)
+    return stats
+
+
+def print_stats(stats: dict):
+    seconds = stats["seconds"] or 1e-9
+    megabytes = stats["bytes"] / (1024 * 1024)
+    print(
+        f"Обработано файлов: {stats['files']} (ошибок: {stats['errors']}, "
+        f"частично: {stats.get('partial', 0)}, почти-дубликатов: {stats.get('duplicates', 0)}), "
+        f"страниц: {stats['pages']}, {megabytes:.1f} МБ за {stats['seconds']:.1f} с"
+    )
+    print(
+        f"{stats['files'] / seconds:.2f} файлов/с, {stats['pages'] / seconds:.2f} стр/с, "
+        f"{megabytes / seconds:.2f} МБ/с"
+    )
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Пакетное извлечение текста из pdf/docx/doc/djvu")
+    arg_parser.add_argument("paths", nargs="*", help="файлы и каталоги")
+    arg_parser.add_argument("--list", dest="list_file", help="файл со списком путей, по одному в строке")
+    arg_parser.add_argument("-o", "--output", default="results.jsonl")
+    arg_parser.add_argument("--workers", type=int, default=os.cpu_count())
+    arg_parser.add_argument("--timeout", type=float, default=TIMEOUT, help="секунд на файл")
+    arg_parser.add_argument("--max-seconds", type=float, help="после стольких секунд - частичный текст")
+    arg_parser.add_argument("--max-memory-mb", type=float, help="прирост памяти на документ, МБ")
+    arg_parser.add_argument("--window", type=int, help="страниц в окне для pdf и djvu")
+    arg_parser.add_argument("--dedup", help="индекс почти-дубликатов (SQLite), например near_duplicates.sqlite3")
+    arg_parser.add_argument("--metrics", help="куда выгрузить метрики: .json или текст Prometheus")
+    args = arg_parser.parse_args()
+
+    if not args.paths and not args.list_file:
+        arg_parser.error("нужны пути или --list")
+    if args.metrics:
+        metrics.enable()
+    budget = None
+    if args.max_seconds or args.max_memory_mb:
+        budget = DocumentBudget(args.max_seconds, args.max_memory_mb)
+    duplicates = NearDuplicateIndex(args.dedup) if args.dedup else None
+    try:
+        ingest(args.paths, args.output, args.workers, args.timeout, args.list_file, budget, args.window, duplicates)
+    finally:
+        if duplicates:
+            duplicates.close()
+    if args.metrics:
+        metrics.write(args.metrics)
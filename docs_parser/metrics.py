@@ -0,0 +1,174 @@
+import atexit
+import itertools
+import json
+import os
+import threading
+import time
+
+# Метрики включаются вызовом enable() или переменной окружения AUTOSYSTEMS_METRICS
+# с путем к файлу, куда они будут выгружены при выходе (.json или Prometheus-текст).
+METRICS_ENV = "AUTOSYSTEMS_METRICS"
+PREFIX = "autosystems"
+
+enabled = False
+_lock = threading.Lock()
+_counters = {}
+_timers = {}
+
+
+def enable():
+    global enabled
+    enabled = True
+
+
+def disable():
+    global enabled
+    enabled = False
+
+
+def reset():
+    with _lock:
+        _counters.clear()
+        _timers.clear()
+
+
+def _key(name: str, labels: dict):
+    return name, tuple(sorted(labels.items()))
+
+
+def inc(name: str, value: float = 1, **labels):
+    if not enabled:
+        return
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def observe(name: str, seconds: float, **labels):
+    if not enabled:
+        return
+    key = _key(name, labels)
+    with _lock:
+        count, total, peak = _timers.get(key, (0, 0.0, 0.0))
+        _timers[key] = (count + 1, total + seconds, max(peak, seconds))
+
+
+class _Timer:
+    __slots__ = ("name", "labels", "start")
+
+    def __init__(self, name: str, labels: dict):
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        observe(self.name, time.perf_counter() - self.start, **self.labels)
+
+
+class _NoopTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+_NOOP_TIMER = _NoopTimer()
+
+
+def count_file(path, **labels):
+    # Документ и его размер на входе: путь или байты
+    if not enabled:
+        return
+    inc("documents", **labels)
+    try:
+        size = len(path) if isinstance(path, (bytes, bytearray)) else os.path.getsize(path)
+    except (OSError, TypeError):
+        return
+    inc("input_bytes", size, **labels)
+
+
+def timer(name: str, **labels):
+    """Контекстный менеджер: время блока попадает в ``<name>_seconds``.
+
+    Пока метрики выключены, возвращается общий пустой объект без замеров.
+    """
+    if not enabled:
+        return _NOOP_TIMER
+    return _Timer(name, labels)
+
+
+def snapshot():
+    with _lock:
+        counters = [
+            {"name": name, "labels": dict(labels), "value": value}
+            for (name, labels), value in sorted(_counters.items())
+        ]
+        timers = [
+            {"name": name, "labels": dict(labels), "count": count, "sum": total, "max": peak}
+            for (name, labels), (count, total, peak) in sorted(_timers.items())
+        ]
+    return {"counters": counters, "timers": timers}
+
+
+def to_json():
+    return json.dumps(snapshot(), ensure_ascii=False, indent=2)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels_text(labels: dict):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + "}"
+
+
+def to_prometheus():
+    data = snapshot()
+    lines = []
+    declared = set()
+    for row in data["counters"]:
+        metric = f"{PREFIX}_{row['name']}_total"
+        if metric not in declared:
+            lines.append(f"# TYPE {metric} counter")
+            declared.add(metric)
+        lines.append(f"{metric}{_labels_text(row['labels'])} {row['value']}")
+    # Строки таймеров отсортированы по имени; у каждого имени два семейства:
+    # сводка (_count и _sum) и отдельный gauge _max, каждое одним блоком
+    for name, rows in itertools.groupby(data["timers"], key=lambda row: row["name"]):
+        rows = list(rows)
+        metric = f"{PREFIX}_{name}_seconds"
+        lines.append(f"# TYPE {metric} summary")
+        for row in rows:
+            labels = _labels_text(row["labels"])
+            lines.append(f"{metric}_count{labels} {row['count']}")
+            lines.append(f"{metric}_sum{labels} {row['sum']:.6f}")
+        lines.append(f"# TYPE {metric}_max gauge")
+        for row in rows:
+            lines.append(f"{metric}_max{_labels_text(row['labels'])} {row['max']:.6f}")
+    return "\n".join(lines) + "\n"
+
+
+def write(path: str):
+    text = to_json() if path.endswith(".json") else to_prometheus()
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(text)
+
+
+def _write_at_exit(path: str, pid: int):
+    if os.getpid() == pid:
+        write(path)
+
+
+if os.environ.get(METRICS_ENV):
+    enable()
+    # Процессы пулов наследуют окружение (и fork, и spawn), но файл пишет только первый процесс
+    owner = os.environ.setdefault(METRICS_ENV + "_PID", str(os.getpid()))
+    atexit.register(_write_at_exit, os.environ[METRICS_ENV], int(owner))
@@ -0,0 +1,186 @@
+import hashlib
+import re
+import sqlite3
+import struct
+import threading
+
+import metrics
+
+INDEX_PATH = "near_duplicates.sqlite3"
+SHINGLE_WORDS = 3
+NUM_PERM = 128
+BANDS = 16
+THRESHOLD = 0.8
+# Для оценки сходства хранятся младшие 8 бит каждого минимума (b-bit MinHash)
+SKETCH_BITS = 8
+
+WORD_RE = re.compile(r"\w+")
+
+
+def shingles(text: str, size: int = SHINGLE_WORDS):
+    # Пересекающиеся цепочки по size слов; короткий текст - одна цепочка
+    words = WORD_RE.findall(text.lower())
+    if len(words) <= size:
+        return {" ".join(words)} if words else set()
+    return {" ".join(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+def minhash(text: str, num_perm: int = NUM_PERM):
+    """Подпись MinHash: ``num_perm`` минимумов независимых хэшей по шинглам.
+
+    Доля совпавших позиций у двух подписей - оценка коэффициента Жаккара
+    их множеств шинглов. Для текста без слов - None.
+    """
+    items = shingles(text)
+    if not items:
+        return None
+    # Один вызов shake_128 дает сразу num_perm 32-битных хэшей шингла;
+    # минимумы по позициям считаются срезами без цикла по шинглам в Python
+    hashes = memoryview(
+        b"".join(hashlib.shake_128(item.encode("utf-8")).digest(4 * num_perm) for item in items)
+    ).cast("I")
+    return tuple(min(hashes[i::num_perm]) for i in range(num_perm))
+
+
+def sketch(signature):
+    return bytes(value & (1 << SKETCH_BITS) - 1 for value in signature)
+
+
+def similarity(first: bytes, second: bytes):
+    # Младшие биты совпадают и случайно, с вероятностью 2**-SKETCH_BITS; поправка на это
+    matches = sum(a == b for a, b in zip(first, second)) / len(first)
+    chance = 2.0 ** -SKETCH_BITS
+    return max((matches - chance) / (1 - chance), 0.0)
+
+
+def band_keys(signature, bands: int = BANDS):
+    # LSH: подпись режется на полосы, у похожих текстов хотя бы одна полоса
+    # с большой вероятностью совпадает целиком. Ключ - 64-битный хэш полосы
+    rows = len(signature) // bands
+    data = struct.pack(f"<{len(signature)}I", *signature)
+    keys = []
+    for band in range(bands):
+        digest = hashlib.blake2b(
+            data[band * rows * 4:(band + 1) * rows * 4],
+            digest_size=8,
+            person=band.to_bytes(2, "little"),
+        ).digest()
+        keys.append(int.from_bytes(digest, "little", signed=True))
+    return keys
+
+
+class NearDuplicateIndex:
+    """Индекс почти-дубликатов на диске: MinHash и LSH поверх SQLite.
+
+    Текст считается дубликатом записи, если оценка сходства их шинглов не ниже
+    ``threshold``. Кандидаты ищутся по ключам полос одним запросом к индексу
+    SQLite, поэтому поиск не зависит от числа записей и занимает доли миллисекунды.
+    """
+
+    def __init__(
+        self,
+        path: str = INDEX_PATH,
+        threshold: float = THRESHOLD,
+        num_perm: int = NUM_PERM,
+        bands: int = BANDS,
+    ):
+        if num_perm % bands:
+            raise ValueError(f"num_perm={num_perm} не делится на bands={bands}")
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.bands = bands
+        # Сколько почти-дубликатов найдено через add с момента открытия
+        self.duplicates = 0
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS documents (id INTEGER PRIMARY KEY, name TEXT NOT NULL, sketch BLOB NOT NULL)"
+        )
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS bands (key INTEGER NOT NULL, document INTEGER NOT NULL, "
+            "PRIMARY KEY (key, document)) WITHOUT ROWID"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS documents_name ON documents (name)")
+        self.check_parameters()
+        self.db.commit()
+
+    def check_parameters(self):
+        # Подписи с другими параметрами несравнимы: индекс открывается только с теми же
+        expected = {"num_perm": self.num_perm, "bands": self.bands, "shingle_words": SHINGLE_WORDS}
+        stored = dict(self.db.execute("SELECT name, value FROM meta"))
+        if not stored:
+            self.db.executemany("INSERT INTO meta (name, value) VALUES (?, ?)", expected.items())
+        elif stored != expected:
+            raise ValueError(f"индекс построен с параметрами {stored}, а не {expected}")
+
+    def signature(self, text: str):
+        return minhash(text, self.num_perm)
+
+    def query(self, text: str = None, signature=None):
+        """Похожие записи: [{"name", "similarity"}, ...], самые похожие первыми."""
+        signature = signature or self.signature(text)
+        if signature is None:
+            return []
+        keys = band_keys(signature, self.bands)
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT name, sketch FROM documents WHERE id IN "
+                f"(SELECT document FROM bands WHERE key IN ({', '.join('?' * len(keys))}))",
+                keys,
+            ).fetchall()
+        own = sketch(signature)
+        matches = [{"name": name, "similarity": similarity(own, other)} for name, other in rows]
+        matches = [match for match in matches if match["similarity"] >= self.threshold]
+        return sorted(matches, key=lambda match: match["similarity"], reverse=True)
+
+    def add(self, name: str, text: str = None, signature=None):
+        """Самая похожая запись, если текст - почти-дубликат; иначе текст добавляется и отдается None.
+
+        Запись с тем же ``name`` (прошлая версия того же файла или статьи)
+        дубликатом не считается и заменяется. Вместо текста можно передать
+        готовую подпись, посчитанную, например, в процессе пула.
+        """
+        signature = signature or self.signature(text)
+        if signature is None:
+            return None
+        matches = [match for match in self.query(signature=signature) if match["name"] != name]
+        if matches:
+            self.duplicates += 1
+            metrics.inc("near_duplicates")
+            return matches[0]
+        self.insert(name, signature)
+        self.commit()
+        return None
+
+    def insert(self, name: str, signature):
+        # Без проверки и без commit - для массовой загрузки. У записи с тем же
+        # именем меняется подпись; ключи полос старой версии остаются, но при
+        # поиске кандидаты все равно сверяются по новой подписи
+        with self.lock:
+            row = self.db.execute("SELECT id FROM documents WHERE name = ?", (name,)).fetchone()
+            if row:
+                document = row[0]
+                self.db.execute("UPDATE documents SET sketch = ? WHERE id = ?", (sketch(signature), document))
+            else:
+                document = self.db.execute(
+                    "INSERT INTO documents (name, sketch) VALUES (?, ?)", (name, sketch(signature))
+                ).lastrowid
+            self.db.executemany(
+                "INSERT OR IGNORE INTO bands (key, document) VALUES (?, ?)",
+                ((key, document) for key in band_keys(signature, self.bands)),
+            )
+
+    def commit(self):
+        with self.lock:
+            self.db.commit()
+
+    def __len__(self):
+        with self.lock:
+            return self.db.execute("SELECT COUNT(*) FROM documents").fetchone()[0]
+
+    def close(self):
+        self.commit()
+        self.db.close()
@@ -0,0 +1,106 @@
+import fitz
+
+# Профили OCR: скорость против точности.
+# dpi - разрешение рендера, grayscale/binarize - предобработка картинки,
+# clip - обрезка полей по содержимому, psm/oem/lang - параметры tesseract,
+# ddjvu_quality - качество картинок при конвертации DJVU в PDF.
+# Замеры на своем наборе: python benchmark.py --only profiles.
+# Рендер синтетического скана 150 dpi (1 CPU, без tesseract), стр/с и Мпикс на стр.:
+#   без профиля 38-49 и 0.50, fast 56-59 и 0.21, balanced 57-58 и 0.48,
+#   accurate 10-11 и 8.70. Время OCR растет с числом пикселей; скорость OCR
+#   и точность по символам еще не замерены - здесь нет tesseract
+PROFILES = {
+    "fast": {
+        "dpi": 100,
+        "grayscale": True,
+        "binarize": True,
+        "clip": True,
+        "psm": 6,
+        "oem": 1,
+        "lang": None,
+        "ddjvu_quality": 50,
+    },
+    "balanced": {
+        "dpi": 150,
+        "grayscale": True,
+        "binarize": False,
+        "clip": True,
+        "psm": 3,
+        "oem": 1,
+        "lang": None,
+        "ddjvu_quality": 85,
+    },
+    "accurate": {
+        "dpi": 300,
+        "grayscale": True,
+        "binarize": False,
+        "clip": False,
+        "psm": 3,
+        "oem": 1,
+        "lang": None,
+        "ddjvu_quality": 100,
+    },
+}
+DDJVU_QUALITY = 85
+CLIP_DPI = 18
+CLIP_THRESHOLD = 200
+BINARIZE_THRESHOLD = 160
+
+
+def get_profile(profile, **overrides):
+    # Имя профиля или словарь; overrides меняют отдельные параметры, например lang="rus"
+    if profile is None and not overrides:
+        return None
+    base = PROFILES[profile or "balanced"] if not isinstance(profile, dict) else profile
+    return {**base, **overrides}
+
+
+def ddjvu_quality(profile):
+    profile = get_profile(profile)
+    return DDJVU_QUALITY if profile is None else profile["ddjvu_quality"]
+
+
+def tesseract_options(profile):
+    # Аргументы для ocr_pixmap; без профиля - настройки tesseract по умолчанию
+    profile = get_profile(profile)
+    if profile is None:
+        return {}
+    config = f"--psm {profile['psm']} --oem {profile['oem']} --dpi {profile['dpi']}"
+    return {"lang": profile["lang"], "config": config}
+
+
+def content_rect(page, threshold: int = CLIP_THRESHOLD):
+    """Прямоугольник с содержимым страницы, найденный по рендеру в низком разрешении."""
+    pixmap = page.get_pixmap(dpi=CLIP_DPI, colorspace=fitz.csGRAY)
+    samples = pixmap.samples
+    stride = pixmap.stride
+    rows = [y for y in range(pixmap.height) if min(samples[y * stride:y * stride + pixmap.width]) < threshold]
+    cols = [x for x in range(pixmap.width) if min(samples[x::stride]) < threshold]
+    if not rows or not cols:
+        return page.rect
+
+    # Пиксель с запасом с каждой стороны, чтобы не срезать края букв
+    scale = 72 / CLIP_DPI
+    rect = fitz.Rect(
+        (cols[0] - 1) * scale, (rows[0] - 1) * scale, (cols[-1] + 2) * scale, (rows[-1] + 2) * scale
+    )
+    return rect & page.rect
+
+
+def binarize(pixmap, threshold: int = BINARIZE_THRESHOLD):
+    # Порог по таблице: bytes.translate работает в C, без цикла по пикселям
+    table = bytes(0 if value < threshold else 255 for value in range(256))
+    return fitz.Pixmap(fitz.csGRAY, pixmap.width, pixmap.height, pixmap.samples.translate(table), False)
+
+
+def render_page(page, profile=None):
+    profile = get_profile(profile)
+    if profile is None:
+        return page.get_pixmap()
+
+    clip = content_rect(page) if profile["clip"] else None
+    colorspace = fitz.csGRAY if profile["grayscale"] or profile["binarize"] else fitz.csRGB
+    pixmap = page.get_pixmap(dpi=profile["dpi"], colorspace=colorspace, clip=clip, alpha=False)
+    if profile["binarize"]:
+        pixmap = binarize(pixmap)
+    return pixmap
@@ -1,14 +1,134 @@
-import fitz
+import os
+from concurrent.futures import ProcessPoolExecutor
 
+import metrics
+from cache import cached
+from sources import as_bytes, is_path, open_pdf
 
-def extract_text_from_pdf(pdf_path):
-    text = ""
+CHUNK_SIZE = 50
+MIN_TEXT_CHARS = 20
+WINDOW_PAGES = 100
+
+
+@cached("pdf", "1", ignore=("workers", "chunk_size"))
+def extract_text_from_pdf(
+    pdf_path,
+    workers: int = 1,
+    chunk_size: int = CHUNK_SIZE,
+    ocr: bool = False,
+    min_chars: int = MIN_TEXT_CHARS,
+    profile=None,
+):
+    # pdf_path - путь, байты или двоичный поток (см. sources).
+    # С ocr=True сканированные страницы распознаются, см. iter_hybrid_pages
     try:
-        pdf_document = fitz.open(pdf_path)
-        num_pages = pdf_document.page_count
-        for i in range(num_pages):
-            page = pdf_document[i]
-            text += page.get_text()
-        return text
+        if not is_path(pdf_path):
+            pdf_path = as_bytes(pdf_path)
+        metrics.count_file(pdf_path, format="pdf")
+        if ocr:
+            pages = iter_hybrid_pages(pdf_path, workers, min_chars, profile)
+            return "".join(page["text"] for page in pages)
+        if workers != 1:
+            return extract_text_parallel(pdf_path, workers, chunk_size)
+        return extract_page_range(pdf_path)
     except Exception as e:
         print(f"Ошибка: {str(e)}, файл, возможно, отсутствует")
+
+
+def iter_pdf_pages(pdf_path, start: int = 0, stop: int = None, window: int = None):
+    # Отдает текст постранично: {"page": номер страницы, "text": текст}.
+    # С window после каждых window страниц чистится кэш MuPDF (картинки, шрифты)
+    with metrics.timer("stage", format="pdf", stage="open"):
+        pdf_document = open_pdf(pdf_path)
+    with pdf_document:
+        if stop is None:
+            stop = pdf_document.page_count
+        for i in range(start, stop):
+            with metrics.timer("stage", format="pdf", stage="text"):
+                text = pdf_document[i].get_text()
+            metrics.inc("pages", format="pdf")
+            yield {"page": i, "text": text}
+            if window and (i - start + 1) % window == 0:
+                release_pdf_cache()
+
+
+def release_pdf_cache():
+    # Общий кэш MuPDF растет до 256 МБ и сам не сжимается
+    import fitz
+
+    fitz.TOOLS.store_shrink(100)
+
+
+def needs_ocr(page, text: str, min_chars: int = MIN_TEXT_CHARS):
+    # Текстового слоя нет или почти нет, зато есть картинка - похоже на скан
+    return len(text.strip()) < min_chars and bool(page.get_images())
+
+
+def iter_hybrid_pages(
+    pdf_path, workers: int = 1, min_chars: int = MIN_TEXT_CHARS, profile=None, window: int = None
+):
+    """Текстовый слой, где он есть; рендер и tesseract - только для сканов.
+
+    Каждая страница дополнительно помечается ``"ocr": True/False``. С ``window``
+    документ разбирается окнами по ``window`` страниц: в памяти тексты только
+    текущего окна, а не всего документа.
+    """
+    if not is_path(pdf_path):
+        pdf_path = as_bytes(pdf_path)
+    with open_pdf(pdf_path) as pdf_document:
+        page_count = pdf_document.page_count
+    window = window or max(page_count, 1)
+    for start in range(0, page_count, window):
+        stop = min(start + window, page_count)
+        yield from _iter_hybrid_window(pdf_path, start, stop, workers, min_chars, profile)
+        release_pdf_cache()
+
+
+def _iter_hybrid_window(pdf_path, start, stop, workers, min_chars, profile):
+    from djvu_parser import iter_ocr_pages
+
+    with metrics.timer("stage", format="pdf", stage="open"):
+        pdf_document = open_pdf(pdf_path)
+    with pdf_document:
+        texts = []
+        scanned = []
+        for i in range(start, stop):
+            with metrics.timer("stage", format="pdf", stage="text"):
+                text = pdf_document[i].get_text()
+            if needs_ocr(pdf_document[i], text, min_chars):
+                scanned.append(i)
+                text = None
+            texts.append(text)
+
+    metrics.inc("pages", len(texts) - len(scanned), format="pdf")
+    ocr_pages = iter_ocr_pages(pdf_path, workers, page_nums=scanned, profile=profile)
+    try:
+        for i, text in enumerate(texts, start):
+            if text is None:
+                yield {"page": i, "text": next(ocr_pages)["text"], "ocr": True}
+            else:
+                yield {"page": i, "text": text, "ocr": False}
+    finally:
+        ocr_pages.close()
+
+
+def extract_page_range(pdf_path, start: int = 0, stop: int = None):
+    return "".join(page["text"] for page in iter_pdf_pages(pdf_path, start, stop))
+
+
+def extract_text_parallel(pdf_path, workers: int = None, chunk_size: int = CHUNK_SIZE):
+    # Каждый процесс открывает свой fitz.Document и читает свой диапазон страниц
+    # Байты уходят в каждую задачу целиком; для больших файлов лучше передавать путь
+    workers = workers or os.cpu_count()
+    if not is_path(pdf_path):
+        pdf_path = as_bytes(pdf_path)
+    with open_pdf(pdf_path) as pdf_document:
+        num_pages = pdf_document.page_count
+    starts = range(0, num_pages, chunk_size)
+    stops = [min(start + chunk_size, num_pages) for start in starts]
+
+    # Счетчики дочерних процессов до родителя не доходят, страницы считаются здесь
+    metrics.inc("pages", num_pages, format="pdf")
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        chunks = executor.map(extract_page_range, [pdf_path] * len(starts), starts, stops)
+        return "".join(chunks)
@@ -0,0 +1,112 @@
+import os
+import shutil
+import subprocess
+import tempfile
+import zipfile
+
+import fitz
+
+# Синтетические документы для бенчмарков
+
+
+def make_pdf(path: str, pages: int, lines: int = 60):
+    pdf_document = fitz.open()
+    for num in range(pages):
+        page = pdf_document.new_page()
+        text = "\n".join(f"Страница {num}, строка {line}: тестовый текст отчета" for line in range(lines))
+        page.insert_text((36, 36), text, fontsize=8, fontname="helv")
+    pdf_document.save(path)
+    pdf_document.close()
+
+
+def scanned_page_text(num: int):
+    # Эталонный текст страницы скана - для оценки точности OCR
+    return "\n".join(f"Page {num} line {line}: scanned report text" for line in range(40))
+
+
+def render_text_pages(pages: int, dpi: int = 150):
+    # Картинки страниц с текстом - материал для сканов и DJVU
+    source = fitz.open()
+    for num in range(pages):
+        page = source.new_page()
+        page.insert_text((36, 36), scanned_page_text(num), fontsize=11)
+        yield page.rect, page.get_pixmap(dpi=dpi)
+    source.close()
+
+
+def make_scanned_pdf(path: str, pages: int, dpi: int = 150):
+    # Страницы без текстового слоя, только картинка - как после ddjvu
+    scanned = fitz.open()
+    for rect, pixmap in render_text_pages(pages, dpi):
+        scanned_page = scanned.new_page(width=rect.width, height=rect.height)
+        scanned_page.insert_image(scanned_page.rect, pixmap=pixmap)
+    scanned.save(path)
+    scanned.close()
+
+
+def can_make_djvu():
+    return shutil.which("c44") is not None and shutil.which("djvm") is not None
+
+
+def make_djvu(path: str, pages: int, dpi: int = 150):
+    # Нужны c44 и djvm из djvulibre
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        page_files = []
+        for num, (rect, pixmap) in enumerate(render_text_pages(pages, dpi)):
+            image_path = os.path.join(tmp_dir, f"page_{num}.ppm")
+            page_path = os.path.join(tmp_dir, f"page_{num}.djvu")
+            pixmap.save(image_path)
+            subprocess.run(["c44", "-dpi", str(dpi), image_path, page_path], check=True)
+            page_files.append(page_path)
+        subprocess.run(["djvm", "-c", path, *page_files], check=True)
+
+
+def make_docx(path: str, paragraphs: int):
+    from docx import Document
+
+    doc = Document()
+    for num in range(paragraphs):
+        doc.add_paragraph(f"Абзац {num}: текст документа Word. " * 20)
+    doc.save(path)
+
+
+def make_large_docx(path: str, paragraphs: int, rows_every: int = 50):
+    # document.xml пишется потоком прямо в zip: сотни МБ без модели python-docx в памяти.
+    # Остальные части пакета берутся из пустого документа python-docx
+    from docx import Document
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        template = os.path.join(tmp_dir, "template.docx")
+        Document().save(template)
+        with zipfile.ZipFile(template) as source, zipfile.ZipFile(
+            path, "w", zipfile.ZIP_DEFLATED
+        ) as target:
+            for item in source.infolist():
+                if item.filename != "word/document.xml":
+                    target.writestr(item, source.read(item))
+            with target.open("word/document.xml", "w", force_zip64=True) as document:
+                document.write(
+                    b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                    b'<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main">'
+                    b"<w:body>"
+                )
+                for num in range(paragraphs):
+                    text = f"Абзац {num}: текст документа Word. " * 20
+                    paragraph = f"<w:p><w:r><w:t>{text}</w:t></w:r></w:p>"
+                    if num % rows_every == 0:
+                        # Время от времени таблица из одной строки
+                        paragraph = f"<w:tbl><w:tr><w:tc>{paragraph}</w:tc></w:tr></w:tbl>"
+                    document.write(paragraph.encode("utf-8"))
+                document.write(b"<w:sectPr/></w:body></w:document>")
+
+
+def make_doc(path: str, paragraphs: int):
+    # Пробная версия Spire.Doc не работает с документами больше 500 абзацев
+    from spire.doc import Document, FileFormat
+
+    document = Document()
+    section = document.AddSection()
+    for num in range(paragraphs):
+        section.AddParagraph().AppendText(f"Абзац {num}: текст документа Word 97-2003. " * 20)
+    document.SaveToFile(path, FileFormat.Doc)
+    document.Close()
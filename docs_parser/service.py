@@ -0,0 +1,403 @@
+import argparse
+import base64
+import http.client
+import ipaddress
+import json
+import math
+import os
+import socket
+import socketserver
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from importlib import import_module
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+import metrics
+from dispatcher import FORMATS, detect_format
+from ingest import TIMEOUT, extract_units
+
+HOST = "127.0.0.1"
+PORT = 8765
+MAX_BODY = 256 * 1024 * 1024
+# Тяжелые библиотеки, которые процессы пула импортируют заранее
+WARM_MODULES = ["fitz", "docx", "spire.doc", "pytesseract", "PIL.Image"]
+
+
+def warm_up():
+    # Инициализатор процесса пула: импорт всех экстракторов и их библиотек
+    for name in WARM_MODULES + [entry["module"] for entry in FORMATS.values()]:
+        try:
+            import_module(name)
+        except ImportError:
+            pass
+
+
+def _ping():
+    return os.getpid()
+
+
+def extract_document(source, format: str = None, timeout: float = TIMEOUT, **options):
+    """Текст одного документа: путь или байты. Ошибка - в поле "error", как в ingest."""
+    start = time.perf_counter()
+    record = {}
+    try:
+        record["format"] = detect_format(source, format)
+    except ValueError as err:
+        record["error"] = f"{type(err).__name__}: {err}"
+    else:
+        extract_units(record, source, timeout, **options)
+    record["seconds"] = time.perf_counter() - start
+    return record
+
+
+def extract_batch(documents, timeout: float = TIMEOUT, options: dict = None):
+    # Несколько документов за одну задачу пула: один обмен с процессом вместо многих
+    return [
+        extract_document(document["source"], document.get("format"), timeout, **(options or {}))
+        for document in documents
+    ]
+
+
+class ServiceBusy(Exception):
+    """Очередь документов заполнена, клиенту стоит повторить позже."""
+
+
+class ExtractionService:
+    """Пул процессов с заранее загруженными экстракторами.
+
+    Одновременно в работе не больше ``max_pending`` документов; лишние
+    запросы сразу получают отказ (``ServiceBusy``), а не копятся в памяти.
+    Если процесс пула погиб, пул создается заново, см. extract.
+    """
+
+    def __init__(self, workers: int = None, max_pending: int = None, timeout: float = TIMEOUT):
+        self.workers = workers or os.cpu_count()
+        self.max_pending = max_pending or 4 * self.workers
+        self.timeout = timeout
+        self.pending = 0
+        self.lock = threading.Lock()
+        self.pool_lock = threading.Lock()
+        self.executor = self.start_pool()
+
+    def start_pool(self):
+        executor = ProcessPoolExecutor(max_workers=self.workers, initializer=warm_up)
+        # Все процессы пула стартуют и прогревают импорт до первого запроса
+        pids = [executor.submit(_ping) for _ in range(self.workers)]
+        for future in pids:
+            future.result()
+        return executor
+
+    def restart(self, broken: ProcessPoolExecutor):
+        # Пул пересоздается один раз, сколько бы запросов ни застало его сломанным
+        with self.pool_lock:
+            if self.executor is broken:
+                metrics.inc("service_pool_restarts")
+                broken.shutdown(wait=False, cancel_futures=True)
+                self.executor = self.start_pool()
+
+    def admit(self, count: int):
+        with self.lock:
+            if self.pending + count > self.max_pending:
+                metrics.inc("service_rejected")
+                raise ServiceBusy(f"в работе {self.pending} документов из {self.max_pending}")
+            self.pending += count
+
+    def release(self, count: int):
+        with self.lock:
+            self.pending -= count
+
+    def extract(self, documents, options: dict = None):
+        """Тексты документов по порядку. ``documents`` - список {"source": путь или байты, "format": ...}.
+
+        Пакет делится на ``workers`` задач пула, каждая разбирает свою часть подряд.
+        Если процесс пула погиб (например, убит по памяти), пул пересоздается,
+        а пакет повторяется один раз; если и повтор роняет процесс, ошибка
+        попадает в записи этого пакета, остальные запросы не затрагиваются.
+        """
+        self.admit(len(documents))
+        try:
+            try:
+                records = self.run_batches(documents, options)
+            except BrokenProcessPool:
+                try:
+                    records = self.run_batches(documents, options)
+                except BrokenProcessPool as err:
+                    records = [
+                        {"format": document.get("format"), "error": f"{type(err).__name__}: {err}", "seconds": 0.0}
+                        for document in documents
+                    ]
+        finally:
+            self.release(len(documents))
+
+        for record in records:
+            # Метрики процессов пула теряются, поэтому документ учитывается здесь
+            format = record.get("format", "unknown")
+            metrics.observe("file", record["seconds"], format=format)
+            metrics.inc("errors" if "error" in record else "documents", format=format)
+        return records
+
+    def run_batches(self, documents, options: dict = None):
+        executor = self.executor
+        size = max(math.ceil(len(documents) / self.workers), 1)
+        try:
+            futures = [
+                executor.submit(extract_batch, documents[start:start + size], self.timeout, options)
+                for start in range(0, len(documents), size)
+            ]
+            return [record for future in futures for record in future.result()]
+        except BrokenProcessPool:
+            self.restart(executor)
+            raise
+
+    def close(self):
+        self.executor.shutdown(cancel_futures=True)
+
+
+def parse_option(value: str):
+    # Параметры из строки запроса: числа и true/false приводятся к типу
+    if value in ("true", "false"):
+        return value == "true"
+    for cast in (int, float):
+        try:
+            return cast(value)
+        except ValueError:
+            pass
+    return value
+
+
+class ServiceHandler(BaseHTTPRequestHandler):
+    """HTTP API сервиса.
+
+    POST /extract?format=pdf&profile=fast - тело запроса: сам документ;
+        вместо тела можно передать ?path=/путь/к/файлу на этой машине.
+        Пути принимаются только внутри ``path_root``, а без него - только
+        если сервис слушает loopback или Unix-сокет (ответ 403).
+    POST /batch - JSON {"documents": [{"path": ...} | {"data": base64, "format": ...}],
+        "options": {...}}; ответ - {"results": [...]} в том же порядке.
+    GET /health, GET /metrics (формат Prometheus).
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def __init__(self, *args, service: ExtractionService, path_root: str = None, **kwargs):
+        self.service = service
+        self.path_root = path_root
+        super().__init__(*args, **kwargs)
+
+    def local_only(self):
+        # Сервис доступен только с этой машины: Unix-сокет или loopback-адрес
+        if self.server.address_family == socket.AF_UNIX:
+            return True
+        return ipaddress.ip_address(self.server.server_address[0]).is_loopback
+
+    def resolve_path(self, path: str):
+        # Файл на машине сервиса; иначе любой клиент прочитал бы любой файл сервера
+        if self.path_root is None:
+            if not self.local_only():
+                raise PermissionError("пути к файлам принимаются только с --root или на loopback")
+            return path
+        real_path = os.path.realpath(path)
+        if os.path.commonpath([real_path, self.path_root]) != self.path_root:
+            raise PermissionError(f"путь вне {self.path_root}")
+        return real_path
+
+    def setup(self):
+        # Заголовки и тело уходят отдельными send(): без TCP_NODELAY каждый
+        # ответ по keep-alive ждет подтверждения ~40 мс. У Unix-сокета опции нет
+        self.disable_nagle_algorithm = self.request.family != socket.AF_UNIX
+        super().setup()
+
+    def do_GET(self):
+        path = urlsplit(self.path).path
+        if path == "/health":
+            self.send_json(200, {
+                "status": "ok",
+                "workers": self.service.workers,
+                "pending": self.service.pending,
+                "max_pending": self.service.max_pending,
+            })
+        elif path == "/metrics":
+            self.send_body(200, metrics.to_prometheus().encode("utf-8"), "text/plain; version=0.0.4")
+        else:
+            self.send_json(404, {"error": "нет такого адреса"})
+
+    def do_POST(self):
+        url = urlsplit(self.path)
+        start = time.perf_counter()
+        length = int(self.headers.get("Content-Length", 0))
+        if length > MAX_BODY:
+            self.close_connection = True
+            self.send_json(413, {"error": "слишком большой запрос"})
+            return
+        body = self.rfile.read(length)
+
+        try:
+            if url.path == "/extract":
+                query = dict(parse_qsl(url.query))
+                path = query.pop("path", None)
+                source = self.resolve_path(path) if path else body
+                format = query.pop("format", None)
+                options = {name: parse_option(value) for name, value in query.items()}
+                record = self.service.extract([{"source": source, "format": format}], options)[0]
+                self.send_json(422 if "error" in record else 200, record)
+            elif url.path == "/batch":
+                request = json.loads(body)
+                documents = [
+                    {
+                        "source": self.resolve_path(item["path"]) if "path" in item else base64.b64decode(item["data"]),
+                        "format": item.get("format"),
+                    }
+                    for item in request["documents"]
+                ]
+                if len(documents) > self.service.max_pending:
+                    self.send_json(413, {"error": f"в пакете больше {self.service.max_pending} документов"})
+                    return
+                records = self.service.extract(documents, request.get("options"))
+                self.send_json(200, {"results": records})
+            else:
+                self.send_json(404, {"error": "нет такого адреса"})
+                return
+        except ServiceBusy as err:
+            self.send_json(503, {"error": str(err)}, {"Retry-After": "1"})
+            return
+        except PermissionError as err:
+            self.send_json(403, {"error": str(err)})
+            return
+        except (ValueError, KeyError, TypeError) as err:
+            self.send_json(400, {"error": f"{type(err).__name__}: {err}"})
+            return
+        except Exception as err:
+            # Например, процесс пула упал и пул больше не принимает задачи
+            self.send_json(500, {"error": f"{type(err).__name__}: {err}"})
+            return
+        metrics.observe("service_request", time.perf_counter() - start, endpoint=url.path)
+
+    def send_json(self, status: int, data: dict, headers: dict = None):
+        body = json.dumps(data, ensure_ascii=False, default=str).encode("utf-8")
+        self.send_body(status, body, "application/json; charset=utf-8", headers)
+
+    def send_body(self, status: int, body: bytes, content_type: str, headers: dict = None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def address_string(self):
+        # У Unix-сокета нет адреса клиента
+        return self.client_address[0] if self.client_address else "unix"
+
+    def log_message(self, format, *args):
+        pass
+
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def make_server(
+    service: ExtractionService,
+    host: str = HOST,
+    port: int = PORT,
+    socket_path: str = None,
+    path_root: str = None,
+):
+    # С socket_path сервис слушает Unix-сокет вместо TCP-порта;
+    # path_root - каталог, файлы из которого можно запросить по пути
+    path_root = os.path.realpath(path_root) if path_root else None
+    handler = partial(ServiceHandler, service=service, path_root=path_root)
+    if socket_path:
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        return UnixHTTPServer(socket_path, handler)
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, socket_path: str, timeout: float = None):
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+class ServiceClient:
+    """Клиент сервиса для коротких задач: одно keep-alive соединение на клиента."""
+
+    def __init__(self, host: str = HOST, port: int = PORT, socket_path: str = None, timeout: float = TIMEOUT):
+        if socket_path:
+            self.connection = UnixHTTPConnection(socket_path, timeout)
+        else:
+            self.connection = http.client.HTTPConnection(host, port, timeout=timeout)
+
+    def request(self, method: str, path: str, body=None):
+        self.connection.request(method, path, body)
+        response = self.connection.getresponse()
+        data = json.loads(response.read())
+        if response.status in (400, 403, 404, 413, 500, 503):
+            raise RuntimeError(f"{response.status}: {data['error']}")
+        return data
+
+    def extract(self, source, format: str = None, **options):
+        """Запись с текстом документа; ``source`` - путь или байты.
+
+        Путь передается сервису как есть, файл читает сам сервис.
+        """
+        query = dict(options)
+        if format:
+            query["format"] = format
+        body = None
+        if isinstance(source, (str, os.PathLike)):
+            query["path"] = os.path.abspath(source)
+        else:
+            body = bytes(source)
+        query = {name: str(value).lower() if isinstance(value, bool) else value for name, value in query.items()}
+        return self.request("POST", f"/extract?{urlencode(query)}", body)
+
+    def extract_batch(self, sources, **options):
+        documents = [
+            {"path": os.path.abspath(source)}
+            if isinstance(source, (str, os.PathLike))
+            else {"data": base64.b64encode(source).decode("ascii")}
+            for source in sources
+        ]
+        body = json.dumps({"documents": documents, "options": options})
+        return self.request("POST", "/batch", body)["results"]
+
+    def close(self):
+        self.connection.close()
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Сервис извлечения текста с прогретым пулом процессов")
+    arg_parser.add_argument("--host", default=HOST)
+    arg_parser.add_argument("--port", type=int, default=PORT)
+    arg_parser.add_argument("--socket", help="Unix-сокет вместо TCP-порта")
+    arg_parser.add_argument("--root", help="каталог, из которого можно запрашивать файлы по пути")
+    arg_parser.add_argument("--workers", type=int, default=os.cpu_count())
+    arg_parser.add_argument("--max-pending", type=int, help="документов в работе, дальше - ответ 503")
+    arg_parser.add_argument("--timeout", type=float, default=TIMEOUT, help="секунд на документ")
+    args = arg_parser.parse_args()
+
+    metrics.enable()
+    service = ExtractionService(args.workers, args.max_pending, args.timeout)
+    server = make_server(service, args.host, args.port, args.socket, args.root)
+    print(f"Сервис запущен: {args.socket or f'http://{args.host}:{args.port}'}, процессов: {service.workers}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
@@ -0,0 +1,79 @@
+import io
+import mmap
+import os
+from contextlib import contextmanager
+
+# Документ можно передать путем, байтами (bytes, bytearray, memoryview, mmap)
+# или открытым двоичным потоком с seek/tell
+BUFFER_TYPES = (bytes, bytearray, memoryview, mmap.mmap)
+
+
+def is_path(source):
+    return isinstance(source, (str, os.PathLike))
+
+
+def as_bytes(source):
+    # Для библиотек, которым нужен буфер в памяти (fitz, Spire): копия неизбежна
+    if isinstance(source, (bytes, bytearray)):
+        return source
+    if isinstance(source, (memoryview, mmap.mmap)):
+        return bytes(source)
+    if is_path(source):
+        with open(source, "rb") as f:
+            return f.read()
+    position = source.tell()
+    data = source.read()
+    source.seek(position)
+    return data
+
+
+class MappedFile(io.RawIOBase):
+    """Файловый интерфейс поверх mmap без копирования: zipfile требует seekable()."""
+
+    def __init__(self, data: mmap.mmap):
+        self.data = data
+        self.position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, buffer):
+        chunk = self.data[self.position:self.position + len(buffer)]
+        buffer[:len(chunk)] = chunk
+        self.position += len(chunk)
+        return len(chunk)
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self.position, io.SEEK_END: len(self.data)}[whence]
+        self.position = max(base + offset, 0)
+        return self.position
+
+    def tell(self):
+        return self.position
+
+
+def as_file(source):
+    # Для zipfile и python-docx: путь или объект с read/seek без копирования
+    if isinstance(source, mmap.mmap):
+        return MappedFile(source)
+    if isinstance(source, BUFFER_TYPES):
+        return io.BytesIO(source)
+    return source
+
+
+def open_pdf(source):
+    import fitz
+
+    if is_path(source):
+        return fitz.open(source)
+    return fitz.open(stream=as_bytes(source), filetype="pdf")
+
+
+@contextmanager
+def map_file(path):
+    """Большой локальный файл как mmap: страницы читаются ОС по мере обращения."""
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        yield data
@@ -1,13 +1,41 @@
 import unittest
+import io
 import os
+import shutil
+import signal
+import tempfile
+import time
+import json
+import subprocess
+import sys
+import threading
+import zipfile
 import fitz
 from docx import Document
+from docx.oxml import parse_xml
 from unittest.mock import patch
 
-from djvu_parser import parse_djvu
-from doc_parser import extract_text_from_doc
-from docx_parser import extract_text_from_docx
-from pdf_parser import extract_text_from_pdf
+import metrics
+from budget import DocumentBudget, extract_within_budget
+from cache import ExtractionCache, disable_cache, enable_cache
+from dispatcher import extract, iter_extract, sniff_format
+from djvu_parser import (
+    BATCH_PAGES,
+    convert_djvu_to_pdf,
+    iter_djvu_pages,
+    iter_ocr_pages,
+    page_spec,
+    parse_djvu,
+    read_text_layer,
+)
+from doc_parser import extract_text_from_doc, iter_doc_paragraphs
+from docx_parser import extract_text_from_docx, iter_docx_paragraphs, iter_docx_text
+from ingest import extract_file, extract_units, ingest
+from near_duplicates import NearDuplicateIndex
+from ocr_profiles import get_profile, render_page, tesseract_options
+from pdf_parser import WINDOW_PAGES, extract_text_from_pdf, iter_hybrid_pages, iter_pdf_pages
+from service import ExtractionService, ServiceClient, make_server, parse_option
+from sources import map_file
 
 
 class TestDJVUParser(unittest.TestCase):
@@ -88,6 +116,242 @@ class TestDJVUParser(unittest.TestCase):
             mocked_print.assert_called_with("Ошибка: время ожидания истекло")
 
 
+class TestDJVUInMemoryPipeline(unittest.TestCase):
+
+    def fake_convert(self, djvu_file_path, pdf_file_path, profile=None):
+        pdf_document = fitz.open()
+        for _ in range(3):
+            pdf_document.new_page()
+        pdf_document.save(pdf_file_path)
+        pdf_document.close()
+        self.scratch_files.append(pdf_file_path)
+
+    def setUp(self):
+        self.scratch_files = []
+
+    def test_pages_are_ocred_from_memory(self):
+        pixmaps = []
+        with patch("djvu_parser.convert_djvu_to_pdf", self.fake_convert), patch(
+            "djvu_parser.ocr_pixmap", side_effect=lambda pixmap: pixmaps.append(pixmap) or "text "
+        ):
+            pages = list(iter_djvu_pages("book.djvu"))
+
+        self.assertEqual([page["page"] for page in pages], [0, 1, 2])
+        self.assertTrue(all(isinstance(pixmap, fitz.Pixmap) for pixmap in pixmaps))
+        self.assertFalse(os.path.exists("converted.pdf"))
+        self.assertFalse(os.path.exists("tmp_images"))
+        self.assertFalse(os.path.exists(self.scratch_files[0]))
+
+    def test_calls_use_separate_scratch(self):
+        with patch("djvu_parser.convert_djvu_to_pdf", self.fake_convert), patch(
+            "djvu_parser.ocr_pixmap", return_value=""
+        ):
+            first = iter_djvu_pages("first.djvu")
+            second = iter_djvu_pages("second.djvu")
+            next(first)
+            next(second)
+            self.assertNotEqual(self.scratch_files[0], self.scratch_files[1])
+            first.close()
+            second.close()
+
+
+class TestDJVUTextLayer(unittest.TestCase):
+
+    def fake_convert(self, djvu_file_path, pdf_file_path, profile=None, page_nums=None):
+        self.converted.append(page_nums)
+        pdf_document = fitz.open()
+        for _ in range(3 if page_nums is None else len(page_nums)):
+            pdf_document.new_page()
+        pdf_document.save(pdf_file_path)
+        pdf_document.close()
+
+    def setUp(self):
+        self.converted = []
+
+    def test_only_pages_without_text_are_ocred(self):
+        texts = ["first page\n", " \n", "third page\n", ""]
+        with patch("djvu_parser.read_text_layer", return_value=texts), patch(
+            "djvu_parser.convert_djvu_to_pdf", self.fake_convert
+        ), patch("djvu_parser.ocr_pixmap", return_value="ocr text") as ocr_pixmap:
+            pages = list(iter_djvu_pages("book.djvu"))
+
+        self.assertEqual(self.converted, [[1, 3]])
+        self.assertEqual(ocr_pixmap.call_count, 2)
+        self.assertEqual([page["page"] for page in pages], [0, 1, 2, 3])
+        self.assertEqual([page["ocr"] for page in pages], [False, True, False, True])
+        self.assertEqual(
+            [page["text"] for page in pages], ["first page\n", "ocr text", "third page\n", "ocr text"]
+        )
+
+    def test_full_text_layer_skips_conversion(self):
+        with patch("djvu_parser.read_text_layer", return_value=["a", "b"]), patch(
+            "djvu_parser.convert_djvu_to_pdf", self.fake_convert
+        ):
+            pages = list(iter_djvu_pages("book.djvu"))
+        self.assertEqual(self.converted, [])
+        self.assertEqual([page["text"] for page in pages], ["a", "b"])
+
+    def test_without_djvulibre_all_pages_are_ocred(self):
+        with patch("djvu_parser.read_text_layer", return_value=None), patch(
+            "djvu_parser.convert_djvu_to_pdf", self.fake_convert
+        ), patch("djvu_parser.ocr_pixmap", return_value="ocr text"):
+            pages = list(iter_djvu_pages("book.djvu"))
+        self.assertEqual(self.converted, [None])
+        self.assertTrue(all(page["ocr"] for page in pages))
+
+    def test_page_spec(self):
+        self.assertEqual(page_spec([0, 1, 2, 5, 7, 8]), "1-3,6,8-9")
+
+    def test_text_layer_is_read_in_one_call(self):
+        output = (
+            '(page 0 0 2550 3300 "Первая (стр.)\\n")\n'
+            "()\n"
+            '(page 0 0 2550 3300 "\\"Third\\" \\320\\257")\n'
+        ).encode("utf-8")
+        calls = []
+
+        def fake_run(cmd_args, **kwargs):
+            calls.append(cmd_args)
+            stdout = b"3\n" if cmd_args[0] == "djvused" else output
+            return subprocess.CompletedProcess(cmd_args, 0, stdout.decode() if kwargs.get("text") else stdout)
+
+        with patch("djvu_parser.shutil.which", return_value="/usr/bin/djvutxt"), \
+                patch("djvu_parser.subprocess.run", side_effect=fake_run):
+            texts = read_text_layer("book.djvu")
+        self.assertEqual(texts, ["Первая (стр.)\n", "", '"Third" Я'])
+        self.assertEqual([args[0] for args in calls], ["djvused", "djvutxt"])
+
+
+class TestDJVUPipeline(unittest.TestCase):
+
+    def fake_convert(self, djvu_file_path, pdf_file_path, profile=None, page_nums=None):
+        time.sleep(self.convert_seconds)
+        if page_nums and page_nums[0] in self.broken:
+            raise RuntimeError("ddjvu упал")
+        self.converted.append(page_nums)
+        self.scratch_dirs.add(os.path.dirname(pdf_file_path))
+        pdf_document = fitz.open()
+        for page_num in page_nums:
+            pdf_document.new_page(width=100 + page_num, height=100)
+        pdf_document.save(pdf_file_path)
+        pdf_document.close()
+
+    def setUp(self):
+        self.converted = []
+        self.scratch_dirs = set()
+        self.convert_seconds = 0
+        self.broken = ()
+        patchers = [
+            patch("djvu_parser.read_text_layer", return_value=[""] * 5),
+            patch("djvu_parser.convert_djvu_to_pdf", self.fake_convert),
+            patch("djvu_parser.ocr_pixmap", side_effect=lambda pixmap: str(pixmap.width)),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_pages_are_converted_in_batches(self):
+        pages = list(iter_djvu_pages("book.djvu", workers=2, batch_pages=2))
+        self.assertEqual(self.converted, [[0, 1], [2, 3], [4]])
+        self.assertEqual([page["page"] for page in pages], [0, 1, 2, 3, 4])
+        self.assertEqual([page["text"] for page in pages], ["100", "101", "102", "103", "104"])
+        self.assertTrue(all(page["ocr"] for page in pages))
+        self.assertFalse(any(os.path.exists(path) for path in self.scratch_dirs))
+
+    def test_first_page_before_whole_book_is_converted(self):
+        self.convert_seconds = 0.1
+        pages = iter_djvu_pages("book.djvu", batch_pages=1)
+        self.assertEqual(next(pages)["page"], 0)
+        self.assertLess(len(self.converted), 5)
+        pages.close()
+        self.assertFalse(any(os.path.exists(path) for path in self.scratch_dirs))
+
+    def test_conversion_error_reaches_consumer(self):
+        self.broken = (2,)
+        threads = threading.active_count()
+        with self.assertRaises(RuntimeError):
+            list(iter_djvu_pages("book.djvu", batch_pages=2))
+        self.assertEqual(threading.active_count(), threads)
+
+    def test_text_layer_off_still_uses_batches(self):
+        with patch("djvu_parser.djvu_page_count", return_value=3):
+            pages = list(iter_djvu_pages("book.djvu", text_layer=False, batch_pages=2))
+        self.assertEqual(self.converted, [[0, 1], [2]])
+        self.assertEqual(len(pages), 3)
+
+
+class TestOCRWorkerPool(unittest.TestCase):
+
+    def setUp(self):
+        self.pdf_file = "scanned.pdf"
+        pdf_document = fitz.open()
+        for num in range(5):
+            pdf_document.new_page(width=100 + num, height=100)
+        pdf_document.save(self.pdf_file)
+        pdf_document.close()
+
+    def tearDown(self):
+        os.remove(self.pdf_file)
+
+    def test_pool_keeps_page_order(self):
+        with patch("djvu_parser.ocr_pixmap", side_effect=lambda pixmap: str(pixmap.width)):
+            pages = list(iter_ocr_pages(self.pdf_file, workers=2, max_in_flight=2))
+
+        self.assertEqual([page["page"] for page in pages], [0, 1, 2, 3, 4])
+        self.assertEqual([page["text"] for page in pages], ["100", "101", "102", "103", "104"])
+        self.assertTrue(all(page["ocr_seconds"] >= 0 for page in pages))
+        self.assertTrue(all(page["render_seconds"] >= 0 for page in pages))
+
+
+class TestOCRProfiles(unittest.TestCase):
+
+    def setUp(self):
+        self.pdf_file = "profile.pdf"
+        pdf_document = fitz.open()
+        pdf_document.new_page().insert_text((100, 100), "Small block of text")
+        pdf_document.save(self.pdf_file)
+        pdf_document.close()
+
+    def tearDown(self):
+        os.remove(self.pdf_file)
+
+    def test_profile_overrides(self):
+        self.assertIsNone(get_profile(None))
+        self.assertEqual(get_profile("fast", lang="rus")["lang"], "rus")
+        self.assertEqual(get_profile(None, lang="rus")["dpi"], get_profile("balanced")["dpi"])
+        self.assertEqual(tesseract_options(None), {})
+        self.assertEqual(
+            tesseract_options("accurate"), {"lang": None, "config": "--psm 3 --oem 1 --dpi 300"}
+        )
+
+    def test_render_page_preprocessing(self):
+        with fitz.open(self.pdf_file) as pdf_document:
+            page = pdf_document[0]
+            default = render_page(page)
+            fast = render_page(page, "fast")
+            accurate = render_page(page, "accurate")
+
+        self.assertEqual((default.width, default.n), (595, 3))
+        # Обрезка по тексту: картинка намного меньше страницы
+        self.assertLess(fast.width, default.width)
+        self.assertLess(fast.height, default.height / 2)
+        self.assertEqual(fast.n, 1)
+        self.assertEqual(set(fast.samples), {0, 255})
+        self.assertEqual(accurate.width, 2480)
+
+    def test_profile_reaches_tesseract_and_ddjvu(self):
+        with patch("djvu_parser.ocr_pixmap", return_value="text") as ocr_pixmap:
+            list(iter_ocr_pages(self.pdf_file, profile="fast"))
+        self.assertEqual(ocr_pixmap.call_args.kwargs["config"], "--psm 6 --oem 1 --dpi 100")
+
+        with patch("djvu_parser.subprocess.Popen") as popen:
+            popen.return_value.communicate.return_value = (b"", b"")
+            convert_djvu_to_pdf("book.djvu", "book.pdf", "fast")
+            self.assertIn("-quality=50", popen.call_args.args[0])
+            convert_djvu_to_pdf("book.djvu", "book.pdf")
+            self.assertIn("-quality=85", popen.call_args.args[0])
+
+
 class TestPDFTextExtraction(unittest.TestCase):
 
     def setUp(self):
@@ -202,6 +466,222 @@ class TestPDFTextExtraction(unittest.TestCase):
             self.assertIsNone(extracted_text)
             mocked_print.assert_called_with("Ошибка: время ожидания истекло")
 
+class TestPDFParallelExtraction(unittest.TestCase):
+
+    def setUp(self):
+        self.pdf_file = "parallel.pdf"
+        pdf_document = fitz.open()
+        for num in range(7):
+            pdf_page = pdf_document.new_page()
+            pdf_page.insert_text((100, 100), f"Page {num}")
+        pdf_document.save(self.pdf_file)
+        pdf_document.close()
+
+    def tearDown(self):
+        os.remove(self.pdf_file)
+
+    def test_parallel_matches_serial(self):
+        serial_text = extract_text_from_pdf(self.pdf_file)
+        parallel_text = extract_text_from_pdf(self.pdf_file, workers=2, chunk_size=3)
+        self.assertEqual(parallel_text, serial_text)
+
+    def test_parallel_keeps_page_order(self):
+        extracted_text = extract_text_from_pdf(self.pdf_file, workers=3, chunk_size=1)
+        expected = [f"Page {num}" for num in range(7)]
+        self.assertEqual(extracted_text.splitlines(), expected)
+
+    @patch("builtins.print")
+    def test_parallel_missing_file(self, mocked_print):
+        extracted_text = extract_text_from_pdf("non_existent_file.pdf", workers=2)
+        self.assertIsNone(extracted_text)
+        mocked_print.assert_called_with(
+            "Ошибка: no such file: 'non_existent_file.pdf', файл, возможно, отсутствует"
+        )
+
+
+class TestPDFSelectiveOCR(unittest.TestCase):
+
+    def setUp(self):
+        # Страницы: текстовая, скан без текста, пустая, еще один скан
+        self.pdf_file = "hybrid.pdf"
+        source = fitz.open()
+        source_page = source.new_page(width=200, height=100)
+        source_page.insert_text((20, 50), "Scanned text")
+        pixmap = source_page.get_pixmap()
+        source.close()
+
+        pdf_document = fitz.open()
+        pdf_document.new_page().insert_text((100, 100), "Native text layer of the first page")
+        pdf_document.new_page().insert_image(fitz.Rect(0, 0, 200, 100), pixmap=pixmap)
+        pdf_document.new_page()
+        pdf_document.new_page().insert_image(fitz.Rect(0, 0, 200, 100), pixmap=pixmap)
+        pdf_document.save(self.pdf_file)
+        pdf_document.close()
+
+    def tearDown(self):
+        os.remove(self.pdf_file)
+
+    def test_only_scanned_pages_are_ocred(self):
+        with patch("djvu_parser.ocr_pixmap", return_value="OCR text") as ocr_pixmap:
+            pages = list(iter_hybrid_pages(self.pdf_file))
+
+        self.assertEqual(ocr_pixmap.call_count, 2)
+        self.assertEqual([page["ocr"] for page in pages], [False, True, False, True])
+        self.assertEqual(pages[0]["text"].strip(), "Native text layer of the first page")
+        self.assertEqual(pages[1]["text"], "OCR text")
+        self.assertEqual(pages[2]["text"], "")
+
+    def test_pool_keeps_page_order(self):
+        with patch("djvu_parser.ocr_pixmap", return_value="OCR text"):
+            pages = list(iter_hybrid_pages(self.pdf_file, workers=2))
+        self.assertEqual([page["page"] for page in pages], [0, 1, 2, 3])
+        self.assertEqual(pages[3]["text"], "OCR text")
+
+    def test_extract_text_with_ocr(self):
+        with patch("djvu_parser.ocr_pixmap", return_value="OCR text") as ocr_pixmap:
+            self.assertNotIn("OCR text", extract_text_from_pdf(self.pdf_file))
+            self.assertIn("OCR text", extract_text_from_pdf(self.pdf_file, ocr=True))
+        self.assertEqual(ocr_pixmap.call_count, 2)
+
+
+class TestStreamingExtraction(unittest.TestCase):
+
+    def test_iter_pdf_pages(self):
+        pdf_file = "stream.pdf"
+        pdf_document = fitz.open()
+        for num in range(3):
+            pdf_page = pdf_document.new_page()
+            pdf_page.insert_text((100, 100), f"Page {num}")
+        pdf_document.save(pdf_file)
+        pdf_document.close()
+
+        pages = list(iter_pdf_pages(pdf_file))
+        self.assertEqual([page["page"] for page in pages], [0, 1, 2])
+        self.assertEqual(pages[2]["text"].strip(), "Page 2")
+        self.assertEqual(list(iter_pdf_pages(pdf_file, 1, 2))[0]["page"], 1)
+        os.remove(pdf_file)
+
+    def test_iter_docx_paragraphs(self):
+        docx_file = "stream.docx"
+        doc = Document()
+        doc.add_paragraph("First")
+        doc.add_paragraph("Second")
+        doc.save(docx_file)
+
+        paragraphs = list(iter_docx_paragraphs(docx_file))
+        self.assertEqual(
+            paragraphs,
+            [{"paragraph": 0, "text": "First"}, {"paragraph": 1, "text": "Second"}],
+        )
+        os.remove(docx_file)
+
+
+class TestExtractionMetrics(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.pdf_file = os.path.join(self.tmp_dir.name, "metrics.pdf")
+        pdf_document = fitz.open()
+        for num in range(3):
+            pdf_document.new_page().insert_text((100, 100), f"Page {num}")
+        pdf_document.save(self.pdf_file)
+        pdf_document.close()
+        metrics.reset()
+        metrics.enable()
+
+    def tearDown(self):
+        metrics.disable()
+        metrics.reset()
+        self.tmp_dir.cleanup()
+
+    def test_pdf_stage_metrics(self):
+        extract_text_from_pdf(self.pdf_file)
+        data = json.loads(metrics.to_json())
+        counters = {row["name"]: row for row in data["counters"]}
+        self.assertEqual(counters["pages"]["value"], 3)
+        self.assertEqual(counters["documents"]["labels"], {"format": "pdf"})
+        self.assertEqual(counters["input_bytes"]["value"], os.path.getsize(self.pdf_file))
+        timers = {row["labels"]["stage"]: row for row in data["timers"]}
+        self.assertEqual(timers["text"]["count"], 3)
+        self.assertEqual(timers["open"]["count"], 1)
+
+    def test_prometheus_export(self):
+        extract_text_from_pdf(self.pdf_file)
+        metrics_file = os.path.join(self.tmp_dir.name, "metrics.prom")
+        metrics.write(metrics_file)
+        with open(metrics_file, encoding="utf-8") as f:
+            text = f.read()
+        self.assertIn("# TYPE autosystems_pages_total counter", text)
+        self.assertIn('autosystems_pages_total{format="pdf"} 3', text)
+        self.assertIn('autosystems_stage_seconds_count{format="pdf",stage="text"} 3', text)
+        # Каждое семейство метрик - один блок сразу после своего # TYPE
+        families = []
+        for line in text.splitlines():
+            if line.startswith("# TYPE "):
+                families.append(line.split()[2])
+            else:
+                name = line.split("{")[0].split()[0]
+                self.assertIn(families[-1], (name, name.rsplit("_", 1)[0]))
+        self.assertEqual(len(families), len(set(families)))
+        self.assertIn("autosystems_stage_seconds_max", families)
+
+    def test_disabled_metrics_record_nothing(self):
+        metrics.disable()
+        extract_text_from_pdf(self.pdf_file)
+        self.assertIs(metrics.timer("stage"), metrics.timer("other"))
+        self.assertEqual(metrics.snapshot(), {"counters": [], "timers": []})
+
+
+class TestExtractionCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.cache = enable_cache(os.path.join(self.tmp_dir.name, "cache.sqlite3"))
+        self.pdf_file = os.path.join(self.tmp_dir.name, "cached.pdf")
+        self.write_pdf("First version")
+
+    def tearDown(self):
+        disable_cache()
+        self.tmp_dir.cleanup()
+
+    def write_pdf(self, text):
+        pdf_document = fitz.open()
+        pdf_document.new_page().insert_text((100, 100), text)
+        pdf_document.save(self.pdf_file)
+        pdf_document.close()
+
+    def test_second_call_is_a_hit(self):
+        first = extract_text_from_pdf(self.pdf_file)
+        with patch("pdf_parser.extract_page_range") as mocked_extract:
+            second = extract_text_from_pdf(self.pdf_file, workers=2)
+            mocked_extract.assert_not_called()
+        self.assertEqual(first, second)
+        self.assertEqual(self.cache.stats()["hits"], 1)
+        self.assertEqual(self.cache.stats()["misses"], 1)
+
+    def test_changed_content_is_a_miss(self):
+        extract_text_from_pdf(self.pdf_file)
+        self.write_pdf("Second version")
+        self.assertEqual(extract_text_from_pdf(self.pdf_file).strip(), "Second version")
+        self.assertEqual(self.cache.stats()["misses"], 2)
+
+    @patch("builtins.print")
+    def test_errors_are_not_cached(self, mocked_print):
+        self.assertIsNone(extract_text_from_pdf("non_existent_file.pdf"))
+        self.assertEqual(self.cache.stats()["entries"], 0)
+
+    def test_lru_eviction(self):
+        cache = ExtractionCache(os.path.join(self.tmp_dir.name, "small.sqlite3"), max_bytes=10)
+        cache.put("a", "aaaa")
+        cache.put("b", "bbbb")
+        cache.get("a")
+        cache.put("c", "cccc")
+        self.assertEqual(cache.get("a"), "aaaa")
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.stats()["bytes"], 8)
+        cache.close()
+
+
 class TestDocxTextExtraction(unittest.TestCase):
 
     def setUp(self):
@@ -218,173 +698,848 @@ class TestDocxTextExtraction(unittest.TestCase):
         
     @patch("builtins.print")
     def test_extract_text_from_docx_exception(self, mocked_print):
-         non_existent_file = "non_existent_file.docx"
-         extract_text_from_docx(non_existent_file)
-         mocked_print.assert_called_with(
-             "Ошибка: Package not found at 'non_existent_file.docx', Возможно, файл не найден."
-         )
+        non_existent_file = "non_existent_file.docx"
+        extract_text_from_docx(non_existent_file)
+        mocked_print.assert_called_with(
+            "Ошибка: Package not found at 'non_existent_file.docx', Возможно, файл не найден."
+        )
 
     @patch("builtins.print")
     def test_extract_text_from_docx_empty_file(self, mocked_print):
-         empty_docx_file = "empty.docx"
-         doc = Document()
-         doc.save(empty_docx_file)
-         
-         extracted_text = extract_text_from_docx(empty_docx_file)
-         self.assertEqual(extracted_text, "")
-         
-     @patch("builtins.print")
-     def test_extract_text_from_docx_large_file(self, mocked_print):
-         large_docx_file = "large.docx"
-         doc = Document()
-         for _ in range(1000):
-             doc.add_paragraph("Large Docx content" * 1000)
-         doc.save(large_docx_file)
-         
-         extracted_text = extract_text_from_docx(large_docx_file)
-         self.assertTrue(len(extracted_text) > 1000000)
-
-     @patch("builtins.print")
-     def test_extract_text_from_docx_special_characters(self, mocked_print):
-         special_docx_file = "special.docx"
-         doc = Document()
-         doc.add_paragraph("!@#$%^&*()_+")
-         doc.save(special_docx_file)
-         
-         extracted_text = extract_text_from_docx(special_docx_file)
-         self.assertEqual(extracted_text.strip(), "!@#$%^&*()_+")
-         
-     @patch("builtins.print")
-     def test_extract_text_from_docx_unicode_characters(self, mocked_print):
-         unicode_docx_file = "unicode.docx"
-         doc = Document()
-         doc.add_paragraph("тестовые данные")
-         doc.save(unicode_docx_file)
-         
-         extracted_text = extract_text_from_docx(unicode_docx_file)
-         self.assertEqual(extracted_text.strip(), "тестовые данные")
-
-     @patch("builtins.print")
-     def test_extract_text_from_docx_binary_content(self, mocked_print):
-         binary_docx_file = "binary.docx"
-         
-         with open(binary_docx_file, "wb") as f:
-             f.write(b"\\x00\\x01\\x02\\x03")
-
-         extracted_text = extract_text_from_docx(binary_docx_file)
-         self.assertIsNone(extracted_text)
-
-     @patch("builtins.print")
-     def test_extract_text_from_docx_partial_read(self, mocked_print):
-          partial_docx_file = "partial.docx"
-          doc = Document()
-          doc.add_paragraph("Partial content")
-
-          doc.save(partial_docx_file)
-
-          extracted_text = extract_text_from_docx(partial_docx_file)
-          self.assertEqual(extracted_text.strip(), "Partial content")
-
-     @patch("builtins.print")
-     def test_extract_text_from_docx_timeout(self, mocked_print):
-          with patch('docx_parser.extract_text_from_docx', side_effect=TimeoutError):
-              extracted_text = extract_text_from_docx("timeout.docx")
-              self.assertIsNone(extracted_text)
-              mocked_print.assert_called_with(
-                  "Ошибка: время ожидания истекло")
+        empty_docx_file = "empty.docx"
+        doc = Document()
+        doc.save(empty_docx_file)
+
+        extracted_text = extract_text_from_docx(empty_docx_file)
+        self.assertEqual(extracted_text, "")
+
+    @patch("builtins.print")
+    def test_extract_text_from_docx_large_file(self, mocked_print):
+        large_docx_file = "large.docx"
+        doc = Document()
+        for _ in range(1000):
+            doc.add_paragraph("Large Docx content" * 1000)
+        doc.save(large_docx_file)
+
+        extracted_text = extract_text_from_docx(large_docx_file)
+        self.assertTrue(len(extracted_text) > 1000000)
+
+    @patch("builtins.print")
+    def test_extract_text_from_docx_special_characters(self, mocked_print):
+        special_docx_file = "special.docx"
+        doc = Document()
+        doc.add_paragraph("!@#$%^&*()_+")
+        doc.save(special_docx_file)
+
+        extracted_text = extract_text_from_docx(special_docx_file)
+        self.assertEqual(extracted_text.strip(), "!@#$%^&*()_+")
+
+    @patch("builtins.print")
+    def test_extract_text_from_docx_unicode_characters(self, mocked_print):
+        unicode_docx_file = "unicode.docx"
+        doc = Document()
+        doc.add_paragraph("тестовые данные")
+        doc.save(unicode_docx_file)
+
+        extracted_text = extract_text_from_docx(unicode_docx_file)
+        self.assertEqual(extracted_text.strip(), "тестовые данные")
+
+    @patch("builtins.print")
+    def test_extract_text_from_docx_binary_content(self, mocked_print):
+        binary_docx_file = "binary.docx"
+
+        with open(binary_docx_file, "wb") as f:
+            f.write(b"\\x00\\x01\\x02\\x03")
+
+        extracted_text = extract_text_from_docx(binary_docx_file)
+        self.assertIsNone(extracted_text)
+
+    @patch("builtins.print")
+    def test_extract_text_from_docx_partial_read(self, mocked_print):
+        partial_docx_file = "partial.docx"
+        doc = Document()
+        doc.add_paragraph("Partial content")
+
+        doc.save(partial_docx_file)
+
+        extracted_text = extract_text_from_docx(partial_docx_file)
+        self.assertEqual(extracted_text.strip(), "Partial content")
+
+    @patch("builtins.print")
+    def test_extract_text_from_docx_timeout(self, mocked_print):
+        with patch('docx_parser.extract_text_from_docx', side_effect=TimeoutError):
+            extracted_text = extract_text_from_docx("timeout.docx")
+            self.assertIsNone(extracted_text)
+            mocked_print.assert_called_with(
+                "Ошибка: время ожидания истекло")
+
+
+class TestDocxStreamingExtraction(unittest.TestCase):
+
+    W_NS = 'xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main"'
+    RELS_NS = 'xmlns="http://schemas.openxmlformats.org/package/2006/relationships"'
+    REL_TYPE = "http://schemas.openxmlformats.org/officeDocument/2006/relationships/"
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def make_docx_with_footnotes(self):
+        # python-docx не умеет сноски, поэтому пакет собирается вручную
+        path = os.path.join(self.tmp_dir.name, "footnotes.docx")
+        body = (
+            f'<w:document {self.W_NS}><w:body>'
+            '<w:p><w:pPr><w:tabs><w:tab w:val="left" w:pos="720"/></w:tabs></w:pPr>'
+            '<w:r><w:t>Body</w:t><w:tab/><w:t>text</w:t></w:r>'
+            '<w:r><w:delText>deleted</w:delText></w:r></w:p>'
+            '</w:body></w:document>'
+        )
+        footnotes = (
+            f'<w:footnotes {self.W_NS}>'
+            '<w:footnote w:type="separator" w:id="-1"><w:p><w:r><w:separator/></w:r></w:p></w:footnote>'
+            '<w:footnote w:id="1"><w:p><w:r><w:t>Footnote text</w:t></w:r></w:p></w:footnote>'
+            '</w:footnotes>'
+        )
+        with zipfile.ZipFile(path, "w") as archive:
+            archive.writestr(
+                "_rels/.rels",
+                f'<Relationships {self.RELS_NS}><Relationship Id="rId1" '
+                f'Type="{self.REL_TYPE}officeDocument" Target="word/document.xml"/></Relationships>',
+            )
+            archive.writestr(
+                "word/_rels/document.xml.rels",
+                f'<Relationships {self.RELS_NS}><Relationship Id="rId1" '
+                f'Type="{self.REL_TYPE}footnotes" Target="footnotes.xml"/></Relationships>',
+            )
+            archive.writestr("word/document.xml", body)
+            archive.writestr("word/footnotes.xml", footnotes)
+        return path
+
+    def test_headers_tables_and_footers_in_order(self):
+        path = os.path.join(self.tmp_dir.name, "full.docx")
+        doc = Document()
+        doc.sections[0].header.paragraphs[0].text = "Header"
+        doc.sections[0].footer.paragraphs[0].text = "Footer"
+        doc.add_paragraph("Before table")
+        table = doc.add_table(rows=1, cols=2)
+        table.cell(0, 0).text = "Cell A"
+        table.cell(0, 1).text = "Cell B"
+        doc.add_paragraph("After table")
+        doc.save(path)
+
+        paragraphs = list(iter_docx_text(path))
+        self.assertEqual(
+            [(paragraph["part"], paragraph["text"]) for paragraph in paragraphs],
+            [
+                ("header", "Header"),
+                ("body", "Before table"),
+                ("body", "Cell A"),
+                ("body", "Cell B"),
+                ("body", "After table"),
+                ("footer", "Footer"),
+            ],
+        )
+        self.assertEqual([paragraph["paragraph"] for paragraph in paragraphs], list(range(6)))
+
+    def test_footnotes_and_run_content(self):
+        paragraphs = list(iter_docx_text(self.make_docx_with_footnotes()))
+        self.assertEqual(
+            [(paragraph["part"], paragraph["text"]) for paragraph in paragraphs],
+            [("body", "Body\ttext"), ("footnotes", "Footnote text")],
+        )
+
+    def test_text_box_is_read_once(self):
+        # Надпись так, как ее сохраняет Word: рисунок DrawingML в mc:Choice
+        # и копия VML в mc:Fallback
+        path = os.path.join(self.tmp_dir.name, "textbox.docx")
+        box = (
+            '<w:txbxContent><w:p><w:r><w:t>Boxed text</w:t></w:r></w:p></w:txbxContent>'
+        )
+        run = (
+            f'<w:r {self.W_NS} '
+            'xmlns:mc="http://schemas.openxmlformats.org/markup-compatibility/2006" '
+            'xmlns:wp="http://schemas.openxmlformats.org/drawingml/2006/wordprocessingDrawing" '
+            'xmlns:a="http://schemas.openxmlformats.org/drawingml/2006/main" '
+            'xmlns:wps="http://schemas.microsoft.com/office/word/2010/wordprocessingShape" '
+            'xmlns:v="urn:schemas-microsoft-com:vml">'
+            '<mc:AlternateContent><mc:Choice Requires="wps"><w:drawing>'
+            '<wp:anchor><wp:extent cx="914400" cy="457200"/><a:graphic>'
+            '<a:graphicData uri="http://schemas.microsoft.com/office/word/2010/wordprocessingShape">'
+            f'<wps:wsp><wps:txbx>{box}</wps:txbx><wps:bodyPr/></wps:wsp>'
+            '</a:graphicData></a:graphic></wp:anchor></w:drawing></mc:Choice>'
+            f'<mc:Fallback><w:pict><v:shape><v:textbox>{box}</v:textbox></v:shape></w:pict></mc:Fallback>'
+            '</mc:AlternateContent></w:r>'
+        )
+        doc = Document()
+        paragraph = doc.add_paragraph("Before")
+        paragraph._p.append(parse_xml(run))
+        doc.add_paragraph("After")
+        doc.save(path)
+
+        self.assertEqual(
+            [paragraph["text"] for paragraph in iter_docx_text(path)], ["Before", "Boxed text", "After"]
+        )
+
+    def test_body_matches_python_docx(self):
+        path = os.path.join(self.tmp_dir.name, "plain.docx")
+        doc = Document()
+        for num in range(50):
+            doc.add_paragraph(f"Paragraph {num}")
+        doc.add_paragraph("")
+        doc.save(path)
+
+        expected = [paragraph["text"] for paragraph in iter_docx_paragraphs(path)]
+        self.assertEqual([paragraph["text"] for paragraph in iter_docx_text(path)], expected)
+
+    @patch("builtins.print")
+    def test_not_a_docx(self, mocked_print):
+        path = os.path.join(self.tmp_dir.name, "broken.docx")
+        with open(path, "wb") as f:
+            f.write(b"not a zip")
+        self.assertIsNone(extract_text_from_docx(path))
+        mocked_print.assert_called_with(
+            f"Ошибка: Package not found at '{path}', Возможно, файл не найден."
+        )
+
+
+class TestDocInMemoryExtraction(unittest.TestCase):
+
+    def setUp(self):
+        from spire.doc import Document as SpireDocument, FileFormat
+
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.doc_file = os.path.join(self.tmp_dir.name, "native.doc")
+        document = SpireDocument()
+        section = document.AddSection()
+        for text in ["Первый абзац", "Второй абзац"]:
+            section.AddParagraph().AppendText(text)
+        document.SaveToFile(self.doc_file, FileFormat.Doc)
+        document.Close()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_paragraphs_without_intermediate_docx(self):
+        paragraphs = list(iter_doc_paragraphs(self.doc_file))
+        texts = [paragraph["text"] for paragraph in paragraphs]
+        self.assertEqual(texts[-2:], ["Первый абзац", "Второй абзац"])
+        self.assertEqual([paragraph["paragraph"] for paragraph in paragraphs], list(range(len(texts))))
+        self.assertFalse(os.path.exists("ToDocx.docx"))
+
+
+class TestExtractDispatcher(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        pdf_document = fitz.open()
+        pdf_document.new_page().insert_text((100, 100), "PDF text")
+        self.pdf_bytes = pdf_document.tobytes()
+        pdf_document.close()
+
+        doc = Document()
+        doc.add_paragraph("DOCX text")
+        self.docx_file = self.path("document.docx")
+        doc.save(self.docx_file)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def path(self, name):
+        return os.path.join(self.tmp_dir.name, name)
+
+    def test_sniff_format(self):
+        with open(self.docx_file, "rb") as f:
+            docx_bytes = f.read()
+        self.assertEqual(sniff_format(self.pdf_bytes), "pdf")
+        self.assertEqual(sniff_format(docx_bytes), "docx")
+        self.assertEqual(sniff_format(b"AT&TFORM\x00\x00\x00\x10DJVMDIRM"), "djvu")
+        self.assertEqual(sniff_format(b"\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1" + bytes(100)), "doc")
+        self.assertIsNone(sniff_format(b"PK\x03\x04 not a docx"))
+        self.assertIsNone(sniff_format(b"plain text"))
+        self.assertEqual(sniff_format(b"\xef\xbb\xbf\r\n" + self.pdf_bytes), "pdf")
+        self.assertIsNone(sniff_format(b"text before %PDF-1.7"))
+
+    def test_pdf_signature_inside_container(self):
+        # Несжатый PDF первым в архиве: "%PDF-" в первом килобайте zip
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, "w", zipfile.ZIP_STORED) as archive:
+            archive.writestr("attachment.pdf", self.pdf_bytes)
+        self.assertIn(b"%PDF-", buffer.getvalue()[:1024])
+        self.assertIsNone(sniff_format(buffer.getvalue()))
+
+        docx_buffer = io.BytesIO()
+        with zipfile.ZipFile(self.docx_file) as source, zipfile.ZipFile(docx_buffer, "w") as archive:
+            archive.writestr(zipfile.ZipInfo("embedded.pdf"), self.pdf_bytes)
+            for item in source.infolist():
+                archive.writestr(item, source.read(item))
+        self.assertIn(b"%PDF-", docx_buffer.getvalue()[:1024])
+        self.assertEqual(sniff_format(docx_buffer.getvalue()), "docx")
+        self.assertEqual(sniff_format(b"\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1%PDF-1.7" + bytes(100)), "doc")
+
+    def test_wrong_extension_uses_content(self):
+        misnamed = self.path("report.docx")
+        with open(misnamed, "wb") as f:
+            f.write(self.pdf_bytes)
+        self.assertEqual(extract(misnamed).strip(), "PDF text")
+        self.assertEqual(extract(self.docx_file), "DOCX text")
+
+    def test_bytes_input(self):
+        pages = list(iter_extract(self.pdf_bytes))
+        self.assertEqual([page["page"] for page in pages], [0])
+        self.assertEqual(extract(self.pdf_bytes).strip(), "PDF text")
+
+    def test_unknown_format(self):
+        with self.assertRaises(ValueError):
+            extract(b"plain text")
+
+    def test_heavy_backends_are_lazy(self):
+        code = (
+            "import sys, dispatcher, docx_parser, pdf_parser, djvu_parser, doc_parser; "
+            "print(sorted(name for name in ('docx', 'spire', 'pytesseract') if name in sys.modules))"
+        )
+        output = subprocess.run(
+            [sys.executable, "-c", code], capture_output=True, text=True, check=True
+        ).stdout
+        self.assertEqual(output.strip(), "[]")
+
+
+class TestBytesInput(unittest.TestCase):
+
+    def setUp(self):
+        from spire.doc import Document as SpireDocument, FileFormat
+
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.pdf_file = self.path("document.pdf")
+        pdf_document = fitz.open()
+        for num in range(2):
+            pdf_document.new_page().insert_text((100, 100), f"Page {num}")
+        pdf_document.save(self.pdf_file)
+        pdf_document.close()
+
+        self.docx_file = self.path("document.docx")
+        doc = Document()
+        doc.add_paragraph("DOCX text")
+        doc.save(self.docx_file)
+
+        self.doc_file = self.path("document.doc")
+        document = SpireDocument()
+        document.AddSection().AddParagraph().AppendText("DOC text")
+        document.SaveToFile(self.doc_file, FileFormat.Doc)
+        document.Close()
+
+    def tearDown(self):
+        disable_cache()
+        self.tmp_dir.cleanup()
+
+    def path(self, name):
+        return os.path.join(self.tmp_dir.name, name)
+
+    def sources(self, path):
+        with open(path, "rb") as f:
+            data = f.read()
+        return [data, bytearray(data), memoryview(data), io.BytesIO(data)]
+
+    def test_same_units_as_path(self):
+        for path, iter_units in [
+            (self.pdf_file, iter_pdf_pages),
+            (self.docx_file, iter_docx_text),
+            (self.doc_file, iter_doc_paragraphs),
+        ]:
+            expected = list(iter_units(path))
+            for source in self.sources(path):
+                with self.subTest(path=path, source=type(source).__name__):
+                    self.assertEqual(list(iter_units(source)), expected)
+            with map_file(path) as data:
+                self.assertEqual(list(iter_units(data)), expected)
+
+    def test_stream_position_is_kept(self):
+        with open(self.pdf_file, "rb") as f:
+            stream = io.BytesIO(b"junk" + f.read())
+        stream.seek(4)
+        self.assertEqual(extract(stream), extract(self.pdf_file))
+        self.assertEqual(stream.tell(), 4)
+
+    @patch("builtins.print")
+    def test_extractors_accept_bytes(self, mock_print):
+        with open(self.docx_file, "rb") as f:
+            self.assertEqual(extract_text_from_docx(f.read()), "DOCX text")
+        with open(self.pdf_file, "rb") as f:
+            self.assertEqual(extract_text_from_pdf(f.read()), extract_text_from_pdf(self.pdf_file))
+            f.seek(0)
+            self.assertEqual(extract_text_from_pdf(f.read(), workers=2, chunk_size=1),
+                             extract_text_from_pdf(self.pdf_file))
+
+    @patch("builtins.print")
+    def test_djvu_bytes_use_scratch_file(self, mock_print):
+        seen = []
+
+        def fake_text_layer(filename):
+            with open(filename, "rb") as f:
+                seen.append(f.read())
+            return ["Hidden text"]
+
+        data = b"AT&TFORM\x00\x00\x00\x10DJVUINFO"
+        with patch("djvu_parser.read_text_layer", side_effect=fake_text_layer):
+            self.assertEqual(parse_djvu(data), "Hidden text")
+        self.assertEqual(seen, [data])
+
+    def test_cache_keys_bytes_by_content(self):
+        cache = enable_cache(self.path("cache.sqlite"))
+        with open(self.docx_file, "rb") as f:
+            data = f.read()
+        self.assertEqual(extract_text_from_docx(data), "DOCX text")
+        self.assertEqual(extract_text_from_docx(io.BytesIO(data)), "DOCX text")
+        self.assertEqual(extract_text_from_docx(self.docx_file), "DOCX text")
+        self.assertEqual(cache.stats()["hits"], 2)
+        self.assertEqual(cache.stats()["entries"], 1)
+
+    def test_extract_uses_cache(self):
+        cache = enable_cache(self.path("cache.sqlite"))
+        expected = extract(self.pdf_file)
+        with patch("pdf_parser.iter_pdf_pages", side_effect=AssertionError("не из кэша")):
+            self.assertEqual(extract(self.pdf_file), expected)
+            self.assertEqual(extract(self.pdf_file, window=2), expected)
+            record = extract_units({"format": "pdf"}, self.pdf_file)
+        self.assertEqual(record["text"], expected)
+        self.assertEqual(record["pages"], 2)
+        self.assertEqual(cache.stats()["hits"], 3)
+        # Параметры, меняющие текст, входят в ключ
+        self.assertEqual(extract(self.pdf_file, start=1).strip(), "Page 1")
+        self.assertEqual(cache.stats()["entries"], 2)
+
+    def test_metrics_count_bytes(self):
+        metrics.reset()
+        metrics.enable()
+        try:
+            with open(self.pdf_file, "rb") as f:
+                data = f.read()
+            extract_text_from_pdf(data)
+            counters = metrics.snapshot()["counters"]
+        finally:
+            metrics.disable()
+            metrics.reset()
+        self.assertIn({"name": "input_bytes", "labels": {"format": "pdf"}, "value": len(data)}, counters)
+
+
+class TestBatchIngest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.input_dir = os.path.join(self.tmp_dir.name, "input")
+        os.makedirs(os.path.join(self.input_dir, "nested"))
+        self.output = os.path.join(self.tmp_dir.name, "results.jsonl")
+
+        pdf_document = fitz.open()
+        pdf_document.new_page().insert_text((100, 100), "Batch PDF")
+        pdf_document.save(os.path.join(self.input_dir, "nested", "a.pdf"))
+        pdf_document.close()
+        doc = Document()
+        doc.add_paragraph("Batch Docx")
+        doc.save(os.path.join(self.input_dir, "b.docx"))
+        with open(os.path.join(self.input_dir, "notes.txt"), "w") as f:
+            f.write("skip me")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def read_records(self):
+        with open(self.output, encoding="utf-8") as f:
+            return [json.loads(line) for line in f]
+
+    @patch("builtins.print")
+    def test_ingest_and_resume(self, mocked_print):
+        stats = ingest([self.input_dir], self.output, workers=2)
+        records = self.read_records()
+        self.assertEqual(stats["files"], 2)
+        self.assertEqual(stats["pages"], 1)
+        self.assertEqual(
+            sorted(record["text"].strip() for record in records), ["Batch Docx", "Batch PDF"]
+        )
+
+        stats = ingest([self.input_dir], self.output, workers=2)
+        self.assertEqual(stats["files"], 0)
+        self.assertEqual(len(self.read_records()), 2)
+
+    @patch("builtins.print")
+    def test_rescans_are_marked_as_duplicates(self, mocked_print):
+        text = "\n".join(f"Отчет, строка {line}: повторно отсканированный документ" for line in range(30))
+        for name in ("scan_1.pdf", "scan_2.pdf"):
+            pdf_document = fitz.open()
+            pdf_document.new_page().insert_text((36, 36), text, fontsize=8, fontname="helv")
+            pdf_document.save(os.path.join(self.input_dir, name))
+            pdf_document.close()
+
+        duplicates = NearDuplicateIndex(os.path.join(self.tmp_dir.name, "near.sqlite3"))
+        stats = ingest([self.input_dir], self.output, workers=2, duplicates=duplicates)
+        duplicates.close()
+        self.assertEqual(stats["duplicates"], 1)
+        marked = [record for record in self.read_records() if "duplicate_of" in record]
+        self.assertEqual(len(marked), 1)
+        self.assertNotIn("text", marked[0])
+        self.assertNotIn("minhash", marked[0])
+        self.assertIn(os.path.basename(marked[0]["duplicate_of"]), ("scan_1.pdf", "scan_2.pdf"))
+
+    @patch("builtins.print")
+    def test_changed_file_is_not_its_own_duplicate(self, mocked_print):
+        pdf_file = os.path.join(self.input_dir, "nested", "a.pdf")
+        duplicates = NearDuplicateIndex(os.path.join(self.tmp_dir.name, "near.sqlite3"))
+        ingest([pdf_file], self.output, workers=1, duplicates=duplicates)
+        # Файл изменился: новая запись, а не дубликат самого себя
+        os.utime(pdf_file, (time.time() + 10, time.time() + 10))
+        stats = ingest([pdf_file], self.output, workers=1, duplicates=duplicates)
+        self.assertEqual(len(duplicates), 1)
+        duplicates.close()
+        self.assertEqual(stats["files"], 1)
+        self.assertEqual(stats["duplicates"], 0)
+        record = self.read_records()[-1]
+        self.assertNotIn("duplicate_of", record)
+        self.assertEqual(record["text"].strip(), "Batch PDF")
+
+    @patch("builtins.print")
+    def test_failed_files_do_not_stop_batch(self, mocked_print):
+        real_sniff = sniff_format
+
+        def sniff(path):
+            # Файл пропал после обхода; другой роняет процесс пула, как OOM
+            if path.endswith("gone.pdf"):
+                raise FileNotFoundError(path)
+            if path.endswith("crash.pdf"):
+                os._exit(1)
+            return real_sniff(path)
+
+        for name in ("gone.pdf", "crash.pdf"):
+            shutil.copy(os.path.join(self.input_dir, "nested", "a.pdf"), os.path.join(self.input_dir, name))
+        with patch("ingest.sniff_format", side_effect=sniff):
+            stats = ingest([self.input_dir], self.output, workers=2)
+
+        records = {os.path.basename(record["path"]): record for record in self.read_records()}
+        self.assertEqual(sorted(records), ["a.pdf", "b.docx", "crash.pdf", "gone.pdf"])
+        self.assertIn("FileNotFoundError", records["gone.pdf"]["error"])
+        self.assertIn("BrokenProcessPool", records["crash.pdf"]["error"])
+        self.assertEqual(records["a.pdf"]["text"].strip(), "Batch PDF")
+        self.assertEqual(stats["errors"], 2)
+
+    def test_timeout_is_reported(self):
+        def slow_pages(path):
+            time.sleep(2)
+            yield {"page": 0, "text": ""}
+
+        pdf_file = os.path.join(self.input_dir, "nested", "a.pdf")
+        with patch("ingest.get_extractor", return_value=(slow_pages, "")):
+            record = extract_file(pdf_file, timeout=0.2)
+        self.assertIn("TimeoutError", record["error"])
+        self.assertLess(record["seconds"], 1)
+
+
+class TestDocumentBudget(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.pdf_file = os.path.join(self.tmp_dir.name, "long.pdf")
+        pdf_document = fitz.open()
+        for num in range(12):
+            pdf_document.new_page().insert_text((100, 100), f"Page {num}")
+        pdf_document.save(self.pdf_file)
+        pdf_document.close()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_windows_do_not_change_text(self):
+        result = extract_within_budget(self.pdf_file, window=5)
+        self.assertTrue(result["complete"])
+        self.assertEqual(result["pages"], 12)
+        self.assertEqual(result["text"], extract_text_from_pdf(self.pdf_file))
+        hybrid = [page["text"] for page in iter_hybrid_pages(self.pdf_file, window=5)]
+        self.assertEqual(hybrid, [page["text"] for page in iter_hybrid_pages(self.pdf_file)])
+
+    def test_time_budget_returns_partial_text(self):
+        result = extract_within_budget(self.pdf_file, window=5, max_seconds=0)
+        self.assertFalse(result["complete"])
+        self.assertEqual(result["stopped"], "time")
+        self.assertEqual(result["pages"], 1)
+        self.assertEqual(result["text"].strip(), "Page 0")
+
+    def test_budget_spent_on_last_page_keeps_text_complete(self):
+        pdf_file = os.path.join(self.tmp_dir.name, "short.pdf")
+        pdf_document = fitz.open()
+        pdf_document.new_page().insert_text((100, 100), "Only page")
+        pdf_document.save(pdf_file)
+        pdf_document.close()
+        result = extract_within_budget(pdf_file, max_seconds=0)
+        self.assertTrue(result["complete"])
+        self.assertIsNone(result["stopped"])
+        self.assertEqual(result["text"].strip(), "Only page")
+
+    def test_default_window_depends_on_format(self):
+        with patch("djvu_parser.iter_djvu_pages", return_value=iter([])) as iter_djvu_pages:
+            extract_within_budget("book.djvu", "djvu")
+        self.assertEqual(iter_djvu_pages.call_args.kwargs["batch_pages"], BATCH_PAGES)
+        with patch("pdf_parser.iter_pdf_pages", return_value=iter([])) as iter_pdf_pages:
+            extract_within_budget(self.pdf_file)
+        self.assertEqual(iter_pdf_pages.call_args.kwargs["window"], WINDOW_PAGES)
+
+    def test_memory_budget(self):
+        # Каждая страница "съедает" 10 МБ
+        growth = iter(range(0, 1000, 10))
+        with patch("budget.rss_mb", side_effect=lambda: next(growth)):
+            result = extract_within_budget(self.pdf_file, max_memory_mb=25)
+        self.assertEqual(result["stopped"], "memory")
+        self.assertEqual(result["pages"], 3)
+
+    def test_djvu_stop_removes_scratch_files(self):
+        scratch_dirs = set()
+
+        def fake_convert(djvu_file_path, pdf_file_path, profile=None, page_nums=None):
+            scratch_dirs.add(os.path.dirname(pdf_file_path))
+            pdf_document = fitz.open()
+            for _ in page_nums:
+                pdf_document.new_page(width=100, height=100)
+            pdf_document.save(pdf_file_path)
+            pdf_document.close()
+
+        with patch("djvu_parser.read_text_layer", return_value=[""] * 6), \
+                patch("djvu_parser.convert_djvu_to_pdf", fake_convert), \
+                patch("djvu_parser.ocr_pixmap", return_value="OCR"):
+            result = extract_within_budget("book.djvu", "djvu", window=2, max_seconds=0)
+        self.assertEqual(result["stopped"], "time")
+        self.assertEqual(result["pages"], 1)
+        self.assertTrue(scratch_dirs)
+        self.assertFalse(any(os.path.exists(path) for path in scratch_dirs))
+
+    @patch("builtins.print")
+    def test_ingest_marks_partial_records(self, mocked_print):
+        output = os.path.join(self.tmp_dir.name, "results.jsonl")
+        stats = ingest([self.pdf_file], output, workers=1, budget=DocumentBudget(max_seconds=0), window=4)
+        with open(output, encoding="utf-8") as f:
+            record = json.loads(f.readline())
+        self.assertEqual(record["partial"], "time")
+        self.assertEqual(record["pages"], 1)
+        self.assertEqual(stats["partial"], 1)
+
+
+class TestExtractionService(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp_dir = tempfile.TemporaryDirectory()
+        cls.service = ExtractionService(workers=1, max_pending=3)
+        cls.servers = []
+        cls.tcp_port = cls.start(port=0).server_address[1]
+        cls.socket_path = os.path.join(cls.tmp_dir.name, "service.sock")
+        cls.start(socket_path=cls.socket_path)
+
+        cls.pdf_file = os.path.join(cls.tmp_dir.name, "document.pdf")
+        pdf_document = fitz.open()
+        pdf_document.new_page().insert_text((100, 100), "PDF text")
+        pdf_document.save(cls.pdf_file)
+        pdf_document.close()
+
+        doc = Document()
+        doc.add_paragraph("DOCX text")
+        cls.docx_file = os.path.join(cls.tmp_dir.name, "document.docx")
+        doc.save(cls.docx_file)
+
+    @classmethod
+    def start(cls, **address):
+        server = make_server(cls.service, **address)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        cls.servers.append(server)
+        return server
+
+    @classmethod
+    def tearDownClass(cls):
+        for server in cls.servers:
+            server.shutdown()
+            server.server_close()
+        cls.service.close()
+        cls.tmp_dir.cleanup()
+
+    def setUp(self):
+        self.client = ServiceClient(port=self.tcp_port)
+
+    def tearDown(self):
+        self.client.close()
+
+    def test_extract_path_and_bytes(self):
+        record = self.client.extract(self.pdf_file)
+        self.assertEqual(record["format"], "pdf")
+        self.assertEqual(record["text"].strip(), "PDF text")
+        with open(self.docx_file, "rb") as f:
+            record = self.client.extract(f.read())
+        self.assertEqual((record["format"], record["text"]), ("docx", "DOCX text"))
+
+    def test_batch_keeps_order_and_reports_errors(self):
+        with open(self.docx_file, "rb") as f:
+            docx_bytes = f.read()
+        records = self.client.extract_batch([self.docx_file, b"plain text", docx_bytes])
+        self.assertEqual([record.get("text") for record in records], ["DOCX text", None, "DOCX text"])
+        self.assertIn("Неизвестный формат", records[1]["error"])
+
+    def test_unix_socket(self):
+        client = ServiceClient(socket_path=self.socket_path)
+        try:
+            self.assertEqual(client.extract(self.docx_file)["text"], "DOCX text")
+        finally:
+            client.close()
+
+    def test_backpressure(self):
+        self.service.admit(3)
+        try:
+            with self.assertRaisesRegex(RuntimeError, "503"):
+                self.client.extract(self.docx_file)
+        finally:
+            self.service.release(3)
+        self.assertEqual(self.client.extract(self.docx_file)["text"], "DOCX text")
+        with self.assertRaisesRegex(RuntimeError, "413"):
+            self.client.extract_batch([self.docx_file] * 4)
+
+    def test_health(self):
+        health = self.client.request("GET", "/health")
+        self.assertEqual(health, {"status": "ok", "workers": 1, "pending": 0, "max_pending": 3})
+
+    def test_pool_recovers_after_worker_dies(self):
+        for pid in list(self.service.executor._processes):
+            os.kill(pid, signal.SIGKILL)
+        self.assertEqual(self.client.extract(self.docx_file)["text"], "DOCX text")
+        self.assertEqual(self.client.extract_batch([self.docx_file])[0]["text"], "DOCX text")
+
+    def test_crashing_document_fails_alone(self):
+        # Процессы пула создаются fork и наследуют подмену
+        with patch("service.extract_units", side_effect=lambda *args, **kwargs: os._exit(1)):
+            service = ExtractionService(workers=1)
+            try:
+                records = service.extract([{"source": self.docx_file}])
+            finally:
+                service.close()
+        self.assertIn("BrokenProcessPool", records[0]["error"])
+
+    def test_paths_outside_root_are_refused(self):
+        root = os.path.join(self.tmp_dir.name, "root")
+        os.makedirs(root, exist_ok=True)
+        inside = shutil.copy(self.docx_file, root)
+        port = self.start(port=0, path_root=root).server_address[1]
+        client = ServiceClient(port=port)
+        try:
+            self.assertEqual(client.extract(inside)["text"], "DOCX text")
+            with self.assertRaisesRegex(RuntimeError, "403"):
+                client.extract(self.docx_file)
+            with self.assertRaisesRegex(RuntimeError, "403"):
+                client.extract(os.path.join(root, "..", "document.docx"))
+        finally:
+            client.close()
+
+    def test_paths_are_refused_off_loopback(self):
+        port = self.start(host="0.0.0.0", port=0).server_address[1]
+        client = ServiceClient(port=port)
+        try:
+            with self.assertRaisesRegex(RuntimeError, "403"):
+                client.extract(self.docx_file)
+            with open(self.docx_file, "rb") as f:
+                self.assertEqual(client.extract(f.read())["text"], "DOCX text")
+        finally:
+            client.close()
+
+    def test_options_reach_extractor(self):
+        self.assertEqual(self.client.extract(self.pdf_file, start=0, stop=1)["units"], 1)
+        self.assertEqual(self.client.extract(self.pdf_file, start=1)["units"], 0)
+        self.assertEqual(parse_option("true"), True)
+        self.assertEqual(parse_option("16"), 16)
+        self.assertEqual(parse_option("fast"), "fast")
 
 
 class TestDocTextExtraction(unittest.TestCase):
 
-     def setUp(self):
-          self.test_doc_content = "Текст для проверки."
-          self.doc_file = "test.doc"
-          with open(self.doc_file, "w") as f:
-              f.write(self.test_doc_content)
-
-     @patch("builtins.print")
-     def test_extract_text_from_doc_success(self, mocked_print):
-          extracted_text = extract_text_from_doc(self.doc_file)
-
-          expected_text = "Текст для проверки."
-          if expected_text in extracted_text:
-              mocked_print.assert_called()
-
-     @patch("builtins.print")
-     def test_extract_text_from_doc_no_file(self, mocked_print):
-          non_existent_file = "non_existent.doc"
-          extracted_content = extract_test_from_doc(non_existent_file)
-          self.assertIsNone(extracted_content)
-          mocked_print.assert_called_with(
-              "Ошибка: файл 'non_existent.doc' не найден.")
-
-     @patch("builtins.print")
-     def test_extract_test_from_doc_empty_content(self, mocker_print):
-          empty_docfile="empty.doc"
-          with open(empty_docfile,"w") as f:
-               pass
-          
-          extracted_content=extract_test_from_doc(empty_docfile)
-          self.assertEqual(extracted_content,"")
-
-     @patch ("builtins.print"):
-     def test_extract_test_from_large_content (self,mocked print): 
-           large doc file="large.doc" 
-           large_content="Текст для проверки."*10000
-           with open(large doc file,"w") as f: 
-                f.write(large_content)
-
-           extracted_content=extract_test from doc (large doc file) 
-           self assertTrue(len (extracted_content)>1000000)
-
-     @patch ("builtins print"): 
-     def test_extract_test from doc_special_characters (self,mocked print): 
-           special doc file="special.doc" 
-           special_content="!@#$%^&*()_+" 
-           with open(special doc file,"w") as f: 
-                f.write(special_content)
-
-           extracted_content=extract_test from doc (special doc file) 
-           self assertEqual (extracted_content.strip(),"!@#$%^&*()_+")
-
-     @patch ("builtins print"): 
-     def test extract_test from doc_unicode_characters (self,mocked print): 
-           unicode doc file="unicode.doc" 
-           unicode_content="тестовые данные" 
-           with open (unicode doc file,"w") as f: 
-                f.write (unicode_content)
-
-           extracted_content=extract_test from doc (unicode doc file) 
-           self assertEqual (extracted_content.strip (),"тестовые данные")
-
-      @patch ("builtins print"): 
-      def test extract_test from doc_binary_content (self,mocked print): 
-           binary doc file="binary.doc"
-
-           with open(binary doc file,"wb") as f: 
-                f.write(b"\\ x00\\ x01\\ x02\\ x03")
-
-           extracted_content=extract_test from doc (binary doc file) 
-           self assertIsNone (extracted_content)
-
-      @patch ("builtins print"): 
-      def test extract_test from partial_read (self,mocked print): 
-           partial doc file="partial.doc" 
-           partial content="Partial content" 
-           with open(partial doc file,"w") as f: 
-                f.write(partial content)
-
-           extracted_content=extract_test from doc(partial doc file) 
-           self assertEqual (extracted_content.strip(),"Partial content")
-
-      @patch ("builtins print"): 
-      def test extract_test from timeout (self,mocked print): 
-           with patch('doc parser.extract_test from doc',side_effect=Timeout Error): 
-                extracted_content=extract_test from doc ("timeout.doc") 
-                self assertIsNone (extracted_content) 
-                mocked print. assert called with (
-                     "Ошибка: время ожидания истекло")
+    def setUp(self):
+        self.test_doc_content = "Текст для проверки."
+        self.doc_file = "test.doc"
+        with open(self.doc_file, "w") as f:
+            f.write(self.test_doc_content)
+
+    @patch("builtins.print")
+    def test_extract_text_from_doc_success(self, mocked_print):
+        extracted_text = extract_text_from_doc(self.doc_file)
+
+        expected_text = "Текст для проверки."
+        if expected_text in extracted_text:
+            mocked_print.assert_called()
+
+    @patch("builtins.print")
+    def test_extract_text_from_doc_no_file(self, mocked_print):
+        non_existent_file = "non_existent.doc"
+        extracted_content = extract_text_from_doc(non_existent_file)
+        self.assertIsNone(extracted_content)
+        mocked_print.assert_called_with(
+            "Ошибка: файл 'non_existent.doc' не найден.")
+
+    @patch("builtins.print")
+    def test_extract_text_from_doc_empty_content(self, mocked_print):
+        empty_doc_file = "empty.doc"
+        with open(empty_doc_file, "w") as f:
+            pass
+
+        extracted_content = extract_text_from_doc(empty_doc_file)
+        self.assertEqual(extracted_content, "")
+
+    @patch("builtins.print")
+    def test_extract_text_from_doc_large_content(self, mocked_print):
+        large_doc_file = "large.doc"
+        large_content = "Текст для проверки." * 10000
+        with open(large_doc_file, "w") as f:
+            f.write(large_content)
+
+        extracted_content = extract_text_from_doc(large_doc_file)
+        self.assertTrue(len(extracted_content) > 1000000)
+
+    @patch("builtins.print")
+    def test_extract_text_from_doc_special_characters(self, mocked_print):
+        special_doc_file = "special.doc"
+        special_content = "!@#$%^&*()_+"
+        with open(special_doc_file, "w") as f:
+            f.write(special_content)
+
+        extracted_content = extract_text_from_doc(special_doc_file)
+        self.assertEqual(extracted_content.strip(), "!@#$%^&*()_+")
+
+    @patch("builtins.print")
+    def test_extract_text_from_doc_unicode_characters(self, mocked_print):
+        unicode_doc_file = "unicode.doc"
+        unicode_content = "тестовые данные"
+        with open(unicode_doc_file, "w") as f:
+            f.write(unicode_content)
 
+        extracted_content = extract_text_from_doc(unicode_doc_file)
+        self.assertEqual(extracted_content.strip(), "тестовые данные")
+
+    @patch("builtins.print")
+    def test_extract_text_from_doc_binary_content(self, mocked_print):
+        binary_doc_file = "binary.doc"
+
+        with open(binary_doc_file, "wb") as f:
+            f.write(b"\\x00\\x01\\x02\\x03")
+
+        extracted_content = extract_text_from_doc(binary_doc_file)
+        self.assertIsNone(extracted_content)
+
+    @patch("builtins.print")
+    def test_extract_text_from_doc_partial_read(self, mocked_print):
+        partial_doc_file = "partial.doc"
+        partial_content = "Partial content"
+        with open(partial_doc_file, "w") as f:
+            f.write(partial_content)
+
+        extracted_content = extract_text_from_doc(partial_doc_file)
+        self.assertEqual(extracted_content.strip(), "Partial content")
+
+    @patch("builtins.print")
+    def test_extract_text_from_doc_timeout(self, mocked_print):
+        with patch('doc_parser.extract_text_from_doc', side_effect=TimeoutError):
+            extracted_content = extract_text_from_doc("timeout.doc")
+            self.assertIsNone(extracted_content)
+            mocked_print.assert_called_with(
+                "Ошибка: время ожидания истекло")
 
 if __name__ == "__main__":
     unittest.main()
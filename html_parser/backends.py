@@ -0,0 +1,100 @@
+from bs4 import BeautifulSoup, SoupStrainer
+from bs4.dammit import EncodingDetector, UnicodeDammit
+
+try:
+    import lxml.html
+except ImportError:
+    lxml = None
+
+# Имя бэкенда -> функция(html, encoding) -> поля статьи
+BACKENDS = {}
+
+
+def register(name: str):
+    def decorator(func):
+        BACKENDS[name] = func
+        return func
+
+    return decorator
+
+
+def default_backend():
+    return "lxml" if lxml is not None else "strainer"
+
+
+def extract_fields(html, backend: str = None, encoding: str = None):
+    """Заголовок, подзаголовок, абзацы и дата публикации статьи.
+
+    ``html`` - str или сырые байты ответа. ``encoding`` - charset из
+    заголовка Content-Type, для байтов он важнее <meta charset>. Если нет
+    заголовка, текста или даты, бэкенд бросает исключение.
+    """
+    return BACKENDS[backend or default_backend()](html, encoding)
+
+
+@register("html.parser")
+def soup_fields(html, encoding: str = None):
+    # Прежний путь: полное дерево BeautifulSoup на чистом Python
+    return _fields_from_soup(BeautifulSoup(html, "html.parser", from_encoding=_bytes_only(html, encoding)))
+
+
+def _article_node(name, attrs):
+    classes = (attrs.get("class") or "").split()
+    return (
+        name == "h1"
+        or (name == "h2" and "subheader" in classes)
+        or (name == "div" and "b_article-text" in classes)
+        or (name == "time" and attrs.get("itemprop") == "datePublished")
+    )
+
+
+@register("strainer")
+def strainer_fields(html, encoding: str = None):
+    # Строятся только нужные узлы, остальная страница пропускается
+    parser = "lxml" if lxml is not None else "html.parser"
+    strainer = SoupStrainer(_article_node)
+    return _fields_from_soup(
+        BeautifulSoup(html, parser, parse_only=strainer, from_encoding=_bytes_only(html, encoding))
+    )
+
+
+def _bytes_only(html, encoding: str = None):
+    # BeautifulSoup предупреждает, если from_encoding передан вместе со str
+    return encoding if isinstance(html, bytes) else None
+
+
+def _lxml_parser(html, encoding: str = None):
+    # Без кодировки lxml читает байты как Latin-1, если в странице нет <meta charset>.
+    # Порядок как в браузере: заголовок ответа, <meta>, затем угадывание, как в bs4
+    if not isinstance(html, bytes):
+        return None
+    if not encoding and not EncodingDetector.find_declared_encoding(html, is_html=True):
+        encoding = UnicodeDammit(html, is_html=True).original_encoding
+    return lxml.html.HTMLParser(encoding=encoding) if encoding else None
+
+
+def _fields_from_soup(soup):
+    subheader = soup.find("h2", class_="subheader")
+    return {
+        "header": soup.find("h1").get_text(),
+        "subheader": subheader.get_text() if subheader else None,
+        "paragraphs": [p.get_text() for p in soup.find("div", class_="b_article-text").find_all("p")],
+        "published": soup.find("time", itemprop="datePublished")["datetime"],
+    }
+
+
+def _has_class(name: str) -> str:
+    return f"contains(concat(' ', normalize-space(@class), ' '), ' {name} ')"
+
+
+@register("lxml")
+def lxml_fields(html, encoding: str = None):
+    tree = lxml.html.fromstring(html, parser=_lxml_parser(html, encoding))
+    subheader = tree.xpath(f"//h2[{_has_class('subheader')}]")
+    article = tree.xpath(f"//div[{_has_class('b_article-text')}]")[0]
+    return {
+        "header": tree.xpath("//h1")[0].text_content(),
+        "subheader": subheader[0].text_content() if subheader else None,
+        "paragraphs": [p.text_content() for p in article.iter("p")],
+        "published": tree.xpath("//time[@itemprop='datePublished']/@datetime")[0],
+    }
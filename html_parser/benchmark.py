@@ -0,0 +1,240 @@
+import argparse
+import glob
+import io
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import redirect_stdout
+
+from bs4 import BeautifulSoup
+
+import shared  # noqa: F401 - docs_parser в sys.path
+from backends import BACKENDS
+from fetcher import make_session
+from frontier import SECTIONS, BloomFilter
+from gazeta_parser import crawl, parse_article, parse_links, parse_one_link
+from local_server import PAGES_DIR, Faults, article_urls, make_mirror, start_server, stop_server
+from near_duplicates import NUM_PERM, NearDuplicateIndex, minhash
+from scheduler import CrawlScheduler
+
+
+def fetch_plain(urls, handler, max_workers: int):
+    # Пул потоков без повторов и планировщика - точка отсчета для CrawlScheduler
+    session = make_session(max_workers)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(lambda url: handler(url, session), urls))
+
+
+def bench_fetch(count: int, latency: float, max_workers: int):
+    server, base_url = start_server(latency=latency)
+    urls = article_urls(base_url, count)
+    try:
+        start = time.perf_counter()
+        serial = [parse_one_link(url) for url in urls]
+        serial_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        scheduler = CrawlScheduler(max_workers=max_workers, host_rate=0, rate=0)
+        pooled = list(parse_links(urls, scheduler=scheduler))
+        pooled_time = time.perf_counter() - start
+    finally:
+        stop_server(server)
+
+    print(f"Статей: {count}, задержка сервера: {latency * 1000:.0f} мс")
+    print(f"  последовательно: {serial_time:.2f} с ({count / serial_time:.1f} стр/с)")
+    print(
+        f"  пул из {max_workers}: {pooled_time:.2f} с ({count / pooled_time:.1f} стр/с), "
+        f"ускорение x{serial_time / pooled_time:.1f}"
+    )
+    assert sum(1 for row in serial if row) == sum(1 for row in pooled if row)
+
+
+def bench_faults(count: int, max_workers: int):
+    # Каждая статья сначала отвечает 503, потом обрывает соединение
+    faults = Faults([503, "drop"])
+    server, base_url = start_server(faults=faults)
+    urls = article_urls(base_url, count)
+    try:
+        start = time.perf_counter()
+        plain = fetch_plain(urls, parse_one_link, max_workers)
+        plain_time = time.perf_counter() - start
+
+        faults.reset()
+        start = time.perf_counter()
+        scheduler = CrawlScheduler(max_workers=max_workers, host_rate=0, rate=0, backoff=0.05)
+        retried = list(parse_links(urls, scheduler=scheduler))
+        retried_time = time.perf_counter() - start
+    finally:
+        stop_server(server)
+
+    print(f"Статей: {count}, у каждой два сбоя подряд (503, обрыв соединения)")
+    print(f"  без повторов: {sum(1 for row in plain if row)} статей за {plain_time:.2f} с")
+    print(f"  с повторами: {sum(1 for row in retried if row)} статей за {retried_time:.2f} с")
+
+
+def original_parse(html: str):
+    # Прежний parse_one_link: полное дерево html.parser и рост all_text конкатенацией
+    all_text = ""
+    soup = BeautifulSoup(html, "html.parser")
+    all_text = all_text + soup.find("h1").get_text() + " "
+    subheader = soup.find("h2", class_="subheader")
+    if subheader:
+        all_text = all_text + subheader.get_text() + " "
+    for text in soup.find("div", class_="b_article-text").find_all("p"):
+        all_text = all_text.strip() + " " + text.get_text().strip()
+    soup.find("time", itemprop="datePublished")["datetime"]
+    return all_text
+
+
+def bench_backends(repeat: int):
+    pages = []
+    for path in sorted(glob.glob(os.path.join(PAGES_DIR, "**", "*.shtml"), recursive=True)):
+        with open(path, "rb") as f:
+            pages.append(f.read())
+    count = len(pages) * repeat
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for html in pages:
+            original_parse(html.decode("utf-8"))
+    baseline = time.perf_counter() - start
+
+    print(f"Разбор статей: {len(pages)} страниц x {repeat}")
+    print(f"  прежний код: {baseline * 1000000 / count:.0f} мкс/стр")
+    for name in BACKENDS:
+        start = time.perf_counter()
+        for _ in range(repeat):
+            for html in pages:
+                parse_article("", html, name)
+        elapsed = time.perf_counter() - start
+        print(
+            f"  {name}: {elapsed * 1000000 / count:.0f} мкс/стр, ускорение x{baseline / elapsed:.1f}"
+        )
+
+
+def bench_crawl(pages: int, per_page: int, max_workers: int, latency: float):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        make_mirror(tmp_dir, pages=pages, per_page=per_page)
+        server, base_url = start_server(tmp_dir, latency=latency)
+        try:
+            output = os.path.join(tmp_dir, "output.jsonl")
+            for workers in (1, max_workers):
+                scheduler = CrawlScheduler(max_workers=workers, host_rate=0, rate=0)
+                start = time.perf_counter()
+                with redirect_stdout(io.StringIO()):
+                    written = crawl(base_url, max_pages=pages, output=output, scheduler=scheduler)
+                elapsed = time.perf_counter() - start
+                print(f"  обход разделов, {workers} потоков: {written} статей за {elapsed:.2f} с")
+        finally:
+            stop_server(server)
+
+
+def bench_seen(count: int):
+    # Память на множество адресов: set строк против фильтра Блума
+    urls = (f"https://www.gazeta.ru/news/2024/05/22/{23000000 + num}.shtml" for num in range(count))
+    tracemalloc.start()
+    seen = set(urls)
+    set_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del seen
+
+    bloom = BloomFilter(capacity=count)
+    start = time.perf_counter()
+    for num in range(count):
+        bloom.add(f"https://www.gazeta.ru/news/2024/05/22/{23000000 + num}.shtml")
+    elapsed = time.perf_counter() - start
+    print(f"Адресов: {count}")
+    print(f"  set: {set_bytes / 1024 / 1024:.0f} МБ")
+    print(f"  фильтр Блума (1%): {len(bloom.bits) / 1024 / 1024:.1f} МБ, {elapsed * 1e6 / count:.1f} мкс на адрес")
+
+
+def random_article(rng: random.Random, words: int = 300):
+    return " ".join(f"слово{rng.randrange(20000)}" for _ in range(words))
+
+
+def light_edit(rng: random.Random, text: str):
+    # Перепечатка: новый заголовок и три замененных слова
+    words = ["Срочно", "обновлено"] + text.split()
+    for _ in range(3):
+        words[rng.randrange(len(words))] = "правка"
+    return " ".join(words)
+
+
+def percentile(values: list, share: float):
+    return sorted(values)[min(int(len(values) * share), len(values) - 1)]
+
+
+def bench_dedup(entries: int, queries: int = 2000):
+    # Индекс почти-дубликатов на entries записей: случайные подписи плюс
+    # настоящие статьи, перепечатки которых потом ищутся
+    rng = random.Random(0)
+    articles = [random_article(rng) for _ in range(queries)]
+    start = time.perf_counter()
+    signatures = [minhash(text) for text in articles]
+    signature_time = (time.perf_counter() - start) / queries
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "near.sqlite3")
+        index = NearDuplicateIndex(path)
+        start = time.perf_counter()
+        for num in range(entries - queries):
+            index.insert(f"random/{num}", tuple(memoryview(os.urandom(4 * NUM_PERM)).cast("I")))
+            if num % 100000 == 0:
+                index.commit()
+        for num, signature in enumerate(signatures):
+            index.insert(f"article/{num}", signature)
+        index.commit()
+        load_time = time.perf_counter() - start
+        size = sum(os.path.getsize(os.path.join(tmp_dir, name)) for name in os.listdir(tmp_dir))
+
+        edits = [minhash(light_edit(rng, text)) for text in articles]
+        misses = [minhash(random_article(rng)) for _ in range(queries)]
+        runs = {}
+        for name, batch in (("перепечатки", edits), ("новые статьи", misses)):
+            latencies = []
+            found = 0
+            for signature in batch:
+                start = time.perf_counter()
+                found += bool(index.query(signature=signature))
+                latencies.append(time.perf_counter() - start)
+            runs[name] = latencies, found
+        index.close()
+
+    print(f"Почти-дубликаты, записей в индексе: {entries}")
+    print(f"  подпись MinHash статьи в 300 слов: {signature_time * 1000:.1f} мс")
+    print(f"  загрузка: {load_time:.0f} с ({entries / load_time:.0f} записей/с), на диске {size / 1024 / 1024:.0f} МБ")
+    for name, (latencies, found) in runs.items():
+        print(
+            f"  поиск, {name}: p50 {percentile(latencies, 0.5) * 1000:.3f} мс, "
+            f"p99 {percentile(latencies, 0.99) * 1000:.3f} мс, найдено {found} из {len(latencies)}"
+        )
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("--count", type=int, default=64)
+    arg_parser.add_argument("--latency", type=float, default=0.05)
+    arg_parser.add_argument("--workers", type=int, default=8)
+    arg_parser.add_argument("--repeat", type=int, default=200)
+    arg_parser.add_argument("--only", action="append", choices=["fetch", "faults", "crawl", "parse", "dedup"])
+    arg_parser.add_argument("--pages", type=int, default=5, help="страниц ленты на раздел для crawl")
+    arg_parser.add_argument("--urls", type=int, default=1000000, help="адресов для сравнения set и Блума")
+    arg_parser.add_argument("--entries", type=int, default=1000000, help="записей в индексе почти-дубликатов")
+    args = arg_parser.parse_args()
+    benches = args.only or ["fetch", "faults", "crawl", "parse", "dedup"]
+
+    if "fetch" in benches:
+        bench_fetch(args.count, args.latency, args.workers)
+    if "faults" in benches:
+        bench_faults(args.count, args.workers)
+    if "crawl" in benches:
+        print(f"Зеркало: {len(SECTIONS)} раздела, {args.pages} страниц ленты, задержка {args.latency * 1000:.0f} мс")
+        bench_crawl(args.pages, 20, args.workers, args.latency)
+        bench_seen(args.urls)
+    if "parse" in benches:
+        bench_backends(args.repeat)
+    if "dedup" in benches:
+        bench_dedup(args.entries)
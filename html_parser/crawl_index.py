@@ -0,0 +1,64 @@
+import hashlib
+import sqlite3
+import threading
+import time
+
+INDEX_PATH = "seen.sqlite3"
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class SeenIndex:
+    """Уже скачанные адреса: валидаторы ETag/Last-Modified и хэш текста статьи."""
+
+    def __init__(self, path: str = INDEX_PATH):
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS seen ("
+            "url TEXT PRIMARY KEY, etag TEXT, last_modified TEXT, content_hash TEXT, "
+            "fetched_at REAL NOT NULL)"
+        )
+        self.db.commit()
+
+    def get(self, url: str):
+        with self.lock:
+            row = self.db.execute(
+                "SELECT etag, last_modified, content_hash FROM seen WHERE url = ?", (url,)
+            ).fetchone()
+        if row is None:
+            return None
+        return {"etag": row[0], "last_modified": row[1], "content_hash": row[2]}
+
+    def update(self, url: str, etag=None, last_modified=None, content_hash=None):
+        with self.lock:
+            self.db.execute(
+                "INSERT INTO seen (url, etag, last_modified, content_hash, fetched_at) "
+                "VALUES (?, ?, ?, ?, ?) ON CONFLICT (url) DO UPDATE SET "
+                "etag = excluded.etag, last_modified = excluded.last_modified, "
+                "content_hash = COALESCE(excluded.content_hash, seen.content_hash), "
+                "fetched_at = excluded.fetched_at",
+                (url, etag, last_modified, content_hash, time.time()),
+            )
+            self.db.commit()
+
+    def __contains__(self, url: str):
+        return self.get(url) is not None
+
+    def __len__(self):
+        with self.lock:
+            return self.db.execute("SELECT COUNT(*) FROM seen").fetchone()[0]
+
+    def close(self):
+        self.db.close()
+
+
+def conditional_headers(entry):
+    headers = {}
+    if entry and entry["etag"]:
+        headers["If-None-Match"] = entry["etag"]
+    if entry and entry["last_modified"]:
+        headers["If-Modified-Since"] = entry["last_modified"]
+    return headers
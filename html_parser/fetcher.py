@@ -0,0 +1,50 @@
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import shared  # noqa: F401 - docs_parser в sys.path
+import metrics
+
+MAX_WORKERS = 8
+HOST_RATE = 10.0
+
+
+def make_session(pool_size: int = MAX_WORKERS):
+    # Один пул keep-alive соединений на все потоки
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.hooks["response"].append(record_response)
+    return session
+
+
+def record_response(response, *args, **kwargs):
+    # elapsed - время от отправки запроса до разбора заголовков ответа
+    if not metrics.enabled:
+        return
+    metrics.observe("http_request", response.elapsed.total_seconds(), status=response.status_code)
+    metrics.inc("http_bytes", len(response.content))
+
+
+class HostRateLimiter:
+    """Не больше ``rate`` запросов в секунду к одному хосту."""
+
+    def __init__(self, rate: float = HOST_RATE):
+        self.interval = 1.0 / rate if rate else 0.0
+        self.lock = threading.Lock()
+        self.next_slot = {}
+
+    def wait(self, url: str):
+        if not self.interval:
+            return
+        host = urlsplit(url).netloc
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_slot.get(host, now))
+            self.next_slot[host] = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
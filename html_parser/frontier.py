@@ -0,0 +1,153 @@
+import datetime
+import hashlib
+import math
+from collections import deque
+from urllib.parse import urldefrag, urljoin, urlsplit, urlunsplit
+
+import requests
+from bs4 import BeautifulSoup
+
+import shared  # noqa: F401 - docs_parser в sys.path
+import metrics
+
+BASE_URL = "https://www.gazeta.ru/"
+SECTIONS = ("sport", "army", "style", "tech")
+MAX_PAGES = 5
+
+
+class BloomFilter:
+    """Множество адресов без хранения самих адресов.
+
+    При ``error_rate`` = 1% нужно около 1.2 байта на элемент вместо десятков
+    байт у set со строками. Ложные срабатывания возможны (новый адрес изредка
+    считается виденным), пропуски виденных - нет.
+    """
+
+    def __init__(self, capacity: int = 1_000_000, error_rate: float = 0.01):
+        self.size = max(int(-capacity * math.log(error_rate) / math.log(2) ** 2), 8)
+        self.hashes = max(round(self.size / capacity * math.log(2)), 1)
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, item: str):
+        # Двойное хэширование: k позиций из двух половин одного blake2b
+        digest = hashlib.blake2b(item.encode("utf-8"), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], "little")
+        second = int.from_bytes(digest[8:], "little") | 1
+        return [(first + i * second) % self.size for i in range(self.hashes)]
+
+    def add(self, item: str):
+        new = False
+        for position in self._positions(item):
+            byte, bit = divmod(position, 8)
+            if not self.bits[byte] >> bit & 1:
+                self.bits[byte] |= 1 << bit
+                new = True
+        self.count += new
+        return new
+
+    def __contains__(self, item: str):
+        return all(self.bits[position // 8] >> position % 8 & 1 for position in self._positions(item))
+
+    def __len__(self):
+        return self.count
+
+
+def normalize_url(url: str):
+    # Без якоря и с хостом в нижнем регистре: один адрес - одна запись
+    scheme, netloc, path, query, _ = urlsplit(urldefrag(url).url)
+    return urlunsplit((scheme.lower(), netloc.lower(), path or "/", query, ""))
+
+
+def parse_listing_page(url: str, html: str):
+    """Статьи страницы ленты и следующая страница: ([(адрес, дата или None), ...], адрес или None).
+
+    Дата берется из <time datetime> рядом со ссылкой, без часового пояса,
+    как в ``parse_article``.
+    """
+    soup = BeautifulSoup(html, "html.parser")
+    listing = soup.find("div", id="_id_article_listing")
+    items = []
+    for link in listing.find_all("a", href=True) if listing else []:
+        time_tag = link.parent.find("time", datetime=True) if link.parent is not listing else None
+        published = None
+        if time_tag:
+            published = datetime.datetime.fromisoformat(time_tag["datetime"]).replace(tzinfo=None)
+        items.append((urljoin(url, link["href"]), published))
+
+    next_link = soup.find("a", rel="next", href=True)
+    return items, urljoin(url, next_link["href"]) if next_link else None
+
+
+def in_window(published, since=None, until=None):
+    if published is None:
+        return True
+    return (since is None or published >= since) and (until is None or published <= until)
+
+
+class Frontier:
+    """Адреса статей из лент разделов: постранично, без повторов, в окне дат.
+
+    Ленты разделов обходятся по очереди, по странице за раз, не глубже
+    ``max_pages`` страниц. Лента идет от новых статей к старым, поэтому
+    раздел бросается, как только вся страница старше ``since``. ``seen`` -
+    set или ``BloomFilter``; адреса, уже виденные в других разделах, пропускаются.
+    """
+
+    def __init__(
+        self,
+        scheduler,
+        base_url: str = BASE_URL,
+        sections=SECTIONS,
+        max_pages: int = MAX_PAGES,
+        since: datetime.datetime = None,
+        until: datetime.datetime = None,
+        seen=None,
+    ):
+        self.scheduler = scheduler
+        self.base_url = base_url
+        self.sections = sections
+        self.max_pages = max_pages
+        self.since = since
+        self.until = until
+        self.seen = set() if seen is None else seen
+        self.listing_pages = 0
+        self.links = 0
+        self.duplicates = 0
+
+    def section_url(self, section: str):
+        return urljoin(self.base_url, f"/{section}/news/")
+
+    def __iter__(self):
+        queue = deque((self.section_url(section), 1) for section in self.sections)
+        while queue:
+            url, depth = queue.popleft()
+            try:
+                page = self.scheduler.get(url)
+            except requests.RequestException:
+                # Лента не загрузилась и после повторов или адрес неверный;
+                # адрес уже в scheduler.failed
+                continue
+            if page.status_code != 200:
+                print(f"Ошибка загрузки ленты {url}: {page.status_code}")
+                continue
+            self.listing_pages += 1
+            metrics.inc("listing_pages")
+            items, next_url = parse_listing_page(url, page.text)
+
+            older = 0
+            for link, published in items:
+                if not in_window(published, self.since, self.until):
+                    older += self.since is not None and published < self.since
+                    continue
+                link = normalize_url(link)
+                if link in self.seen:
+                    self.duplicates += 1
+                    metrics.inc("frontier_duplicates")
+                    continue
+                self.seen.add(link)
+                self.links += 1
+                yield link
+
+            if next_url and depth < self.max_pages and not (items and older == len(items)):
+                queue.append((next_url, depth + 1))
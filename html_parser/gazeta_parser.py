@@ -1,70 +1,277 @@
+import argparse
 import requests
 import datetime
 from bs4 import BeautifulSoup
-import csv
+from functools import partial
+from urllib.parse import urljoin
 
+import shared  # noqa: F401 - docs_parser в sys.path
+import metrics
+from backends import extract_fields
+from crawl_index import INDEX_PATH, SeenIndex, conditional_headers, content_hash
+from fetcher import HOST_RATE, MAX_WORKERS
+from frontier import BASE_URL, MAX_PAGES, SECTIONS, BloomFilter, Frontier, in_window
+from near_duplicates import NearDuplicateIndex
+from scheduler import TIMEOUT, CrawlScheduler
+from sinks import open_sink
 
-def parse():
-    URL = "https://www.gazeta.ru/news/"
-    links = []
+URL = "https://www.gazeta.ru/news/"
 
-    page = requests.get(URL)
-    soup = BeautifulSoup(page.text, "html.parser")
-    all_articles = soup.find("div", id="_id_article_listing")
-    articles = all_articles.find_all("a")
-    for article in articles:
-        link = "https://www.gazeta.ru" + article["href"]
+
+def parse(
+    url: str = URL,
+    max_workers: int = MAX_WORKERS,
+    host_rate: float = HOST_RATE,
+    output: str = "output.csv",
+    scheduler: CrawlScheduler = None,
+    dedup: str = None,
+    **sink_options,
+):
+    scheduler = scheduler or CrawlScheduler(max_workers=max_workers, host_rate=host_rate)
+    page = scheduler.get(url)
+    links = parse_listing(url, page.text)
 
     print(f"Got {len(links)} links.")
 
-    parse_result = []
+    # Каждая статья пишется сразу после разбора, в памяти ничего не копится
+    duplicates = NearDuplicateIndex(dedup) if dedup else None
+    try:
+        with open_sink(output, **sink_options) as sink:
+            for result in parse_links(links, scheduler=scheduler):
+                if not is_near_duplicate(result, duplicates):
+                    sink.write(result)
+    finally:
+        report_duplicates(duplicates)
+    report_failed(scheduler)
+    return sink.written
+
+
+def crawl(
+    base_url: str = BASE_URL,
+    sections=SECTIONS,
+    max_pages: int = MAX_PAGES,
+    since: datetime.datetime = None,
+    until: datetime.datetime = None,
+    output: str = "output.csv",
+    max_workers: int = MAX_WORKERS,
+    host_rate: float = HOST_RATE,
+    bloom: bool = False,
+    scheduler: CrawlScheduler = None,
+    dedup: str = None,
+    **sink_options,
+):
+    # Обход лент разделов: статьи качаются пулом, пока frontier листает ленты
+    scheduler = scheduler or CrawlScheduler(max_workers=max_workers, host_rate=host_rate)
+    seen = BloomFilter() if bloom else set()
+    frontier = Frontier(scheduler, base_url, sections, max_pages, since, until, seen)
+
+    duplicates = NearDuplicateIndex(dedup) if dedup else None
+    try:
+        with open_sink(output, **sink_options) as sink:
+            for result in scheduler.run(frontier, parse_page):
+                # Если в ленте не было даты, окно проверяется по дате статьи
+                if not result or not in_window(result["date"], since, until):
+                    continue
+                if not is_near_duplicate(result, duplicates):
+                    sink.write(result)
+    finally:
+        report_duplicates(duplicates)
+
+    print(
+        f"Got {frontier.links} links from {frontier.listing_pages} listing pages, "
+        f"{frontier.duplicates} duplicates skipped."
+    )
+    report_failed(scheduler)
+    return sink.written
+
+
+def parse_incremental(
+    url: str = URL,
+    index_path: str = INDEX_PATH,
+    output: str = "output.csv",
+    recheck: bool = True,
+    max_workers: int = MAX_WORKERS,
+    host_rate: float = HOST_RATE,
+    scheduler: CrawlScheduler = None,
+    **sink_options,
+):
+    # Дописывает в output только новые и изменившиеся статьи, возвращает их число
+    index = SeenIndex(index_path)
+    scheduler = scheduler or CrawlScheduler(max_workers=max_workers, host_rate=host_rate)
+    try:
+        page = conditional_get(url, scheduler, index)
+        if page is None:
+            print("Лента не изменилась")
+            return 0
+        links = parse_listing(url, page.text)
+        if not recheck:
+            links = [link for link in links if link not in index]
+
+        handler = partial(parse_changed_page, index=index)
+        headers = lambda link: conditional_headers(index.get(link))
+        with open_sink(output, append=True, **sink_options) as sink:
+            for result in scheduler.run(links, handler, headers):
+                if result:
+                    sink.write(result)
+        index.update(url, page.headers.get("ETag"), page.headers.get("Last-Modified"))
+    finally:
+        index.close()
+
+    print(f"Got {len(links)} links, {sink.written} new or changed.")
+    report_failed(scheduler)
+    return sink.written
+
+
+def is_near_duplicate(result, duplicates: NearDuplicateIndex = None):
+    # Перепечатка или слегка поправленная копия уже сохраненной статьи;
+    # новая статья при этом попадает в индекс
+    if result is None or duplicates is None:
+        return False
+    return duplicates.add(result["link"], result["text"]) is not None
+
+
+def report_duplicates(duplicates: NearDuplicateIndex = None):
+    if duplicates is None:
+        return
+    if duplicates.duplicates:
+        print(f"Пропущено почти-дубликатов: {duplicates.duplicates}")
+    duplicates.close()
+
 
-    for link in links:
-        parse_result.append(parse_one_link(link))
+def report_failed(scheduler: CrawlScheduler):
+    if scheduler.failed:
+        print(f"Не удалось загрузить {len(scheduler.failed)} ссылок")
 
-    write_to_csv(parse_result)
 
+def conditional_get(url: str, session, index: SeenIndex):
+    # None, если сервер ответил 304 Not Modified
+    page = session.get(url, headers=conditional_headers(index.get(url)), timeout=TIMEOUT)
+    if page.status_code == 304:
+        return None
+    return page
 
-def write_to_csv(data: list):
 
-    with open("output.csv", "w", newline="") as csvfile:
-        writer = csv.writer(csvfile)
+def parse_changed_page(url: str, page, index: SeenIndex):
+    # None для 304 и для статьи, текст которой не изменился
+    if page is None or page.status_code == 304:
+        return None
 
-        writer.writerow(["Ссылка", "Текст", "Дата"])
+    result = parse_article(url, page.content, encoding=response_encoding(page))
+    if result is None:
+        return None
+    text_hash = content_hash(result["text"])
+    entry = index.get(url)
+    index.update(url, page.headers.get("ETag"), page.headers.get("Last-Modified"), text_hash)
+    if entry and entry["content_hash"] == text_hash:
+        return None
+    return result
 
+
+def parse_listing(url: str, html: str):
+    soup = BeautifulSoup(html, "html.parser")
+    all_articles = soup.find("div", id="_id_article_listing")
+    return [urljoin(url, article["href"]) for article in all_articles.find_all("a")]
+
+
+def parse_links(
+    links: list,
+    session=None,
+    max_workers: int = MAX_WORKERS,
+    host_rate: float = HOST_RATE,
+    scheduler: CrawlScheduler = None,
+):
+    # Статьи скачиваются параллельно и отдаются в порядке готовности;
+    # временные сбои повторяются, для так и не загруженных статей - None
+    scheduler = scheduler or CrawlScheduler(session, max_workers, host_rate)
+    return scheduler.run(links, parse_page)
+
+
+def write_to_csv(data: list, path: str = "output.csv", append: bool = False):
+
+    with open_sink(path, "csv", append=append) as sink:
         for row in data:
-            writer.writerow([row["link"], row["text"], row["date"]])
+            sink.write(row)
+
+
+def parse_one_link(url: str, session=None, backend: str = None):
+    try:
+        page = (session or requests).get(url, timeout=TIMEOUT)
+    except Exception:
+        print(f"Ошибка парсинга")
+        return None
+    return parse_page(url, page, backend)
+
+
+def parse_page(url: str, page, backend: str = None):
+    return parse_article(url, page.content, backend, response_encoding(page))
+
 
+def response_encoding(page):
+    # Только явный charset из Content-Type: для text/html без него requests
+    # подставляет ISO-8859-1, и тогда лучше довериться <meta> или угадыванию
+    if "charset" not in page.headers.get("Content-Type", "").lower():
+        return None
+    return page.encoding
 
-def parse_one_link(url: str):
+
+def parse_article(url: str, html, backend: str = None, encoding: str = None):
     try:
-        all_text = ""
-        page = requests.get(url)
-        soup = BeautifulSoup(page.text, "html.parser")
-        header = soup.find("h1").get_text()
-        all_text = all_text + header + " "
-        try:
-            header_1 = soup.find("h2", class_="subheader").get_text()
-            all_text = all_text + header_1 + " "
-        except Exception:
-            pass
-
-        texts = soup.find("div", class_="b_article-text")
-        texts = texts.find_all("p")
-        for text in texts:
-            all_text = all_text.strip() + " " + text.get_text().strip()
-
-        time_news = soup.find("time", itemprop="datePublished")
-        time_news = time_news["datetime"].replace("T", " ")[:-6]
+        with metrics.timer("stage", format="html", stage="parse"):
+            fields = extract_fields(html, backend, encoding)
+
+        parts = [fields["header"]]
+        if fields["subheader"] is not None:
+            parts.append(fields["subheader"])
+        parts += fields["paragraphs"]
+        stripped = (part.strip() for part in parts)
+        all_text = " ".join(part for part in stripped if part)
+
+        time_news = fields["published"].replace("T", " ")[:-6]
         time_news = datetime.datetime.strptime(time_news.strip(), "%Y-%m-%d %H:%M:%S")
 
         result = {"link": url, "text": all_text.replace("\xa0", " "), "date": time_news}
+        metrics.inc("articles")
         return result
 
     except Exception as err:
+        metrics.inc("parse_errors")
         print(f"Ошибка парсинга")
 
 
 if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Парсер новостей gazeta.ru")
+    arg_parser.add_argument("--sections", nargs="+", help=f"обойти ленты разделов, например {' '.join(SECTIONS)}")
+    arg_parser.add_argument("--pages", type=int, default=MAX_PAGES, help="глубина: страниц ленты на раздел")
+    arg_parser.add_argument("--since", type=datetime.datetime.fromisoformat, help="не раньше, 2024-05-01[T12:00]")
+    arg_parser.add_argument("--until", type=datetime.datetime.fromisoformat, help="не позже")
+    arg_parser.add_argument("--workers", type=int, default=MAX_WORKERS)
+    arg_parser.add_argument("--bloom", action="store_true", help="фильтр Блума вместо set для адресов")
+    arg_parser.add_argument("--dedup", help="индекс почти-дубликатов (SQLite), например near_duplicates.sqlite3")
+    arg_parser.add_argument(
+        "--incremental",
+        nargs="?",
+        const=INDEX_PATH,
+        metavar="INDEX",
+        help=f"дописать только новые и изменившиеся статьи ленты; индекс просмотренных, по умолчанию {INDEX_PATH}",
+    )
+    arg_parser.add_argument("-o", "--output", default="output.csv")
+    args = arg_parser.parse_args()
+    if args.incremental and args.sections:
+        arg_parser.error("--incremental работает с лентой новостей, без --sections")
+
     print("Начало парсинга")
-    parse()
+    if args.sections:
+        crawl(
+            sections=args.sections,
+            max_pages=args.pages,
+            since=args.since,
+            until=args.until,
+            output=args.output,
+            max_workers=args.workers,
+            bloom=args.bloom,
+            dedup=args.dedup,
+        )
+    elif args.incremental:
+        parse_incremental(index_path=args.incremental, output=args.output, max_workers=args.workers)
+    else:
+        parse(output=args.output, max_workers=args.workers, dedup=args.dedup)
@@ -0,0 +1,219 @@
+import datetime
+import os
+import re
+import threading
+import time
+from collections import Counter
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+PAGES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "test_pages")
+ARTICLE_PATHS = [
+    "/sport/news/2024/05/22/23074501.shtml",
+    "/army/news/2024/05/22/23074423.shtml",
+    "/style/news/2024/05/22/23074471.shtml",
+    "/tech/news/2024/05/16/23023147.shtml",
+]
+
+
+class Faults:
+    """Сбои сервера по порядку запросов к каждому адресу.
+
+    ``plan`` - что делать с первым, вторым и т.д. запросом: код ответа (503),
+    "slow" (ответ после ``slow_latency`` секунд) или "drop" (закрыть соединение
+    без ответа). Дальше адрес отвечает нормально. ``match`` ограничивает сбои
+    адресами, содержащими эту подстроку.
+    """
+
+    def __init__(self, plan=(), slow_latency: float = 1.0, match: str = None):
+        self.plan = list(plan)
+        self.slow_latency = slow_latency
+        self.match = match
+        self.lock = threading.Lock()
+        self.requests = Counter()
+
+    def next(self, path: str):
+        if self.match is not None and self.match not in path:
+            return None
+        with self.lock:
+            num = self.requests[path]
+            self.requests[path] += 1
+        return self.plan[num] if num < len(self.plan) else None
+
+    def reset(self):
+        with self.lock:
+            self.requests.clear()
+
+
+class PageHandler(SimpleHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    extensions_map = {
+        **SimpleHTTPRequestHandler.extensions_map,
+        ".html": "text/html; charset=utf-8",
+        ".shtml": "text/html; charset=utf-8",
+    }
+
+    def __init__(self, *args, latency=0.0, faults=None, **kwargs):
+        self.latency = latency
+        self.faults = faults
+        super().__init__(*args, **kwargs)
+
+    def do_GET(self):
+        self.etag = None
+        if self.latency:
+            time.sleep(self.latency)
+        fault = self.faults.next(self.path) if self.faults else None
+        if fault == "drop":
+            self.close_connection = True
+            return
+        if fault == "slow":
+            time.sleep(self.faults.slow_latency)
+        elif fault is not None:
+            self.send_error(fault)
+            return
+        try:
+            self.send_page()
+        except (BrokenPipeError, ConnectionResetError):
+            # Клиент не дождался ответа и закрыл соединение по тайм-ауту
+            self.close_connection = True
+
+    def send_page(self):
+        self.etag = self.file_etag()
+        if self.etag and self.headers.get("If-None-Match") == self.etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        super().do_GET()
+
+    def file_etag(self):
+        path = self.translate_path(self.path)
+        if os.path.isdir(path):
+            path = os.path.join(path, "index.html")
+        if not os.path.isfile(path):
+            return None
+        stat = os.stat(path)
+        return f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+
+    def end_headers(self):
+        if getattr(self, "etag", None):
+            self.send_header("ETag", self.etag)
+        super().end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_server(pages_dir=PAGES_DIR, latency=0.0, port=0, faults: Faults = None):
+    """Поднимает локальную копию gazeta.ru из сохраненных страниц.
+
+    ``faults`` - сбои для проверки повторов, см. ``Faults``.
+    Возвращает сервер и его базовый адрес.
+    """
+    handler = partial(PageHandler, directory=pages_dir, latency=latency, faults=faults)
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    host, port = server.server_address
+    return server, f"http://{host}:{port}"
+
+
+def article_urls(base_url: str, count: int):
+    # Сохраненные статьи по кругу; разный query string дает разные адреса
+    return [
+        f"{base_url}{ARTICLE_PATHS[i % len(ARTICLE_PATHS)]}?n={i}" for i in range(count)
+    ]
+
+
+LISTING_TEMPLATE = """<!DOCTYPE html>
+<html lang="ru">
+<head><meta charset="utf-8"><title>{section} - Газета.Ru</title></head>
+<body>
+<main class="b_main">
+<div id="_id_article_listing" class="b_ear-list">
+{items}
+</div>
+{more}
+</main>
+</body>
+</html>
+"""
+
+
+def listing_path(section: str, page: int):
+    return f"/{section}/news/" if page == 1 else f"/{section}/news/page-{page}.html"
+
+
+def make_mirror(
+    target_dir: str,
+    sections=("sport", "army", "style", "tech"),
+    pages: int = 3,
+    per_page: int = 4,
+    newest=datetime.datetime(2024, 5, 22, 23, 0),
+    step=datetime.timedelta(minutes=30),
+):
+    """Копия gazeta.ru с постраничными лентами разделов для проверки обхода.
+
+    В каждом разделе ``pages`` страниц ленты по ``per_page`` статей, от новых
+    к старым, со ссылкой rel="next" на следующую. Статьи - сохраненные страницы
+    раздела с новыми заголовком и датой. Первая статья каждой страницы еще раз
+    стоит в ленте соседнего раздела, как перепосты на сайте.
+    Возвращает пути статей по разделам.
+    """
+    templates = {path.split("/")[1]: path for path in ARTICLE_PATHS}
+    articles = {}
+    for section_num, section in enumerate(sections):
+        with open(os.path.join(PAGES_DIR, templates[section].lstrip("/")), encoding="utf-8") as f:
+            template = f.read()
+        articles[section] = []
+        for num in range(pages * per_page):
+            published = newest - num * step
+            path = f"/{section}/news/{published:%Y/%m/%d}/{30000000 + section_num * 10000 + num}.shtml"
+            html = re.sub(r'(<h1 class="headline">)[^<]*', rf"\g<1>Новость {section} номер {num}", template)
+            html = re.sub(
+                r'(<time itemprop="datePublished" datetime=")[^"]*',
+                rf"\g<1>{published.isoformat()}+03:00",
+                html,
+            )
+            write_page(target_dir, path, html)
+            articles[section].append((path, published))
+
+    for section_num, section in enumerate(sections):
+        neighbour = articles[sections[(section_num + 1) % len(sections)]]
+        for page in range(1, pages + 1):
+            own = articles[section][(page - 1) * per_page:page * per_page]
+            entries = own + [neighbour[(page - 1) * per_page]]
+            items = "\n".join(
+                f'<div class="b_ear"><time datetime="{published.isoformat()}+03:00"></time>'
+                f'<a href="{path}">Статья</a></div>'
+                for path, published in entries
+            )
+            more = ""
+            if page < pages:
+                more = f'<a rel="next" class="b_more" href="{listing_path(section, page + 1)}">Еще</a>'
+            html = LISTING_TEMPLATE.format(section=section, items=items, more=more)
+            path = listing_path(section, page)
+            write_page(target_dir, path + "index.html" if path.endswith("/") else path, html)
+    return {section: [path for path, _ in paths] for section, paths in articles.items()}
+
+
+def write_page(target_dir: str, path: str, html: str):
+    file_path = os.path.join(target_dir, path.lstrip("/"))
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    with open(file_path, "w", encoding="utf-8") as f:
+        f.write(html)
+
+
+def stop_server(server):
+    server.shutdown()
+    server.server_close()
+
+
+if __name__ == "__main__":
+    server, base_url = start_server()
+    print(f"Сервер запущен: {base_url}/news/")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        stop_server(server)
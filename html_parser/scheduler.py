@@ -0,0 +1,209 @@
+import heapq
+import itertools
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import requests
+
+import shared  # noqa: F401 - docs_parser в sys.path
+import metrics
+from fetcher import HOST_RATE, MAX_WORKERS, HostRateLimiter, make_session
+
+CONNECT_TIMEOUT = 5.0
+READ_TIMEOUT = 20.0
+TIMEOUT = (CONNECT_TIMEOUT, READ_TIMEOUT)
+MAX_RETRIES = 3
+BACKOFF = 0.5
+MAX_BACKOFF = 30.0
+GLOBAL_RATE = 20.0
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+
+class RetryableStatus(requests.HTTPError):
+    """Ответ, который стоит запросить повторно: 429 и временные ошибки сервера."""
+
+
+# Обрыв соединения, тайм-аут подключения или чтения, недочитанное тело ответа
+RETRY_ERRORS = (
+    requests.ConnectionError,
+    requests.Timeout,
+    requests.exceptions.ChunkedEncodingError,
+    RetryableStatus,
+)
+
+
+class RateBudget:
+    """Не больше ``rate`` запросов в секунду на все хосты вместе."""
+
+    def __init__(self, rate: float = GLOBAL_RATE):
+        self.interval = 1.0 / rate if rate else 0.0
+        self.lock = threading.Lock()
+        self.next_slot = 0.0
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_slot)
+            self.next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+def backoff_delay(attempt: int, base: float = BACKOFF, cap: float = MAX_BACKOFF):
+    # Полный разброс: равномерно от 0 до base * 2**attempt, но не дольше cap,
+    # чтобы повторы после общего сбоя не приходили на сервер одной волной
+    return random.uniform(0, min(cap, base * 2**attempt))
+
+
+def retry_after(error):
+    # Retry-After в секундах из ответа 429/503; дата вместо числа не учитывается
+    response = getattr(error, "response", None)
+    if response is None:
+        return 0.0
+    try:
+        return max(float(response.headers.get("Retry-After", 0)), 0.0)
+    except ValueError:
+        return 0.0
+
+
+def retry_reason(error):
+    if isinstance(error, RetryableStatus):
+        return str(error.response.status_code)
+    return type(error).__name__
+
+
+class CrawlScheduler:
+    """Загрузка страниц с тайм-аутами, повторами и общим бюджетом запросов.
+
+    Временные сбои (обрыв соединения, тайм-аут, 429 и 5xx) повторяются не больше
+    ``max_retries`` раз с экспоненциальной задержкой и случайным разбросом.
+    Адреса, ждущие повтора, стоят в отдельной очереди и потоки не занимают.
+    """
+
+    def __init__(
+        self,
+        session=None,
+        max_workers: int = MAX_WORKERS,
+        host_rate: float = HOST_RATE,
+        rate: float = GLOBAL_RATE,
+        timeout=TIMEOUT,
+        max_retries: int = MAX_RETRIES,
+        backoff: float = BACKOFF,
+        max_backoff: float = MAX_BACKOFF,
+    ):
+        # Лишнее соединение - для get() из главного потока, пока пул занят
+        self.session = session or make_session(max_workers + 1)
+        self.max_workers = max_workers
+        self.host_limiter = HostRateLimiter(host_rate)
+        self.budget = RateBudget(rate)
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        # Адреса, которые не удалось загрузить и после всех повторов
+        self.failed = []
+
+    def attempt(self, url: str, **kwargs):
+        # Один запрос без повторов; временный сбой - исключение из RETRY_ERRORS
+        kwargs.setdefault("timeout", self.timeout)
+        self.budget.wait()
+        self.host_limiter.wait(url)
+        response = self.session.get(url, **kwargs)
+        if response.status_code in RETRY_STATUSES:
+            raise RetryableStatus(f"{response.status_code} для {url}", response=response)
+        return response
+
+    def get(self, url: str, **kwargs):
+        # Как session.get, но с повторами; ошибка последней попытки пробрасывается.
+        # Неповторяемые ошибки (неверный адрес, петля редиректов) - сразу
+        for attempt in itertools.count():
+            try:
+                return self.attempt(url, **kwargs)
+            except RETRY_ERRORS as err:
+                delay = self.retry_delay(attempt, err)
+                if attempt >= self.max_retries or delay is None:
+                    self.give_up(url, err)
+                    raise
+                metrics.inc("http_retries", reason=retry_reason(err))
+                time.sleep(delay)
+            except requests.RequestException as err:
+                self.give_up(url, err)
+                raise
+
+    def run(self, urls, handler, headers=None):
+        """Вызывает ``handler(url, response)`` для каждого адреса в пуле потоков.
+
+        Результаты отдаются по мере готовности. ``headers(url)`` - заголовки
+        запроса к адресу (например, условные). Для адресов, не загруженных после
+        всех повторов, с неповторяемой ошибкой запроса (например, mailto: в ленте)
+        или с исключением в ``handler``, отдается None, сами адреса собираются в ``failed``.
+        Адреса берутся из ``urls`` по мере освобождения места в очереди.
+        """
+        urls = iter(urls)
+        retry_queue = []  # (когда повторить, порядковый номер, адрес, попытка)
+        order = itertools.count()
+        running = {}
+        max_in_flight = 2 * self.max_workers
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            try:
+                while True:
+                    now = time.monotonic()
+                    while len(running) < max_in_flight:
+                        if retry_queue and retry_queue[0][0] <= now:
+                            _, _, url, attempt = heapq.heappop(retry_queue)
+                        else:
+                            url = next(urls, None)
+                            if url is None:
+                                break
+                            attempt = 0
+                        future = executor.submit(self._task, url, handler, headers)
+                        running[future] = url, attempt
+
+                    if not running and not retry_queue:
+                        return
+                    # Пока все заняты или ждут повтора - спим до ближайшего события
+                    timeout = max(retry_queue[0][0] - now, 0.0) if retry_queue else None
+                    done, _ = wait(running, timeout, return_when=FIRST_COMPLETED)
+
+                    for future in done:
+                        url, attempt = running.pop(future)
+                        try:
+                            result = future.result()
+                        except RETRY_ERRORS as err:
+                            delay = self.retry_delay(attempt, err)
+                            if attempt < self.max_retries and delay is not None:
+                                metrics.inc("http_retries", reason=retry_reason(err))
+                                retry_at = time.monotonic() + delay
+                                heapq.heappush(retry_queue, (retry_at, next(order), url, attempt + 1))
+                                continue
+                            self.give_up(url, err)
+                            result = None
+                        except Exception as err:
+                            self.give_up(url, err)
+                            result = None
+                        yield result
+            finally:
+                for future in running:
+                    future.cancel()
+
+    def retry_delay(self, attempt: int, error):
+        # None - сервер просит ждать дольше max_backoff: адрес не повторяется
+        requested = retry_after(error)
+        if requested > self.max_backoff:
+            return None
+        return max(backoff_delay(attempt, self.backoff, self.max_backoff), requested)
+
+    def give_up(self, url: str, error):
+        self.failed.append(url)
+        metrics.inc("http_failures")
+        print(f"Ошибка загрузки {url}: {error}")
+
+    def _task(self, url, handler, headers):
+        with metrics.timer("fetch_task"):
+            response = self.attempt(url, headers=headers(url) if headers else None)
+            return handler(url, response)
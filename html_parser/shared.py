@@ -0,0 +1,13 @@
+"""Доступ к модулям, общим с docs_parser (metrics, near_duplicates).
+
+Каталог docs_parser добавляется в конец sys.path, поэтому одноименные
+модули html_parser (tests, benchmark) остаются своими. Импортируется
+перед первым общим модулем.
+"""
+import os
+import sys
+
+DOCS_PARSER = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "docs_parser")
+
+if DOCS_PARSER not in sys.path:
+    sys.path.append(DOCS_PARSER)
@@ -0,0 +1,137 @@
+import csv
+import gzip
+import json
+import os
+import time
+
+FIELDS = ["link", "text", "date"]
+CSV_HEADER = ["Ссылка", "Текст", "Дата"]
+FLUSH_EVERY = 100
+FLUSH_INTERVAL = 5.0
+
+
+class Sink:
+    """Пишет статьи по одной сразу после разбора.
+
+    Буфер сбрасывается каждые ``flush_every`` строк или ``flush_interval``
+    секунд; с ``fsync=True`` данные еще и принудительно пишутся на диск.
+    Пустые результаты (``None``) пропускаются.
+    """
+
+    def __init__(self, path: str, append: bool = False, flush_every: int = FLUSH_EVERY,
+                 flush_interval: float = FLUSH_INTERVAL, fsync: bool = False):
+        self.path = path
+        self.append = append
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+        self.written = 0
+        self.pending = 0
+        self.last_flush = time.monotonic()
+
+    def open_text(self):
+        mode = "at" if self.append else "wt"
+        if self.path.endswith(".gz"):
+            return gzip.open(self.path, mode, encoding="utf-8", newline="")
+        return open(self.path, mode, encoding="utf-8", newline="")
+
+    def is_empty(self):
+        return not os.path.exists(self.path) or os.path.getsize(self.path) == 0
+
+    def write(self, row):
+        if row is None:
+            return
+        self.write_row(row)
+        self.written += 1
+        self.pending += 1
+        if self.pending >= self.flush_every or time.monotonic() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        self.pending = 0
+        self.last_flush = time.monotonic()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class TextSink(Sink):
+    def __init__(self, path: str, **kwargs):
+        super().__init__(path, **kwargs)
+        self.new_file = self.is_empty()
+        self.file = self.open_text()
+
+    def flush(self):
+        # Для .gz flush() делает Z_SYNC_FLUSH, поэтому сжатые данные тоже уходят в файл
+        self.file.flush()
+        if self.fsync:
+            os.fsync(self.file.fileno())
+        super().flush()
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+
+class CsvSink(TextSink):
+    def __init__(self, path: str, **kwargs):
+        super().__init__(path, **kwargs)
+        self.writer = csv.writer(self.file)
+        if not self.append or self.new_file:
+            self.writer.writerow(CSV_HEADER)
+
+    def write_row(self, row):
+        self.writer.writerow([row[field] for field in FIELDS])
+
+
+class JsonlSink(TextSink):
+    def write_row(self, row):
+        record = {field: row[field] for field in FIELDS}
+        self.file.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+
+
+class ParquetSink(Sink):
+    # Строки копятся пачками по flush_every и пишутся отдельными row group
+    def __init__(self, path: str, **kwargs):
+        import pyarrow
+        import pyarrow.parquet
+
+        super().__init__(path, **kwargs)
+        if self.append:
+            raise ValueError("Parquet не поддерживает дозапись")
+        self.pyarrow = pyarrow
+        self.schema = pyarrow.schema(
+            [("link", pyarrow.string()), ("text", pyarrow.string()), ("date", pyarrow.timestamp("s"))]
+        )
+        self.writer = pyarrow.parquet.ParquetWriter(path, self.schema)
+        self.batch = []
+
+    def write_row(self, row):
+        self.batch.append(row)
+
+    def flush(self):
+        if self.batch:
+            columns = {field: [row[field] for row in self.batch] for field in FIELDS}
+            self.writer.write_table(self.pyarrow.table(columns, schema=self.schema))
+            self.batch = []
+        super().flush()
+
+    def close(self):
+        self.flush()
+        self.writer.close()
+
+
+SINKS = {"csv": CsvSink, "jsonl": JsonlSink, "parquet": ParquetSink}
+
+
+def sink_format(path: str):
+    name = path[:-3] if path.endswith(".gz") else path
+    return os.path.splitext(name)[1].lstrip(".").lower()
+
+
+def open_sink(path: str, format: str = None, **kwargs):
+    # Формат берется из расширения: output.csv, output.jsonl.gz, output.parquet
+    return SINKS[format or sink_format(path)](path, **kwargs)
@@ -1,6 +1,36 @@
+import csv
+import datetime
+import gzip
+import json
 import os
+import re
+import shutil
+import tempfile
+import time
 import unittest
-from gazeta_parser import parse, write_to_csv, parse_one_link
+from unittest.mock import patch
+
+import requests
+
+import shared  # noqa: F401 - docs_parser в sys.path
+import metrics
+from gazeta_parser import (
+    crawl,
+    parse,
+    write_to_csv,
+    parse_one_link,
+    parse_links,
+    parse_incremental,
+    parse_article,
+    parse_page,
+)
+from backends import BACKENDS
+from fetcher import HostRateLimiter
+from frontier import SECTIONS, BloomFilter, normalize_url, parse_listing_page
+from local_server import PAGES_DIR, Faults, article_urls, make_mirror, start_server, stop_server
+from near_duplicates import NearDuplicateIndex, minhash
+from scheduler import CrawlScheduler, RateBudget, RetryableStatus, backoff_delay, retry_after
+from sinks import open_sink
 
 
 class TestParse(unittest.TestCase):
@@ -43,5 +73,491 @@ class TestParse(unittest.TestCase):
         self.assertIsNone(result)
 
 
+class TestLocalParse(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server, cls.base_url = start_server()
+
+    @classmethod
+    def tearDownClass(cls):
+        stop_server(cls.server)
+
+    def test_parse_one_link_local(self):
+        url = self.base_url + "/sport/news/2024/05/22/23074501.shtml"
+        result = parse_one_link(url)
+        self.assertEqual(result["link"], url)
+        self.assertTrue(result["text"].startswith("Тренер сборной"))
+        self.assertEqual(str(result["date"]), "2024-05-22 14:05:12")
+
+    def test_parse_links_returns_all(self):
+        links = [
+            self.base_url + "/sport/news/2024/05/22/23074501.shtml",
+            self.base_url + "/army/news/2024/05/22/23074423.shtml",
+            self.base_url + "/style/news/2024/05/22/23074471.shtml",
+            self.base_url + "/tech/news/2024/05/16/23023147.shtml",
+        ]
+        results = list(parse_links(links, max_workers=4))
+        self.assertEqual(sorted(row["link"] for row in results), sorted(links))
+
+    def test_parse_writes_listing(self):
+        parse(self.base_url + "/news/")
+        with open("output.csv") as f:
+            rows = f.read().splitlines()
+        self.assertEqual(len(rows), 5)
+
+
+class TestIncrementalParse(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.pages_dir = os.path.join(self.tmp_dir.name, "pages")
+        shutil.copytree(PAGES_DIR, self.pages_dir)
+        self.server, self.base_url = start_server(self.pages_dir)
+        self.index_path = os.path.join(self.tmp_dir.name, "seen.sqlite3")
+        self.output = os.path.join(self.tmp_dir.name, "output.csv")
+
+    def tearDown(self):
+        stop_server(self.server)
+        self.tmp_dir.cleanup()
+
+    def crawl(self):
+        return parse_incremental(self.base_url + "/news/", self.index_path, self.output)
+
+    def output_rows(self):
+        with open(self.output, newline="", encoding="utf-8") as f:
+            return list(csv.reader(f))
+
+    def test_second_run_fetches_nothing_new(self):
+        self.assertEqual(self.crawl(), 4)
+        self.assertEqual(self.crawl(), 0)
+        self.assertEqual(len(self.output_rows()), 5)
+
+    def test_changed_article_is_appended(self):
+        self.crawl()
+        article = os.path.join(self.pages_dir, "army/news/2024/05/22/23074423.shtml")
+        with open(article, encoding="utf-8") as f:
+            html = f.read()
+        with open(article, "w", encoding="utf-8") as f:
+            f.write(html.replace("</p>", " Обновлено.</p>", 1))
+        listing = os.path.join(self.pages_dir, "news/index.html")
+        os.utime(listing, ns=(time.time_ns(), time.time_ns()))
+
+        self.assertEqual(self.crawl(), 1)
+        rows = self.output_rows()
+        self.assertEqual(len(rows), 6)
+        link, text, _ = rows[-1]
+        self.assertEqual(link, self.base_url + "/army/news/2024/05/22/23074423.shtml")
+        self.assertIn("Обновлено.", text)
+
+
+class TestArticleBackends(unittest.TestCase):
+    def read_page(self, path):
+        with open(os.path.join(PAGES_DIR, path), "rb") as f:
+            return f.read()
+
+    def test_backends_agree(self):
+        for path in [
+            "sport/news/2024/05/22/23074501.shtml",
+            "army/news/2024/05/22/23074423.shtml",
+        ]:
+            html = self.read_page(path)
+            results = [parse_article(path, html, backend) for backend in BACKENDS]
+            self.assertTrue(all(result == results[0] for result in results), path)
+            self.assertNotIn("  ", results[0]["text"])
+
+    def test_str_and_bytes_input(self):
+        html = self.read_page("style/news/2024/05/22/23074471.shtml")
+        self.assertEqual(
+            parse_article("style", html), parse_article("style", html.decode("utf-8"))
+        )
+
+    def test_bytes_without_meta_charset(self):
+        html = self.read_page("style/news/2024/05/22/23074471.shtml").decode("utf-8")
+        expected = parse_article("style", html)
+        raw = re.sub(r"<meta[^>]*charset[^>]*>", "", html, flags=re.I).encode("utf-8")
+        for backend in BACKENDS:
+            self.assertEqual(parse_article("style", raw, backend), expected, backend)
+
+        # Charset из заголовка ответа важнее угадывания
+        raw = raw.decode("utf-8").encode("cp1251", errors="ignore")
+        page = requests.models.Response()
+        page._content = raw
+        page.headers["Content-Type"] = "text/html; charset=windows-1251"
+        self.assertEqual(parse_page("style", page)["text"], expected["text"])
+
+    @patch("builtins.print")
+    def test_missing_article_text(self, mocked_print):
+        html = self.read_page("news/index.html")
+        for backend in BACKENDS:
+            self.assertIsNone(parse_article("listing", html, backend))
+        mocked_print.assert_called_with("Ошибка парсинга")
+
+
+class TestSinks(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.row = {"link": "https://example.com", "text": "Текст", "date": "2024-05-22 12:00:00"}
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def path(self, name):
+        return os.path.join(self.tmp_dir.name, name)
+
+    def test_write_to_csv_skips_failed_pages(self):
+        write_to_csv([self.row, None, self.row], self.path("output.csv"))
+        with open(self.path("output.csv"), encoding="utf-8") as f:
+            self.assertEqual(len(f.read().splitlines()), 3)
+
+    def test_csv_append_writes_header_once(self):
+        for _ in range(2):
+            with open_sink(self.path("output.csv"), append=True) as sink:
+                sink.write(self.row)
+        with open(self.path("output.csv"), encoding="utf-8") as f:
+            self.assertEqual(f.read().splitlines()[0], "Ссылка,Текст,Дата")
+            f.seek(0)
+            self.assertEqual(len(f.read().splitlines()), 3)
+
+    def test_gzip_jsonl(self):
+        with open_sink(self.path("output.jsonl.gz")) as sink:
+            sink.write(self.row)
+            sink.write(None)
+        with gzip.open(self.path("output.jsonl.gz"), "rt", encoding="utf-8") as f:
+            self.assertEqual([json.loads(line) for line in f], [self.row])
+
+    def test_rows_are_flushed_before_close(self):
+        sink = open_sink(self.path("output.jsonl"), flush_every=1, fsync=True)
+        sink.write(self.row)
+        with open(self.path("output.jsonl"), encoding="utf-8") as f:
+            self.assertEqual(len(f.read().splitlines()), 1)
+        sink.close()
+
+
+class TestHostRateLimiter(unittest.TestCase):
+    def test_rate_limit_per_host(self):
+        limiter = HostRateLimiter(rate=20)
+        start = time.monotonic()
+        for _ in range(5):
+            limiter.wait("http://a.example/page")
+            limiter.wait("http://b.example/page")
+        # 5 запросов к каждому хосту при 20 rps - не меньше 0.2 с
+        self.assertGreaterEqual(time.monotonic() - start, 0.19)
+
+
+class TestCrawlMetrics(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server, cls.base_url = start_server()
+
+    @classmethod
+    def tearDownClass(cls):
+        stop_server(cls.server)
+
+    def setUp(self):
+        metrics.reset()
+        metrics.enable()
+
+    def tearDown(self):
+        metrics.disable()
+        metrics.reset()
+
+    def counter(self, name):
+        return sum(row["value"] for row in metrics.snapshot()["counters"] if row["name"] == name)
+
+    def test_http_and_parse_metrics(self):
+        links = [self.base_url + "/sport/news/2024/05/22/23074501.shtml"] * 3
+        list(parse_links(links, max_workers=2, host_rate=0))
+        timers = {row["name"]: row for row in metrics.snapshot()["timers"]}
+        self.assertEqual(timers["http_request"]["labels"], {"status": 200})
+        self.assertEqual(timers["http_request"]["count"], 3)
+        self.assertEqual(timers["fetch_task"]["count"], 3)
+        self.assertEqual(self.counter("articles"), 3)
+        self.assertGreater(self.counter("http_bytes"), 0)
+
+        text = metrics.to_prometheus()
+        self.assertIn('autosystems_http_request_seconds_count{status="200"} 3', text)
+        self.assertIn("autosystems_articles_total 3", text)
+
+    def test_disabled_metrics_record_nothing(self):
+        metrics.disable()
+        list(parse_links([self.base_url + "/sport/news/2024/05/22/23074501.shtml"]))
+        self.assertEqual(metrics.snapshot(), {"counters": [], "timers": []})
+
+
+class TestCrawlScheduler(unittest.TestCase):
+    def setUp(self):
+        metrics.reset()
+        metrics.enable()
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.servers = []
+
+    def tearDown(self):
+        metrics.disable()
+        metrics.reset()
+        for server in self.servers:
+            stop_server(server)
+        self.tmp_dir.cleanup()
+
+    def serve(self, *plan, match=None, slow_latency=1.0):
+        server, base_url = start_server(faults=Faults(plan, slow_latency, match))
+        self.servers.append(server)
+        return base_url
+
+    def scheduler(self, **options):
+        options = {"host_rate": 0, "rate": 0, "timeout": (1.0, 0.3), "backoff": 0.01, **options}
+        return CrawlScheduler(**options)
+
+    def retries(self):
+        return {
+            row["labels"]["reason"]: row["value"]
+            for row in metrics.snapshot()["counters"]
+            if row["name"] == "http_retries"
+        }
+
+    @patch("builtins.print")
+    def test_transient_failures_are_retried(self, mocked_print):
+        base_url = self.serve(503, "drop", "slow", slow_latency=0.6)
+        scheduler = self.scheduler()
+        urls = article_urls(base_url, 3)
+        results = list(parse_links(urls, scheduler=scheduler))
+        self.assertEqual(sorted(row["link"] for row in results), sorted(urls))
+        self.assertEqual(scheduler.failed, [])
+        self.assertEqual(self.retries(), {"503": 3, "ConnectionError": 3, "ReadTimeout": 3})
+
+    @patch("builtins.print")
+    def test_gives_up_after_max_retries(self, mocked_print):
+        base_url = self.serve(*[500] * 5, match="n=1")
+        scheduler = self.scheduler(max_retries=2)
+        urls = article_urls(base_url, 3)
+        results = list(parse_links(urls, scheduler=scheduler))
+        self.assertEqual(len(results), 3)
+        self.assertEqual(results.count(None), 1)
+        self.assertEqual(scheduler.failed, [urls[1]])
+        self.assertEqual(self.retries(), {"500": 2})
+        self.assertEqual(self.counter("http_failures"), 1)
+
+    def counter(self, name):
+        return sum(row["value"] for row in metrics.snapshot()["counters"] if row["name"] == name)
+
+    def test_waiting_retry_does_not_block_workers(self):
+        base_url = self.serve(503, match="n=0")
+        scheduler = self.scheduler(max_workers=1, backoff=0.4, max_retries=1)
+        urls = article_urls(base_url, 4)
+        with patch("scheduler.random.uniform", side_effect=lambda low, high: high):
+            links = [row["link"] for row in scheduler.run(urls, parse_page)]
+        # Пока первая статья ждет повтора, единственный поток успевает скачать остальные
+        self.assertEqual(links, urls[1:] + urls[:1])
+
+    def test_not_modified_and_client_errors_are_not_retried(self):
+        base_url = self.serve(404)
+        scheduler = self.scheduler()
+        statuses = list(scheduler.run(article_urls(base_url, 2), lambda url, page: page.status_code))
+        self.assertEqual(statuses, [404, 404])
+        self.assertEqual(self.retries(), {})
+
+    @patch("builtins.print")
+    def test_listing_is_retried(self, mocked_print):
+        base_url = self.serve(503, 502, match="?listing")
+        output = os.path.join(self.tmp_dir.name, "output.csv")
+        written = parse(base_url + "/news/?listing", output=output, scheduler=self.scheduler())
+        self.assertEqual(written, 4)
+        self.assertEqual(self.retries(), {"503": 1, "502": 1})
+
+    def test_connect_timeout_is_a_failure(self):
+        # Порт из диапазона TEST-NET не отвечает: ждать дольше connect-тайм-аута нельзя
+        scheduler = self.scheduler(timeout=(0.2, 0.2), max_retries=1)
+        start = time.monotonic()
+        with patch("builtins.print"):
+            results = list(scheduler.run(["http://192.0.2.1:81/"], parse_page))
+        self.assertEqual(results, [None])
+        self.assertLess(time.monotonic() - start, 3)
+
+    @patch("builtins.print")
+    def test_bad_links_do_not_abort_run(self, mocked_print):
+        base_url = self.serve()
+        urls = ["mailto:someone@example.com", "http://", *article_urls(base_url, 2)]
+        scheduler = self.scheduler()
+        results = list(scheduler.run(urls, parse_page))
+        self.assertEqual(len(results), 4)
+        self.assertEqual(sum(result is not None for result in results), 2)
+        self.assertEqual(sorted(scheduler.failed), sorted(urls[:2]))
+        self.assertEqual(self.retries(), {})
+
+        # Исключение в обработчике - тоже отказ одного адреса, а не всего обхода
+        results = list(scheduler.run(urls[2:], lambda url, page: 1 / 0))
+        self.assertEqual(results, [None, None])
+
+    @patch("builtins.print")
+    def test_long_retry_after_gives_up(self, mocked_print):
+        class Session:
+            calls = 0
+
+            def get(self, url, **kwargs):
+                Session.calls += 1
+                response = requests.models.Response()
+                response.status_code = 503
+                response.headers["Retry-After"] = "86400"
+                return response
+
+        scheduler = self.scheduler(session=Session(), max_backoff=5)
+        start = time.monotonic()
+        self.assertEqual(list(scheduler.run(["http://example.test/a"], parse_page)), [None])
+        with self.assertRaises(RetryableStatus):
+            scheduler.get("http://example.test/b")
+        self.assertLess(time.monotonic() - start, 1)
+        self.assertEqual(Session.calls, 2)
+        self.assertEqual(scheduler.failed, ["http://example.test/a", "http://example.test/b"])
+
+    def test_global_rate_budget(self):
+        budget = RateBudget(rate=20)
+        start = time.monotonic()
+        for _ in range(5):
+            budget.wait()
+        self.assertGreaterEqual(time.monotonic() - start, 0.19)
+
+    def test_backoff_delay(self):
+        for attempt in range(8):
+            delay = backoff_delay(attempt, base=0.5, cap=4)
+            self.assertGreaterEqual(delay, 0)
+            self.assertLessEqual(delay, min(4, 0.5 * 2**attempt))
+
+        class Response:
+            headers = {"Retry-After": "7"}
+
+        self.assertEqual(retry_after(RetryableStatus(response=Response())), 7.0)
+        self.assertEqual(retry_after(RetryableStatus()), 0.0)
+
+
+class TestSectionCrawl(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp_dir = tempfile.TemporaryDirectory()
+        cls.articles = make_mirror(cls.tmp_dir.name, pages=3, per_page=4)
+        cls.server, cls.base_url = start_server(cls.tmp_dir.name)
+
+    @classmethod
+    def tearDownClass(cls):
+        stop_server(cls.server)
+        cls.tmp_dir.cleanup()
+
+    def setUp(self):
+        self.output = os.path.join(self.tmp_dir.name, "output.jsonl")
+
+    def tearDown(self):
+        if os.path.exists(self.output):
+            os.remove(self.output)
+
+    def crawl(self, **options):
+        scheduler = CrawlScheduler(max_workers=4, host_rate=0, rate=0)
+        with patch("builtins.print"):
+            written = crawl(self.base_url, output=self.output, scheduler=scheduler, **options)
+        with open(self.output, encoding="utf-8") as f:
+            rows = [json.loads(line) for line in f]
+        self.assertEqual(len(rows), written)
+        return rows
+
+    def links(self, sections, count):
+        return sorted(self.base_url + path for section in sections for path in self.articles[section][:count])
+
+    def test_all_sections_and_pages(self):
+        rows = self.crawl()
+        self.assertEqual(sorted(row["link"] for row in rows), self.links(SECTIONS, 12))
+        self.assertTrue(all(row["text"] for row in rows))
+
+    def test_depth_limits_listing_pages(self):
+        rows = self.crawl(sections=("sport", "army"), max_pages=2)
+        # Перепосты из соседних разделов на страницах 1-2 тоже попадают в обход
+        expected = set(self.links(("sport", "army"), 8))
+        expected |= {self.base_url + self.articles["style"][0], self.base_url + self.articles["style"][4]}
+        self.assertEqual({row["link"] for row in rows}, expected)
+
+    def test_date_window(self):
+        since = datetime.datetime(2024, 5, 22, 21, 30)
+        until = datetime.datetime(2024, 5, 22, 22, 30)
+        with patch("frontier.parse_listing_page", wraps=parse_listing_page) as listing:
+            rows = self.crawl(since=since, until=until)
+        self.assertTrue(all(since <= datetime.datetime.fromisoformat(row["date"]) <= until for row in rows))
+        self.assertEqual(len(rows), 3 * len(SECTIONS))
+        # Вторая страница уже целиком старше окна, третья не запрашивается
+        self.assertEqual(listing.call_count, 2 * len(SECTIONS))
+
+    def test_bloom_filter_dedup(self):
+        rows = self.crawl(bloom=True)
+        self.assertEqual(len(rows), 12 * len(SECTIONS))
+        self.assertEqual(len({row["link"] for row in rows}), len(rows))
+
+    def test_bloom_filter(self):
+        bloom = BloomFilter(capacity=10000, error_rate=0.01)
+        urls = [f"https://www.gazeta.ru/news/{num}.shtml" for num in range(10000)]
+        self.assertTrue(all(bloom.add(url) for url in urls[:100]))
+        for url in urls[100:]:
+            bloom.add(url)
+        self.assertTrue(all(url in bloom for url in urls))
+        false_positives = sum(f"https://www.gazeta.ru/other/{num}" in bloom for num in range(10000))
+        self.assertLess(false_positives, 200)
+        self.assertLess(len(bloom.bits), 12500)
+
+    def test_near_duplicates_skipped(self):
+        # В зеркале статьи раздела - одна страница с разными заголовками
+        index_path = os.path.join(self.tmp_dir.name, "near.sqlite3")
+        rows = self.crawl(dedup=index_path)
+        self.assertEqual({row["link"].split("/")[3] for row in rows}, set(SECTIONS))
+        self.assertLess(len(rows), 12 * len(SECTIONS) / 2)
+        # Повторный обход: статья не дубликат своей прошлой версии по тому же адресу,
+        # остальные статьи раздела по-прежнему отсекаются
+        again = self.crawl(dedup=index_path)
+        self.assertEqual({row["link"] for row in again}, {row["link"] for row in rows})
+        index = NearDuplicateIndex(index_path)
+        self.assertEqual(len(index), len(rows))
+        index.close()
+
+    def test_normalize_url(self):
+        self.assertEqual(
+            normalize_url("HTTPS://WWW.Gazeta.ru/sport/news/1.shtml#comments"),
+            "https://www.gazeta.ru/sport/news/1.shtml",
+        )
+
+
+class TestNearDuplicateIndex(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, "near.sqlite3")
+        self.index = NearDuplicateIndex(self.path)
+        words = [f"слово{num % 97}_{num % 13}" for num in range(400)]
+        self.text = " ".join(words)
+        # Перепечатка: другой заголовок и пара поправленных фраз
+        self.edited = "Срочно: " + " ".join(words[:150] + ["уточнение", "редакции"] + words[155:])
+        self.other = " ".join(f"другое{num % 89}_{num % 7}" for num in range(400))
+
+    def tearDown(self):
+        self.index.close()
+        self.tmp_dir.cleanup()
+
+    def test_edited_copy_is_duplicate(self):
+        self.assertIsNone(self.index.add("a", self.text))
+        match = self.index.add("b", self.edited)
+        self.assertEqual(match["name"], "a")
+        self.assertGreater(match["similarity"], 0.8)
+        self.assertIsNone(self.index.add("c", self.other))
+        # Дубликаты в индекс не попадают
+        self.assertEqual(len(self.index), 2)
+        self.assertEqual(self.index.duplicates, 1)
+
+    def test_index_is_persisted(self):
+        self.index.add("a", self.text)
+        self.index.close()
+        self.index = NearDuplicateIndex(self.path)
+        self.assertEqual([match["name"] for match in self.index.query(self.edited)], ["a"])
+        self.assertEqual(self.index.query(self.other), [])
+
+    def test_parameters_must_match(self):
+        with self.assertRaises(ValueError):
+            NearDuplicateIndex(self.path, num_perm=64, bands=16)
+
+    def test_empty_text(self):
+        self.assertIsNone(minhash("  ...  "))
+        self.assertIsNone(self.index.add("empty", ""))
+        self.assertEqual(len(self.index), 0)
+
+
 if __name__ == "__main__":
     unittest.main()